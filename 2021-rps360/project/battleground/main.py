@@ -2,6 +2,7 @@
 Client program to instantiate a player class and 
 conduct a game of Chexers through the online battleground
 """
+import os
 import logging
 
 from referee.log import config, print, _print, comment
@@ -11,7 +12,7 @@ from referee.player import PlayerWrapper, set_space_line
 from battleground.options import get_options
 from battleground.protocol import Connection as Server, ConnectingException
 from battleground.protocol import MessageType as M, ProtocolException
-from battleground.protocol import DisconnectException
+from battleground.protocol import DisconnectException, BINARY_FRAMING
 
 
 def main():
@@ -37,22 +38,36 @@ def main():
         # may still be useful for some users
         set_space_line()
 
-        # Play the game, catching any errors and displaying them to the
+        # Play the games (all over the same connection, and with the same
+        # player class), catching any errors and displaying them to the
         # user:
-        result = connect_and_play(
-            player=player,
-            name=options.name,
-            channel=options.channel,
-            host=options.host,
-            port=options.port,
-            log_filename=options.logfile,
-            print_state=(options.verbosity > 1),
-            use_debugboard=(options.verbosity > 2),
-            use_colour=options.use_colour,
-            use_unicode=options.use_unicode,
-        )
-        comment("game over!", depth=-1)
-        print(result)
+        server = connect(options.host, options.port)
+        for i in range(options.games):
+            if options.games > 1:
+                comment(f"game {i + 1} of {options.games}", depth=-1)
+            try:
+                result = play_game(
+                    server=server,
+                    player=player,
+                    name=options.name,
+                    channel=options.channel,
+                    games=options.games - i,
+                    log_filename=_numbered(options.logfile, i, options.games),
+                    print_state=(options.verbosity > 1),
+                    use_debugboard=(options.verbosity > 2),
+                    use_colour=options.use_colour,
+                    use_unicode=options.use_unicode,
+                )
+            except ServerEncounteredError as e:
+                # (if the server still has us, we can play the next game;
+                # if it has hung up, there are no more games to play)
+                if i == options.games - 1 or server.hung_up():
+                    raise
+                print("server encountered error!", depth=-1)
+                comment(e)
+                continue
+            comment("game over!", depth=-1)
+            print(result)
     except KeyboardInterrupt:
         _print()  # (end the line)
         comment("bye!")
@@ -72,12 +87,33 @@ def main():
     # itself? Then, a traceback will be more helpful.
 
 
-def connect_and_play(
+def connect_and_play(player, name, channel, host, port, **kwargs):
+    """
+    Connect to and coordinate a game with a server, return a string describing
+    the result. See play_game for the parameters ('host' and 'port' are the
+    server's address and port).
+    """
+    server = connect(host, port)
+    return play_game(server, player, name, channel, **kwargs)
+
+
+def connect(host, port):
+    """
+    Connect to the server at 'host':'port', return the connection.
+    """
+    comment("connecting to battleground", depth=-1)
+    comment("attempting to connect to the server...")
+    server = Server.from_address(host, port)
+    comment("connection established!")
+    return server
+
+
+def play_game(
+    server,
     player,
     name,
     channel,
-    host,
-    port,
+    games=None,
     log_filename=None,
     out_function=None,
     print_state=True,
@@ -86,16 +122,18 @@ def connect_and_play(
     use_unicode=False,
 ):
     """
-    Connect to and coordinate a game with a server, return a string describing
-    the result.
+    Coordinate a game with a server, return a string describing the result.
+    Afterwards, another game can be played over the same connection (by
+    calling this function again).
 
     Parameters:
+    * server         -- The connection to the server (see connect).
     * player         -- Your player's wrapped object (supporting 'init',
                         'update' and 'action' methods).
     * name           -- Your player's name on the server
     * channel        -- The matchmaking channel string
-    * host           -- The server address
-    * port           -- The server port
+    * games          -- If not None, tell the server how many games (including
+                        this one) you will play (for tournament channels).
     * log_filename   -- If not None, log all game actions to this path.
     * print_state    -- If True, print a picture of the board after each
                         update.
@@ -125,27 +163,39 @@ def connect_and_play(
         def display_state(players_str, game):
             pass
 
-    # Set up a connection with the server
-    comment("connecting to battleground", depth=-1)
-    comment("attempting to connect to the server...")
-    server = Server.from_address(host, port)
-    comment("connection established!")
-
     # Wait for some matching players
     comment("looking for a game", depth=-1)
     channel_str = f"channel '{channel}'" if channel else "open channel"
     comment(f"submitting game request as '{name}' in {channel_str}...")
-    server.send(M.PLAY, name=name, channel=channel)
-    server.recv(M.OKAY)
+    playmsg = {"name": name, "channel": channel}
+    if games is not None:
+        playmsg["games"] = games
+    if server.framing != BINARY_FRAMING:
+        # (ask for the more compact framing; servers that don't know it
+        # will just ignore us, and carry on in JSON)
+        playmsg["framing"] = BINARY_FRAMING
+    # (and for pipelined turns, which such servers will likewise ignore: see
+    # the TURN messages below)
+    playmsg["pipelined"] = True
+    server.send(M.PLAY, **playmsg)
+    # (or an ERRO message, if the server won't have us right now)
+    okaymsg = server.recv(M.OKAY | M.ERRO)
+    if okaymsg["mtype"] is M.ERRO:
+        raise ServerEncounteredError(okaymsg["reason"])
+    if okaymsg.get("framing") == BINARY_FRAMING:
+        server.set_framing(BINARY_FRAMING)
     comment("game request submitted.")
     comment(f"waiting for opponents in {channel_str}...")
     comment("(press ^C to stop waiting)")
     # (wait through some OKAY-OKAY msg exchanges until a GAME message comes---
     # the server is asking if we are still here waiting, or have disconnected)
-    gamemsg = server.recv(M.OKAY | M.GAME)
+    # (or an ERRO message, if the server gives up on finding us a game)
+    gamemsg = server.recv(M.OKAY | M.GAME | M.ERRO)
     while gamemsg["mtype"] is not M.GAME:
+        if gamemsg["mtype"] is M.ERRO:
+            raise ServerEncounteredError(gamemsg["reason"])
         server.send(M.OKAY)
-        gamemsg = server.recv(M.OKAY | M.GAME)
+        gamemsg = server.recv(M.OKAY | M.GAME | M.ERRO)
     # when we get a game message, it's time to play!
     comment("setting up game", depth=-1, clear=True)
     comment("opponents found!")
@@ -168,10 +218,33 @@ def connect_and_play(
     game = Game(log_filename)
     display_state(players_str, game)
 
+    def update(msg):
+        player_action = msg["player_action"]
+        opponent_action = msg["opponent_action"]
+        comment("receiving update", depth=-1, clear=True)
+        if player.colour == "upper":
+            game.update(
+                upper_action=player_action,
+                lower_action=opponent_action,
+            )
+        else:
+            game.update(
+                upper_action=opponent_action,
+                lower_action=player_action,
+            )
+        display_state(players_str, game)
+        player.update(
+            player_action=player_action,
+            opponent_action=opponent_action,
+        )
+
     # Now wait for messages from the sever and respond accordingly
     while True:
         msg = server.recv(M.TURN | M.UPD8 | M.OVER | M.ERRO)
         if msg["mtype"] is M.TURN:
+            # with pipelined turns, the previous turn's update comes first
+            if "player_action" in msg:
+                update(msg)
             # TODO: For simultaneous play, there's no need to display the
             # state again at the start of the turn...
             # comment("your turn!", depth=-1, clear=True)
@@ -181,24 +254,7 @@ def connect_and_play(
             server.send(M.ACTN, action=action)
 
         elif msg["mtype"] is M.UPD8:
-            player_action = msg["player_action"]
-            opponent_action = msg["opponent_action"]
-            comment("receiving update", depth=-1, clear=True)
-            if player.colour == "upper":
-                game.update(
-                    upper_action=player_action,
-                    lower_action=opponent_action,
-                )
-            else:
-                game.update(
-                    upper_action=opponent_action,
-                    lower_action=player_action,
-                )
-            display_state(players_str, game)
-            player.update(
-                player_action=player_action,
-                opponent_action=opponent_action,
-            )
+            update(msg)
             # then notify server we are ready to continue:
             server.send(M.OKAY)
 
@@ -212,6 +268,14 @@ def connect_and_play(
             raise ServerEncounteredError(msg["reason"])
 
 
+def _numbered(log_filename, i, ngames):
+    # (when playing several games, log game i to e.g. 'battle-{i+1}.log')
+    if log_filename is None or ngames == 1:
+        return log_filename
+    root, ext = os.path.splitext(log_filename)
+    return f"{root}-{i + 1}{ext}"
+
+
 def format_players_str(gamemsg, your_colour):
     players = []
     for colour, name in gamemsg.items():
@@ -3,8 +3,8 @@ Provide a command-line argument parsing function using argparse
 (resulting in the following help message):
 
 -----------------------------------------------------------------------------
-usage: battleground [-h] [-V] [-H HOST] [-P PORT] [-D | -v [{0,1,2,3}]]
-                    [-l [LOGFILE]] [-c | -C] [-u | -a]
+usage: battleground [-h] [-V] [-H HOST] [-P PORT] [-g GAMES]
+                    [-D | -v [{0,1,2,3}]] [-l [LOGFILE]] [-c | -C] [-u | -a]
                     player name [channel]
 
 play against your classmates on the online battleground!
@@ -22,6 +22,9 @@ optional arguments:
   -V, --version         show program's version number and exit
   -H HOST, --host HOST  address of server (leave blank for default)
   -P PORT, --port PORT  port to contact server on (leave blank for default)
+  -g GAMES, --games GAMES
+                        number of games to play, one after another over the
+                        same connection (default: 1)
   -D, --debug           switch to printing the debug board (with
                         coordinates) (equivalent to -v or -v3)
   -v [{0,1,2,3}], --verbosity [{0,1,2,3}]
@@ -71,6 +74,8 @@ HOST_DEFAULT = "ai.far.in.net"
 
 CHANNEL_DEFAULT = ""
 
+GAMES_DEFAULT = 1
+
 VERBOSITY_LEVELS = 4
 VERBOSITY_DEFAULT = 2  # normal level, normal board
 VERBOSITY_NOVALUE = 3  # highest level, debug board
@@ -144,6 +149,14 @@ def get_options():
         default=PORT_DEFAULT,
         help="port to contact server on (leave blank for default)",
     )
+    optionals.add_argument(
+        "-g",
+        "--games",
+        type=int,
+        default=GAMES_DEFAULT,
+        help="number of games to play, one after another over the same "
+        "connection (default: %(default)s)",
+    )
 
     verbosity_group = optionals.add_mutually_exclusive_group()
     verbosity_group.add_argument(
@@ -4,7 +4,21 @@ Adversary Server Connection Interface protocol (the 'ROPASCI' protocol).
 
 This module provides a convenient Connection class to manage a ROPASCI
 connection and MessageType flag enum to easily work with the various
-ROPASCI message types.
+ROPASCI message types. AsyncConnection provides the same interface (with
+coroutine methods) over asyncio streams.
+
+Messages are framed as lines of JSON by default. A client may ask for the
+more compact binary framing instead, by sending framing="binary" in its PLAY
+message; if the server agrees, its OKAY reply also says framing="binary",
+and both parties then switch to binary framing (see set_framing) for the
+rest of the connection. In binary framing, each message is a frame made of
+a 2-byte (big-endian) length, followed by that many bytes: a 1-byte message
+type code (see MessageType.code), and the message's payload. The payloads
+of the messages sent every turn (OKAY, TURN, INIT, ACTN and UPD8) are packed
+into a few bytes each, with each action packed into 3 bytes (see
+_pack_action). Other messages, and any message whose payload doesn't fit
+the packed format (e.g. a malformed action), carry their payload as JSON,
+flagged by the type code's top bit (FRAME_JSON).
 
 Example usage:
 
@@ -12,9 +26,9 @@ Example usage:
     >>> server = Connection.from_address('ai.far.in.net', 12360)
     >>> server.send(M.PLAY, name="rock_first", channel="amateur_hour")
     >>> server.recv(M.OKAY)
-    { 'mtype': <MessageType.OKAY [000000001]> }
+    { 'mtype': <MessageType.OKAY [0000000001]> }
     >>> server.recv(M.OKAY|M.GAME)
-    { 'mtype': <MessageType.GAME [000001000]>
+    { 'mtype': <MessageType.GAME [0000001000]>
     , 'upper': 'rock_first'
     , 'lower': 'rock_and_roll'
     }
@@ -22,7 +36,11 @@ Example usage:
 """
 
 import json
+import time
 import socket
+import struct
+import asyncio
+import selectors
 from enum import Flag as FlagEnum
 
 
@@ -33,18 +51,31 @@ DEFAULT_SERVER_PORT = 12360
 # Print messages while sending and receiving messages?
 _NET_DEBUG = False
 
+# The ways of framing messages (see above)
+JSON_FRAMING = "json"
+BINARY_FRAMING = "binary"
+
+# The binary frame header (length), and the flag (in the type code) for a
+# payload in JSON
+FRAME_HEADER = struct.Struct(">H")
+FRAME_JSON = 0x80
+
+# How much to read from a socket at once (bytes)
+_RECV_SIZE = 65536
+
 
 class MessageType(FlagEnum):
     # The different protocol message types:
-    OKAY = 0b000000001
-    ERRO = 0b000000010
-    PLAY = 0b000000100
-    GAME = 0b000001000
-    INIT = 0b000010000
-    TURN = 0b000100000
-    ACTN = 0b001000000
-    UPD8 = 0b010000000
-    OVER = 0b100000000
+    OKAY = 0b0000000001
+    ERRO = 0b0000000010
+    PLAY = 0b0000000100
+    GAME = 0b0000001000
+    INIT = 0b0000010000
+    TURN = 0b0000100000
+    ACTN = 0b0001000000
+    UPD8 = 0b0010000000
+    OVER = 0b0100000000
+    SPEC = 0b1000000000
 
     @staticmethod
     def any():
@@ -59,30 +90,28 @@ class MessageType(FlagEnum):
             | MessageType.ACTN
             | MessageType.UPD8
             | MessageType.OVER
+            | MessageType.SPEC
         )
         return msgtypes
 
     @staticmethod
     def from_name(name):
-        names = {
-            "OKAY": MessageType.OKAY,
-            "ERRO": MessageType.ERRO,
-            "PLAY": MessageType.PLAY,
-            "GAME": MessageType.GAME,
-            "INIT": MessageType.INIT,
-            "TURN": MessageType.TURN,
-            "ACTN": MessageType.ACTN,
-            "UPD8": MessageType.UPD8,
-            "OVER": MessageType.OVER,
-        }
         try:
-            msgtype = names[name]
-            return msgtype
-        except KeyError:
+            return _MTYPES_BY_NAME[name]
+        except (KeyError, TypeError):
             raise ValueError(f"Invalid flag name {name}")
 
+    @property
+    def code(self):
+        """the type's code in binary framing (its flag's bit position)"""
+        return self.value.bit_length() - 1
+
     def __repr__(self):
-        return f"<{str(self)} [{self.value:09b}]>"
+        return f"<{str(self)} [{self.value:010b}]>"
+
+
+# (built once, for MessageType.from_name)
+_MTYPES_BY_NAME = {mtype.name: mtype for mtype in MessageType}
 
 
 class Connection:
@@ -135,7 +164,36 @@ class Connection:
         and don't use the socket directly anymore.
         """
         self.socket = sock
-        self.socketf = sock.makefile("rb")  # for line-based reading
+        self.framing = JSON_FRAMING
+        # bytes received, but not yet taken as (whole) messages
+        self._buffer = bytearray()
+        # for waiting on the socket with a timeout (made when first needed)
+        self._selector = None
+
+    def set_framing(self, framing):
+        """
+        Switch to framing messages with 'framing' (JSON_FRAMING or
+        BINARY_FRAMING), for all messages sent and received from now on.
+        Only do this as agreed with the other party (see above).
+        """
+        if framing not in (JSON_FRAMING, BINARY_FRAMING):
+            raise ValueError(f"Unknown framing {framing!r}")
+        self.framing = framing
+
+    def hung_up(self):
+        """
+        Return True if the other party has hung up (or the connection has
+        failed), as far as we have seen so far, without waiting and without
+        taking any messages.
+        """
+        if self._buffer:
+            return False  # (there are still messages from them to read)
+        if not self._wait(0):
+            return False
+        try:
+            return not self.socket.recv(1, socket.MSG_PEEK)
+        except ConnectionResetError:
+            return True
 
     def disconnect(self):
         """
@@ -144,7 +202,8 @@ class Connection:
         Do NOT call any other methods after this one, on this connection
         or the socket!
         """
-        self.socketf.close()
+        if self._selector is not None:
+            self._selector.close()
         self.socket.close()
 
     def send(self, mtype, **margs):
@@ -156,6 +215,9 @@ class Connection:
             raise ValueError(
                 f"Unnamed MessageType {mtype} not valid for send()"
             )
+        if self.framing == BINARY_FRAMING:
+            self._send_frame(_encode_binary(mtype, margs))
+            return
         # convert mtype to a string, e.g. 'ACTN', for sending:
         margs["mtype"] = mtype.name
         self._send(**margs)
@@ -168,84 +230,658 @@ class Connection:
 
         This method blocks until a message is recv'd, unless 'timeout' is
         specified, in which case it will wait up to 'timeout' (float) seconds.
+        A timeout does not consume any partially-received message (the
+        connection can still be used afterwards).
 
         Use '|' to combine message types to allow multiple types of messages
         to be accepted, for example:
             c.recv(MessageType.ACTN|MessageType.UPD8).
         """
-        msg = self._recv(timeout=timeout)
-        # convert mtype back to a MessageType, e.g. MessageType.ACTN:
-        try:
-            msg["mtype"] = MessageType.from_name(msg["mtype"])
-        except ValueError:
-            raise ProtocolException(f"Unknown message type {msg['mtype']}!")
-        if not (mtype & msg["mtype"]):
-            # recvd message type was not expected!
-            raise ProtocolException(f"Unexpected {msg['mtype']} message!")
-        return msg
+        if self.framing == BINARY_FRAMING:
+            msg = self._recv_frame(timeout=timeout)
+        else:
+            msg = self._recv(timeout=timeout)
+        return _expect_mtype(msg, mtype)
 
     def _send(self, **msg):
-        string = json.dumps(msg, indent=None, separators=(",", ":"))
-        line = f"{string}\n".encode()
+        self._send_frame(_encode(msg))
+
+    def _send_frame(self, frame):
         if _NET_DEBUG:
-            print("SENDING:", repr(line))
-        self.socket.sendall(line)
+            print("SENDING:", repr(frame))
+        try:
+            self.socket.sendall(frame)
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise DisconnectException(f"Connection error! {e}")
         if _NET_DEBUG:
             print("SENT!")
 
     def _recv(self, timeout=None):
+        return _decode(self._read(_split_line, timeout))
+
+    def _recv_frame(self, timeout=None):
+        return _decode_binary(self._read(_split_frame, timeout))
+
+    def _read(self, split, timeout):
+        # (receive into the buffer until it begins with a whole message, as
+        # found by 'split', and then take that message from the buffer; with
+        # a timeout, wait for the socket with a selector, until the deadline,
+        # rather than setting a timeout on the socket itself, so that timing
+        # out is cheap, and leaves any partial message in the buffer)
         if _NET_DEBUG:
             print("RECVING...")
-        self.socket.settimeout(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            found = split(self._buffer)
+            if found is not None:
+                start, end = found
+                data = bytes(self._buffer[start:end])
+                del self._buffer[:end]
+                break
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+                if not self._wait(remaining):
+                    raise TimeoutException("Timeout exceeded! Assuming lost.")
+            try:
+                chunk = self.socket.recv(_RECV_SIZE)
+            except ConnectionResetError as e:
+                raise DisconnectException(f"Connection error! {e}")
+            if not chunk:
+                data = b""  # (the connection has closed)
+                break
+            self._buffer += chunk
+        if _NET_DEBUG:
+            print("RECV'D:", repr(data))
+        if not data:
+            raise DisconnectException("Connection lost!")
+        return data
+
+    def _wait(self, timeout):
+        # (wait up to 'timeout' seconds for the socket to be readable, and
+        # return whether it is)
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.socket, selectors.EVENT_READ)
+        return bool(self._selector.select(timeout))
+
+
+class AsyncConnection:
+    """
+    A ROPASCI connection over asyncio streams. Messages are framed and
+    encoded exactly as for Connection, and the methods mirror Connection's
+    methods, except that send, recv and disconnect are coroutines.
+    """
+
+    @staticmethod
+    async def from_address(host, port):
+        """
+        Create and return a TCP-based connection to another host (at
+        'host':'port') to be used with this protocol.
+
+        Raises a ConnectingException if there is any issue establishing the
+        connection (see Connection.from_address).
+        """
         try:
-            line = self.socketf.readline()
-        except socket.timeout:
-            raise DisconnectException("Timeout exceeded! Assuming lost.")
-        except ConnectionResetError as e:
+            reader, writer = await asyncio.open_connection(host, port)
+        except (
+            ConnectionRefusedError,
+            ConnectionAbortedError,
+            socket.gaierror,
+            socket.herror,
+        ) as e:
+            raise ConnectingException(str(e))
+        return AsyncConnection(reader, writer)
+
+    @staticmethod
+    async def from_socket(sock):
+        """
+        Create and return a connection using an already-connected socket
+        (e.g. one passed from another process).
+        """
+        reader, writer = await asyncio.open_connection(sock=sock)
+        return AsyncConnection(reader, writer)
+
+    @staticmethod
+    async def start_server(
+        handler, host, port, reuse_port=False, keepalive=None
+    ):
+        """
+        Bind on and listen to a server socket on 'port' (and 'host', which
+        should probably be "" to allow all incoming connections). For each
+        incoming connection, the coroutine function 'handler' is called with
+        a new AsyncConnection and the address of the client.
+
+        If 'reuse_port' is True, several processes may listen on the same
+        port at once (with SO_REUSEPORT; the kernel shares out incoming
+        connections between them).
+
+        If 'keepalive' is not None, turn on TCP keepalive for each incoming
+        connection, with these (idle, interval, count) settings (see
+        set_keepalive).
+
+        Return the asyncio Server (see asyncio.start_server).
+        """
+
+        async def client_connected(reader, writer):
+            address = writer.get_extra_info("peername")
+            if keepalive is not None:
+                set_keepalive(writer.get_extra_info("socket"), *keepalive)
+            await handler(AsyncConnection(reader, writer), address)
+
+        return await asyncio.start_server(
+            client_connected,
+            host=host,
+            port=port,
+            reuse_address=True,
+            reuse_port=reuse_port,
+        )
+
+    def __init__(self, reader, writer):
+        """
+        Avoid using this constructor directly. Prefer to use from_address or
+        start_server instead.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.framing = JSON_FRAMING
+        # the length of a binary frame whose header has been read, but not
+        # (yet) the rest (see recv)
+        self._length = None
+        # If not None, called with the type of each message received and the
+        # time (in seconds) recv spent waiting for it
+        self.recv_observer = None
+
+    def set_framing(self, framing):
+        """
+        Switch to framing messages with 'framing' (see Connection.set_framing).
+        """
+        if framing not in (JSON_FRAMING, BINARY_FRAMING):
+            raise ValueError(f"Unknown framing {framing!r}")
+        self.framing = framing
+
+    def fileno(self):
+        """
+        Return the file descriptor of the underlying socket (e.g. to pass it
+        to another process, before disconnecting this connection).
+        """
+        return self.writer.get_extra_info("socket").fileno()
+
+    def hung_up(self):
+        """
+        Return True if the other party has hung up (or the connection has
+        failed), as far as the event loop has seen, without exchanging any
+        messages. (A party who vanishes without hanging up, e.g. whose
+        machine loses power, is only seen to have gone once TCP keepalive
+        gives up on them; see set_keepalive.)
+        """
+        return (
+            self.reader.at_eof()
+            or self.reader.exception() is not None
+            or self.writer.is_closing()
+        )
+
+    async def disconnect(self):
+        """
+        Close this protocol and its underlying transport.
+        """
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass  # (already lost; nothing left to close)
+
+    async def send(self, mtype, **margs):
+        """
+        Send a message of type 'mtype' with payload given by keyword
+        arguments (see Connection.send).
+        """
+        if self.framing == BINARY_FRAMING:
+            await self.send_encoded(encode_binary(mtype, **margs))
+        else:
+            await self.send_encoded(encode(mtype, **margs))
+
+    async def send_encoded(self, *lines):
+        """
+        Send messages already encoded with 'encode' (or, with binary
+        framing, with 'encode_binary'), e.g. to send the same message to
+        many connections, while only encoding it once.
+        """
+        if _NET_DEBUG:
+            for line in lines:
+                print("SENDING:", repr(line))
+        try:
+            self.writer.writelines(lines)
+            await self.writer.drain()
+        except (ConnectionResetError, BrokenPipeError) as e:
             raise DisconnectException(f"Connection error! {e}")
-        finally:
-            self.socket.settimeout(None)
+
+    async def recv(self, mtype=MessageType.any(), timeout=None):
+        """
+        Recv a message of a type in 'mtype' (default: any message type), see
+        Connection.recv.
+
+        Waits up to 'timeout' (float) seconds if 'timeout' is specified. A
+        timeout does not consume any partially-received message.
+        """
+        start = time.monotonic()
+        binary = self.framing == BINARY_FRAMING
+        read = self._read_frame() if binary else self.reader.readline()
+        try:
+            line = await asyncio.wait_for(read, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutException("Timeout exceeded! Assuming lost.")
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise DisconnectException(f"Connection error! {e}")
+        except (ValueError, asyncio.LimitOverrunError):
+            # (a line longer than the stream's buffer limit, 64 KiB)
+            raise ProtocolException("Message too long!")
         if _NET_DEBUG:
             print("RECV'D:", repr(line))
         if not line:
             raise DisconnectException("Connection lost!")
-        string = line.decode().strip()
-        msg = json.loads(string, object_hook=_tuplify_values_hook)
+        if binary:
+            msg = _expect_mtype(_decode_binary(line), mtype)
+        else:
+            msg = _expect_mtype(_decode(line), mtype)
+        if self.recv_observer is not None:
+            self.recv_observer(msg["mtype"], time.monotonic() - start)
         return msg
 
+    async def _read_frame(self):
+        # (return the next binary frame, or b"" if the connection closes
+        # first; if cancelled, e.g. by a timeout, the frame is left to be
+        # read next time, even if its header has been read already)
+        try:
+            if self._length is None:
+                header = await self.reader.readexactly(FRAME_HEADER.size)
+                (self._length,) = FRAME_HEADER.unpack(header)
+                if not self._length:
+                    # (every frame has at least its message type code)
+                    self._length = None
+                    raise ProtocolException("Empty frame!")
+            frame = await self.reader.readexactly(self._length)
+        except asyncio.IncompleteReadError:
+            return b""
+        self._length = None
+        return frame
+
+
+def set_keepalive(sock, idle, interval, count):
+    """
+    Turn on TCP keepalive for the socket 'sock': once the connection has
+    been idle for 'idle' seconds, the operating system probes the other end
+    every 'interval' seconds, and gives up on the connection (failing any
+    reads) after 'count' probes go unanswered. (The settings are applied
+    where the platform allows.)
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    idle_option = "TCP_KEEPIDLE"
+    if not hasattr(socket, idle_option):
+        idle_option = "TCP_KEEPALIVE"  # (as macOS calls it)
+    settings = {
+        idle_option: idle,
+        "TCP_KEEPINTVL": interval,
+        "TCP_KEEPCNT": count,
+    }
+    for name, value in settings.items():
+        if hasattr(socket, name):
+            option = getattr(socket, name)
+            sock.setsockopt(socket.IPPROTO_TCP, option, int(value))
 
-# Helper methods to get JSON arrays to decode as tuples.
-# If only JSONDecoder had an 'array_hook'; we could just use
-# 'array_hook=tuple'!
-def _tuplify_values_hook(obj):
-    """A Json object's values may contain arrays: convert them!"""
-    return {key: _deep_tuple(val) for key, val in obj.items()}
 
+def encode(mtype, **margs):
+    """
+    Encode a message of type 'mtype' with payload given by keyword
+    arguments, ready to send (see AsyncConnection.send_encoded).
+    """
+    if mtype.name is None:
+        raise ValueError(f"Unnamed MessageType {mtype} not valid for send()")
+    margs["mtype"] = mtype.name
+    return _encode(margs)
 
-def _deep_tuple(item):
+
+def encode_binary(mtype, **margs):
+    """
+    Encode a message of type 'mtype' with payload given by keyword
+    arguments as a binary frame, ready to send (see encode).
+    """
+    if mtype.name is None:
+        raise ValueError(f"Unnamed MessageType {mtype} not valid for send()")
+    return _encode_binary(mtype, margs)
+
+
+# Helper methods for message encoding, shared by both kinds of connection.
+def _encode(msg):
+    """Encode a message (a dict) as a line of JSON."""
+    string = json.dumps(msg, indent=None, separators=(",", ":"))
+    return f"{string}\n".encode()
+
+
+def _decode(line):
+    """
+    Decode a line of JSON into a message (a dict), with its mtype converted
+    back to a MessageType (e.g. MessageType.ACTN), and its payload checked
+    (see _check_payload).
+    """
+    try:
+        msg = json.loads(line)
+    except ValueError:
+        raise ProtocolException("Malformed message (not JSON)!")
+    if not isinstance(msg, dict):
+        raise ProtocolException("Malformed message (not a JSON object)!")
+    try:
+        msg["mtype"] = MessageType.from_name(msg.get("mtype"))
+    except ValueError:
+        raise ProtocolException(f"Unknown message type {msg.get('mtype')}!")
+    return _check_payload(msg)
+
+
+def _expect_mtype(msg, mtype):
+    """
+    Check that a decoded message's mtype (a MessageType) is one of those in
+    'mtype'.
+    """
+    # (comparing the flags' values, which is quicker than combining them)
+    if not (mtype.value & msg["mtype"].value):
+        # recvd message type was not expected!
+        raise ProtocolException(f"Unexpected {msg['mtype']} message!")
+    return msg
+
+
+# Helper methods for binary framing.
+def _encode_binary(mtype, margs):
+    """
+    Encode a message of type 'mtype' (with payload 'margs') as a binary
+    frame: packed, if it fits the packed format for its type, or else JSON.
+    """
+    code = mtype.code
+    payload = None
+    packing = _PACKINGS.get(mtype)
+    if packing is not None and margs.keys() <= packing[0]:
+        try:
+            payload = packing[1](margs)
+        except (KeyError, TypeError, ValueError):
+            pass  # (it doesn't fit; send it as JSON after all)
+    if payload is None:
+        code |= FRAME_JSON
+        payload = json.dumps(margs, separators=(",", ":")).encode()
+    length = 1 + len(payload)
+    if length > 0xFFFF:
+        raise ValueError(f"{mtype} message too long for binary framing")
+    return FRAME_HEADER.pack(length) + bytes((code,)) + payload
+
+
+def _split_line(buffer):
+    """
+    Find the first line in 'buffer', if it's all there, and return its
+    (start, end) (or None).
+    """
+    end = buffer.find(b"\n")
+    return None if end < 0 else (0, end + 1)
+
+
+def _split_frame(buffer):
     """
-    Convert a nested list with arbitrary structure to a nested _tuple_
-    instead.
+    Find the first binary frame in 'buffer', if it's all there, and return
+    the (start, end) of the frame after its header (or None). Raise a
+    ProtocolException if the frame is empty (it should at least have a
+    message type code).
     """
-    if isinstance(item, list):
-        # In the recursive case (item is a list), recursively deep_tuple-ify
-        # all list items, and store all items in a tuple intead.
-        return tuple(_deep_tuple(i) for i in item)
-    else:
-        # In the base case (any items that are not lists, including some
-        # possibly deep objects like dicts, and tuples themselves), change
-        # nothing.
-        return item
+    if len(buffer) < FRAME_HEADER.size:
+        return None
+    (length,) = FRAME_HEADER.unpack_from(buffer)
+    if not length:
+        raise ProtocolException("Empty frame!")
+    end = FRAME_HEADER.size + length
+    return None if len(buffer) < end else (FRAME_HEADER.size, end)
+
+
+def _decode_binary(frame):
+    """Decode a binary frame (without its header) into a message (a dict)."""
+    if not frame:
+        raise ProtocolException("Empty frame!")
+    code, payload = frame[0], frame[1:]
+    mtype = _MTYPES_BY_CODE.get(code & ~FRAME_JSON)
+    if mtype is None:
+        raise ProtocolException(f"Unknown message type code {code}!")
+    packing = _PACKINGS.get(mtype)
+    try:
+        if code & FRAME_JSON:
+            msg = json.loads(payload)
+            if not isinstance(msg, dict):
+                raise ValueError("payload must be a JSON object")
+        elif packing is not None:
+            msg = packing[2](payload)
+        else:
+            raise ValueError("no packed format for this type")
+    except (IndexError, ValueError):
+        raise ProtocolException(f"Malformed {mtype.name} message!")
+    msg["mtype"] = mtype
+    if code & FRAME_JSON:
+        # (packed payloads are well-formed already, but JSON needs checking)
+        return _check_payload(msg)
+    return msg
+
+
+# Actions are packed into 3 bytes: the action type, and then the thrown
+# symbol and hex (for a THROW), or the two hexes (for a SLIDE or SWING).
+# Each hex (r, q) is packed into one byte, 9 * (r + 4) + (q + 4), which
+# fits every hex on the board (and a few off it, for -4 <= r, q <= 4).
+_ATYPES = ("THROW", "SLIDE", "SWING")
+_ATYPE_CODES = {atype: i for i, atype in enumerate(_ATYPES)}
+_SYMBOLS = ("r", "p", "s")
+_SYMBOL_CODES = {s: i for i, s in enumerate(_SYMBOLS)}
+_HEXES = tuple((r, q) for r in range(-4, 5) for q in range(-4, 5))
+
+
+def _pack_action(action):
+    atype, a, b = action
+    if atype == "THROW":
+        return bytes((0, _SYMBOL_CODES[a], _pack_hex(b)))
+    return bytes((_ATYPE_CODES[atype], _pack_hex(a), _pack_hex(b)))
+
+
+def _pack_hex(x):
+    r, q = x
+    if type(r) is not int or type(q) is not int:
+        raise TypeError("hex coordinates must be ints")
+    if not (-4 <= r <= 4 and -4 <= q <= 4):
+        raise ValueError("hex not on the board")
+    return 9 * (r + 4) + (q + 4)
+
+
+def _unpack_action(payload):
+    if len(payload) != 3:
+        raise ValueError("actions are 3 bytes")
+    atype, a, b = payload
+    if atype == 0:
+        return _ATYPES[0], _SYMBOLS[a], _HEXES[b]
+    return _ATYPES[atype], _HEXES[a], _HEXES[b]
+
+
+def _pack_update(msg):
+    return _pack_action(msg["player_action"]) + _pack_action(
+        msg["opponent_action"]
+    )
+
+
+def _unpack_update(payload):
+    return {
+        "player_action": _unpack_action(payload[:3]),
+        "opponent_action": _unpack_action(payload[3:]),
+    }
+
+
+def _pack_colour(colour):
+    return bytes((("upper", "lower").index(colour),))
+
+
+def _unpack_colour(payload):
+    if len(payload) != 1:
+        raise ValueError("colours are 1 byte")
+    return ("upper", "lower")[payload[0]]
+
+
+def _unpack_nothing(payload):
+    if payload:
+        raise ValueError("no payload expected")
+    return {}
+
+
+# The packed formats for each message type that has one: the keys its payload
+# may have, and functions to pack a payload (a dict, raising a KeyError if a
+# key it needs is missing) and to unpack one (from bytes).
+_PACKINGS = {
+    MessageType.OKAY: (set(), lambda m: b"", _unpack_nothing),
+    # (with the previous turn's update, if turns are pipelined)
+    MessageType.TURN: (
+        {"player_action", "opponent_action"},
+        lambda m: _pack_update(m) if m else b"",
+        lambda p: _unpack_update(p) if p else {},
+    ),
+    MessageType.INIT: (
+        {"colour"},
+        lambda m: _pack_colour(m["colour"]),
+        lambda p: {"colour": _unpack_colour(p)},
+    ),
+    MessageType.ACTN: (
+        {"action"},
+        lambda m: _pack_action(m["action"]),
+        lambda p: {"action": _unpack_action(p)},
+    ),
+    MessageType.UPD8: (
+        {"player_action", "opponent_action"},
+        _pack_update,
+        _unpack_update,
+    ),
+}
+_MTYPES_BY_CODE = {mtype.code: mtype for mtype in MessageType}
+
+
+# Helper methods to check (and convert) decoded payloads.
+def _check_payload(msg):
+    """
+    Check that a decoded message's payload has the fields its type requires
+    (see _SCHEMAS), and that they are well-formed, converting those that
+    need it (e.g. actions, from JSON arrays to tuples), or else raise a
+    ProtocolException. Fields not in the schema are passed through as they
+    are (e.g. from newer versions of the protocol).
+    """
+    mtype = msg["mtype"]
+    for field, (check, required) in _SCHEMAS[mtype].items():
+        if field in msg:
+            try:
+                msg[field] = check(msg[field])
+            except (TypeError, ValueError):
+                raise ProtocolException(
+                    f"Malformed {field!r} in {mtype.name} message!"
+                )
+        elif required:
+            raise ProtocolException(
+                f"Missing {field!r} in {mtype.name} message!"
+            )
+    return msg
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise TypeError("expected a string")
+    return value
+
+
+def _integer(value):
+    if type(value) is not int:
+        raise TypeError("expected an integer")
+    return value
+
+
+def _boolean(value):
+    if not isinstance(value, bool):
+        raise TypeError("expected a boolean")
+    return value
+
+
+def _optional(check):
+    return lambda value: None if value is None else check(value)
+
+
+def _array(value):
+    if not isinstance(value, list):
+        raise TypeError("expected an array")
+    return value
+
+
+def _colour(value):
+    if value not in ("upper", "lower"):
+        raise ValueError("expected a colour")
+    return value
+
+
+def _action(value):
+    # (just its shape; whether it's a legal action is up to the referee)
+    atype, a, b = _array(value)
+    if atype == "THROW":
+        return atype, _string(a), _hex(b)
+    if atype in ("SLIDE", "SWING"):
+        return atype, _hex(a), _hex(b)
+    raise ValueError("expected an action")
+
+
+def _hex(value):
+    r, q = _array(value)
+    return _integer(r), _integer(q)
+
+
+# The payload of each message type: a dict from each of its fields to a
+# function that checks (and converts) the field's decoded value, raising a
+# TypeError or ValueError if it's malformed, and whether it is required.
+_SCHEMAS = {
+    MessageType.OKAY: {
+        "framing": (_string, False),
+        "pipelined": (_boolean, False),
+    },
+    MessageType.ERRO: {"reason": (_string, True)},
+    MessageType.PLAY: {
+        "name": (_string, True),
+        "channel": (_string, True),
+        "games": (_integer, False),
+        "framing": (_string, False),
+        "pipelined": (_boolean, False),
+    },
+    MessageType.GAME: {
+        "upper": (_string, True),
+        "lower": (_string, True),
+        "game": (_integer, False),
+    },
+    MessageType.INIT: {"colour": (_colour, True)},
+    MessageType.TURN: {
+        "player_action": (_action, False),
+        "opponent_action": (_action, False),
+    },
+    MessageType.ACTN: {"action": (_action, True)},
+    MessageType.UPD8: {
+        "player_action": (_action, True),
+        "opponent_action": (_action, True),
+    },
+    MessageType.OVER: {"result": (_string, True)},
+    # (a request to watch, a listing of games, or a turn; see server.spectate)
+    MessageType.SPEC: {
+        "game": (_optional(_integer), False),
+        "games": (_array, False),
+        "turn": (_integer, False),
+        "upper": (_action, False),
+        "lower": (_action, False),
+    },
+}
 
 
 class ProtocolException(Exception):
     """
     For when an unexpected message is recvd, indicating that we (and the
-    other party) disagree about what is meant to happen next in the protocol
-    TODO: add message contents validation to protocol, using this exception,
-    while sending and recving messages. That way, errors caused by e.g.
-    missing message data won't pop up elsewhere on the wrong side of the
-    network.
+    other party) disagree about what is meant to happen next in the protocol,
+    or a malformed one (e.g. with missing or ill-typed message data), so that
+    such errors are caught at the network, rather than popping up elsewhere
+    on the wrong side of it.
     """
 
 
@@ -257,5 +893,13 @@ class ConnectingException(Exception):
 
 class DisconnectException(Exception):
     """
-    For when the connection closes while we are trying to recv a message.
+    For when the connection closes while we are trying to recv a message
+    (or, for an AsyncConnection, to send one).
+    """
+
+
+class TimeoutException(DisconnectException):
+    """
+    For when a message doesn't arrive within the recv timeout (treated as a
+    disconnection, unless caught separately).
     """
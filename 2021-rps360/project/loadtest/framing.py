@@ -0,0 +1,175 @@
+"""
+Benchmark the protocol's framings: encode and decode all of the messages a
+client sends and receives during a game (with random actions, for as many
+turns as a game can last), in JSON framing and in binary framing, and
+report the time each message takes to encode and decode, and the bytes sent
+over the wire, for each message type and for the whole game. For example:
+
+    python -m loadtest.framing --turns 360 --repeats 100
+
+(Times are for encoding and decoding alone, without any network I/O; bytes
+are for the messages alone, without TCP/IP headers.)
+"""
+
+import time
+import random
+import argparse
+
+from referee.game import Game, COLOURS
+from battleground.protocol import MessageType as M, encode, encode_binary
+from battleground.protocol import FRAME_HEADER
+from battleground.protocol import _decode, _decode_binary, _expect_mtype
+
+# The longest a game can last (turns)
+MAX_TURNS = 360
+
+# (the message types the decoders accept)
+ANY = M.any()
+
+
+def game_messages(turns=MAX_TURNS, seed=0):
+    """
+    Return a list of (direction, mtype, payload) tuples for the messages
+    exchanged with the upper player over a game of random actions lasting
+    'turns' turns (playing on in new games, should one end sooner).
+    Directions are "down" (server to client) and "up" (client to server).
+    """
+    rng = random.Random(seed)
+    messages = [
+        ("down", M.GAME, {"upper": "rock_first", "lower": "rock_and_roll"}),
+        ("down", M.INIT, {"colour": COLOURS[0]}),
+        ("up", M.OKAY, {}),
+    ]
+    game = Game()
+    for _ in range(turns):
+        if game.over():
+            game = Game()
+        actions = [
+            rng.choice(list(game._available_actions(colour)))
+            for colour in COLOURS
+        ]
+        game.update(*actions)
+        messages += [
+            ("down", M.TURN, {}),
+            ("up", M.ACTN, {"action": actions[0]}),
+            (
+                "down",
+                M.UPD8,
+                {"player_action": actions[0], "opponent_action": actions[1]},
+            ),
+            ("up", M.OKAY, {}),
+        ]
+    result = "draw: maximum number of turns reached"
+    messages.append(("down", M.OVER, {"result": result}))
+    return messages
+
+
+def measure(messages, repeats, encoder, decoder):
+    """
+    Encode and then decode 'messages' (see game_messages) 'repeats' times
+    with 'encoder' (like encode) and 'decoder' (from an encoded message to a
+    checked message dict). Return dicts from each message type to its total
+    bytes, and its total encode and decode time per repeat (seconds), and a
+    dict from each direction to its total bytes.
+    """
+    sizes = {}
+    encode_times = {mtype: 0 for _, mtype, _ in messages}
+    decode_times = dict(encode_times)
+    directions = {"up": 0, "down": 0}
+    for direction, mtype, payload in messages:
+        size = len(encoder(mtype, **payload))
+        sizes[mtype] = sizes.get(mtype, 0) + size
+        directions[direction] += size
+    for _ in range(repeats):
+        for _, mtype, payload in messages:
+            start = time.perf_counter()
+            data = encoder(mtype, **payload)
+            encoded = time.perf_counter()
+            decoder(data)
+            decoded = time.perf_counter()
+            encode_times[mtype] += encoded - start
+            decode_times[mtype] += decoded - encoded
+    for times in (encode_times, decode_times):
+        for mtype in times:
+            times[mtype] /= repeats
+    return sizes, encode_times, decode_times, directions
+
+
+def _decode_json(line):
+    # (as AsyncConnection.recv does, once the line has been read)
+    return _expect_mtype(_decode(line), ANY)
+
+
+def _decode_frame(frame):
+    # (as AsyncConnection.recv does, once the frame has been read)
+    return _expect_mtype(_decode_binary(frame[FRAME_HEADER.size :]), ANY)
+
+
+FRAMINGS = {
+    "json": (encode, _decode_json),
+    "binary": (encode_binary, _decode_frame),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m loadtest.framing",
+        description="compare the cost of the protocol's framings over a "
+        "game's messages.",
+    )
+    parser.add_argument(
+        "-t",
+        "--turns",
+        type=int,
+        default=MAX_TURNS,
+        help="number of turns in the game (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=100,
+        help="number of times to encode and decode the game's messages "
+        "(default: %(default)s).",
+    )
+    options = parser.parse_args()
+
+    messages = game_messages(options.turns)
+    counts = {}
+    for _, mtype, _ in messages:
+        counts[mtype] = counts.get(mtype, 0) + 1
+    results = {
+        name: measure(messages, options.repeats, *coders)
+        for name, coders in FRAMINGS.items()
+    }
+
+    print(
+        f"{len(messages)} messages over {options.turns} turns, per message "
+        "(json / binary):"
+    )
+    print("type  count     bytes      encode (us)     decode (us)")
+    for mtype, count in counts.items():
+        row = [mtype.name, f"{count:>5}"]
+        for i in range(3):
+            json_value, binary_value = (
+                results[name][i][mtype] / count for name in FRAMINGS
+            )
+            scale = 1 if i == 0 else 1e6
+            row.append(
+                f"{scale * json_value:>6.1f} / {scale * binary_value:<6.1f}"
+            )
+        print("  ".join(row))
+    print("whole game (json / binary):")
+    for name in FRAMINGS:
+        sizes, encode_times, decode_times, directions = results[name]
+        cpu = sum(encode_times.values()) + sum(decode_times.values())
+        print(
+            f"{name:>7}: {sum(sizes.values()) / 1024:.1f}kB "
+            f"({directions['up'] / 1024:.1f}kB up, "
+            f"{directions['down'] / 1024:.1f}kB down), "
+            f"{1000 * cpu:.2f}ms to encode and decode"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""
+Driver program to load-test a battleground server: run many simulated
+clients (coroutines speaking the ROPASCI protocol, in one or more worker
+processes) through a number of games against a server, and report the
+server's throughput, the latencies seen by clients, and the server's CPU and
+memory usage.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import socket
+import asyncio
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+from referee.log import config, print, comment
+from referee.game import Game, COLOURS
+from battleground.protocol import AsyncConnection, MessageType as M
+from battleground.protocol import DisconnectException, ProtocolException
+from battleground.protocol import ConnectingException, JSON_FRAMING
+from loadtest.options import get_options
+
+# How long a client will wait for a game before giving up (seconds)
+WAIT_TIMEOUT = 60
+
+# How long to wait for a started server to begin listening (seconds)
+STARTUP_TIMEOUT = 30
+
+
+def main():
+    options = get_options()
+    config(level=1)
+
+    # (thousands of clients need thousands of file descriptors, and so does
+    # the server we may start)
+    _raise_file_limit()
+
+    server = None
+    host, pid = options.host, options.pid
+    if host is None:
+        comment("starting server...")
+        server, workdir = _start_server(options.server_log)
+        host, pid = "localhost", server.pid
+    try:
+        _wait_for_server(host, options.port)
+        usage = _ServerUsage(pid) if pid is not None else None
+
+        # share out the clients and games between the worker processes
+        workers = min(options.workers, options.clients // 2)
+        tasks = [
+            (
+                i,
+                host,
+                options.port,
+                _share(options.clients // 2, workers, i) * 2,
+                _share(options.games, workers, i),
+                options.mix,
+                options.bot_channels,
+                options.think,
+                options.actions,
+                options.framing,
+                options.pipelined,
+            )
+            for i in range(workers)
+        ]
+        comment(
+            f"playing {options.games} games with {options.clients} clients "
+            f"in {workers} worker processes...",
+        )
+        start = time.perf_counter()
+        with multiprocessing.Pool(workers) as pool:
+            result = pool.map_async(_run_worker, tasks)
+            while not result.ready():
+                result.wait(1)
+                if usage is not None:
+                    usage.sample()
+            results = result.get()
+            if usage is not None:
+                usage.sample()
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            _stop_server(server, workdir)
+
+    # combine and report the results
+    games = round(sum(r["games"] for r in results))
+    errors = sum(r["errors"] for r in results)
+    connect = [t for r in results for t in r["connect"]]
+    round_trip = [t for r in results for t in r["round_trip"]]
+    print(
+        f"{games} games in {elapsed:.1f}s ({games / elapsed:.1f} games/s), "
+        f"{errors} client errors"
+    )
+    print("connection setup:", _format_percentiles(connect))
+    print("turn round trip: ", _format_percentiles(round_trip))
+    if usage is not None and usage.available:
+        print(
+            f"server ({usage.processes} processes): "
+            f"{usage.cpu_percent():.0f}% CPU (average), "
+            f"{usage.rss / 1024:.1f}MB RSS ({usage.peak_rss / 1024:.1f}MB "
+            "peak)"
+        )
+
+
+def _share(total, n, i):
+    """Worker i's share when total is divided (as evenly as possible) by n."""
+    return total // n + (i < total % n)
+
+
+# # #
+# Simulated clients (run in the worker processes)
+#
+
+
+def _run_worker(task):
+    return asyncio.run(_run_clients(*task))
+
+
+async def _run_clients(
+    worker_id,
+    host,
+    port,
+    nclients,
+    ngames,
+    mix,
+    bot_channels,
+    think,
+    actions,
+    framing,
+    pipelined,
+):
+    """
+    Run 'nclients' simulated clients, in pairs, until 'ngames' games have been
+    played. Return a dict of statistics.
+    """
+    stats = {"games": 0, "errors": 0, "connect": [], "round_trip": []}
+    remaining = ngames
+    think_time = _think_time_sampler(think)
+    choose = _random_action if actions == "random" else _scripted_action
+    channels, weights = zip(*mix.items())
+
+    async def run_pair(pair_id):
+        nonlocal remaining
+        names = [f"load{worker_id}-{pair_id}-{i}" for i in range(2)]
+        while remaining > 0:
+            channel = random.choices(channels, weights)[0]
+            if channel in bot_channels:
+                # each client plays its own game against a server player
+                nseats = min(remaining, 2)
+                remaining -= nseats
+                share = 1
+            else:
+                # both clients wait in the channel, to make up one game
+                # between them (or with clients of other pairs; either way,
+                # since every pair adds two clients, nobody waits forever)
+                nseats = 2
+                remaining -= 1
+                share = 0.5
+            played = await asyncio.gather(
+                *(
+                    _play_client(
+                        host,
+                        port,
+                        name,
+                        channel,
+                        think_time,
+                        choose,
+                        framing,
+                        pipelined,
+                        stats,
+                    )
+                    for name in names[:nseats]
+                )
+            )
+            stats["games"] += share * sum(played)
+
+    await asyncio.gather(*(run_pair(i) for i in range(nclients // 2)))
+    return stats
+
+
+async def _play_client(
+    host, port, name, channel, think_time, choose, framing, pipelined, stats
+):
+    """
+    Connect to the server, and play one game as 'name' in 'channel' (asking
+    for 'framing', and for 'pipelined' turns if True). Return True if the
+    game was played to the end, or False after an error.
+    """
+    server = None
+    try:
+        # Connect and ask for a game
+        start = time.perf_counter()
+        server = await AsyncConnection.from_address(host, port)
+        playmsg = {"name": name, "channel": channel}
+        if framing != JSON_FRAMING:
+            playmsg["framing"] = framing
+        if pipelined:
+            playmsg["pipelined"] = True
+        await server.send(M.PLAY, **playmsg)
+        msg = await server.recv(M.OKAY)
+        server.set_framing(msg.get("framing", JSON_FRAMING))
+        stats["connect"].append(time.perf_counter() - start)
+
+        # Wait (through keep-alive pings) for the game
+        msg = await server.recv(M.OKAY | M.GAME | M.ERRO, WAIT_TIMEOUT)
+        while msg["mtype"] is not M.GAME:
+            if msg["mtype"] is M.ERRO:
+                raise ProtocolException(msg["reason"])
+            await server.send(M.OKAY)
+            msg = await server.recv(M.OKAY | M.GAME | M.ERRO, WAIT_TIMEOUT)
+        colour = (await server.recv(M.INIT))["colour"]
+        game = Game()
+        await server.send(M.OKAY)
+
+        # Play the game, keeping track of the state to choose valid actions
+        sent = None  # (when we sent our last action)
+        while True:
+            msg = await server.recv(M.TURN | M.UPD8 | M.OVER | M.ERRO)
+            if "player_action" in msg:
+                # (an UPD8, or a pipelined TURN with the previous update)
+                if sent is not None:
+                    stats["round_trip"].append(time.perf_counter() - sent)
+                actions = msg["player_action"], msg["opponent_action"]
+                if colour != COLOURS[0]:
+                    actions = actions[::-1]
+                game.update(*actions)
+            if msg["mtype"] is M.TURN:
+                delay = think_time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sent = time.perf_counter()
+                await server.send(M.ACTN, action=choose(game, colour))
+            elif msg["mtype"] is M.UPD8:
+                await server.send(M.OKAY)
+            elif msg["mtype"] is M.OVER:
+                return True
+            else:  # msg["mtype"] is M.ERRO
+                raise ProtocolException(msg["reason"])
+    except (
+        ConnectingException,
+        DisconnectException,
+        ProtocolException,
+        OSError,
+    ):
+        stats["errors"] += 1
+        return False
+    finally:
+        if server is not None:
+            await server.disconnect()
+
+
+def _random_action(game, colour):
+    return random.choice(list(game._available_actions(colour)))
+
+
+def _scripted_action(game, colour):
+    return next(game._available_actions(colour))
+
+
+def _think_time_sampler(think):
+    kind, *params = think
+    if kind == "const":
+        return lambda: params[0]
+    elif kind == "uniform":
+        return lambda: random.uniform(*params)
+    else:  # kind == "exp"
+        return lambda: random.expovariate(1 / params[0]) if params[0] else 0
+
+
+# # #
+# Server process management and measurement
+#
+
+
+def _start_server(log_filename=None):
+    """
+    Start a server in a new process (working in a temporary directory, where
+    it will write its game logs). Return the process and the directory.
+    """
+    project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [project, env.get("PYTHONPATH")])
+    )
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    log = open(log_filename, "w") if log_filename else subprocess.DEVNULL
+    server = subprocess.Popen(
+        [sys.executable, "-u", "-m", "server"],
+        cwd=workdir,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    return server, workdir
+
+
+def _wait_for_server(host, port):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _stop_server(server, workdir):
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+class _ServerUsage:
+    """
+    Track the CPU usage (since creation of this object) and resident memory
+    (sampled with the sample method) of a process and all of its
+    descendants (e.g. the server's bot workers, and its other server
+    processes, if it has them), from /proc. CPU usage is added up over the
+    processes (so it may exceed 100%), and so is RSS (counting memory shared
+    between the processes more than once).
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.rss = self.peak_rss = 0  # KiB
+        self.processes = 0
+        self.start = self.end = time.monotonic()
+        try:
+            # (key each process by its pid and start time, in case pids are
+            # reused, and remember the CPU time it had used when last seen,
+            # so that processes which exit still count)
+            self._start_cpu = self._cpu_seconds(self._tree())
+            self._cpu = dict(self._start_cpu)
+            self.available = True
+        except OSError:
+            self.available = False  # (no /proc? no usage report)
+
+    def sample(self):
+        if not self.available:
+            return
+        pids = self._tree()
+        if not pids:
+            return  # (the server has gone)
+        self._cpu.update(self._cpu_seconds(pids))
+        self.end = time.monotonic()
+        self.rss = sum(map(self._rss, pids))
+        self.peak_rss = max(self.peak_rss, self.rss)
+        self.processes = len(pids)
+
+    def cpu_percent(self):
+        # (as of the last sample)
+        elapsed = max(self.end - self.start, 1e-9)
+        used = sum(self._cpu.values()) - sum(self._start_cpu.values())
+        return 100 * used / elapsed
+
+    def _tree(self):
+        # (the pids of the process and its descendants, that are still
+        # running)
+        pids, i = [self.pid], 0
+        while i < len(pids):
+            try:
+                for task in os.listdir(f"/proc/{pids[i]}/task"):
+                    path = f"/proc/{pids[i]}/task/{task}/children"
+                    with open(path) as children:
+                        pids.extend(map(int, children.read().split()))
+                i += 1
+            except FileNotFoundError:
+                if i == 0:
+                    return []
+                del pids[i]  # (it has exited since)
+        return pids
+
+    @staticmethod
+    def _cpu_seconds(pids):
+        # (return a dict from (pid, start time) to CPU time used)
+        cpu = {}
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/stat") as stat:
+                    # (skip past the command name, which may contain spaces)
+                    fields = stat.read().rsplit(")", 1)[1].split()
+            except FileNotFoundError:
+                continue  # (it has exited since)
+            utime, stime = int(fields[11]), int(fields[12])
+            cpu[pid, fields[19]] = (utime + stime) / os.sysconf("SC_CLK_TCK")
+        return cpu
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except FileNotFoundError:
+            pass  # (it has exited since)
+        return 0
+
+
+def _raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _format_percentiles(samples):
+    if not samples:
+        return "(no samples)"
+    samples = sorted(samples)
+    points = [
+        (f"p{p}", samples[min(len(samples) - 1, len(samples) * p // 100)])
+        for p in (50, 90, 99)
+    ]
+    points.append(("max", samples[-1]))
+    return ", ".join(f"{name} {1000 * t:.2f}ms" for name, t in points)
@@ -0,0 +1,232 @@
+"""
+Provide a command-line argument parsing function using argparse
+(resulting in the following help message):
+
+-----------------------------------------------------------------------------
+usage: loadtest [-h] [-n GAMES] [-c CLIENTS] [-w WORKERS] [-m MIX]
+                [-b BOT_CHANNELS] [-t THINK] [-a {random,scripted}]
+                [-f {json,binary}] [-T] [-H HOST] [-P PORT] [-p PID]
+                [-l SERVER_LOG]
+
+load-test a battleground server with many simulated clients.
+
+optional arguments:
+  -h, --help            show this message.
+  -n GAMES, --games GAMES
+                        total number of games to play (default: 1000).
+  -c CLIENTS, --clients CLIENTS
+                        number of simulated clients connected at once
+                        (default: 100).
+  -w WORKERS, --workers WORKERS
+                        number of processes to run the clients in (default:
+                        1).
+  -m MIX, --mix MIX     channel mix, as comma-separated channel:weight pairs
+                        (default: loadtest:1).
+  -b BOT_CHANNELS, --bot-channels BOT_CHANNELS
+                        comma-separated channels in which the server provides
+                        the opponent (default: random,greedy).
+  -t THINK, --think THINK
+                        think time before each action, in seconds: const:S,
+                        uniform:LO:HI, or exp:MEAN (default: const:0).
+  -a {random,scripted}, --actions {random,scripted}
+                        how clients choose actions. random: a random available
+                        action; scripted: the first available action (default:
+                        random).
+  -f {json,binary}, --framing {json,binary}
+                        message framing for clients to ask for (default:
+                        json).
+  -T, --pipelined       ask for pipelined turns (one round trip per turn,
+                        rather than two).
+  -H HOST, --host HOST  address of server to test (default: start a new server
+                        on this machine).
+  -P PORT, --port PORT  port to contact server on (default: 12360).
+  -p PID, --pid PID     process id of server (if given with --host), to report
+                        its CPU and memory usage.
+  -l SERVER_LOG, --server-log SERVER_LOG
+                        file for the output of a started server (default:
+                        discard it).
+-----------------------------------------------------------------------------
+"""
+
+import argparse
+from battleground.protocol import DEFAULT_SERVER_PORT
+from battleground.protocol import JSON_FRAMING, BINARY_FRAMING
+
+# Program information:
+PROGRAM = "loadtest"
+DESCRIP = "load-test a battleground server with many simulated clients."
+
+# default values (to use if flag is not provided)
+
+GAMES_DEFAULT = 1000
+CLIENTS_DEFAULT = 100
+WORKERS_DEFAULT = 1
+MIX_DEFAULT = "loadtest:1"
+BOT_CHANNELS_DEFAULT = "random,greedy"
+THINK_DEFAULT = "const:0"
+ACTIONS = ("random", "scripted")
+ACTIONS_DEFAULT = "random"
+FRAMINGS = (JSON_FRAMING, BINARY_FRAMING)
+FRAMING_DEFAULT = JSON_FRAMING
+
+
+def get_options():
+    """Parse and return command-line arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog=PROGRAM,
+        description=DESCRIP,
+        add_help=False,  # <-- we will add it back to the optional group.
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    # optional arguments used for configuration:
+    optionals = parser.add_argument_group(title="optional arguments")
+    optionals.add_argument(
+        "-h",
+        "--help",
+        action="help",
+        help="show this message.",
+    )
+    optionals.add_argument(
+        "-n",
+        "--games",
+        type=int,
+        default=GAMES_DEFAULT,
+        help="total number of games to play (default: %(default)s).",
+    )
+    optionals.add_argument(
+        "-c",
+        "--clients",
+        type=int,
+        default=CLIENTS_DEFAULT,
+        help="number of simulated clients connected at once (default: "
+        "%(default)s).",
+    )
+    optionals.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=WORKERS_DEFAULT,
+        help="number of processes to run the clients in (default: "
+        "%(default)s).",
+    )
+    optionals.add_argument(
+        "-m",
+        "--mix",
+        type=parse_mix,
+        default=MIX_DEFAULT,
+        help="channel mix, as comma-separated channel:weight pairs "
+        "(default: %(default)s).",
+    )
+    optionals.add_argument(
+        "-b",
+        "--bot-channels",
+        type=lambda s: set(s.split(",")),
+        default=BOT_CHANNELS_DEFAULT,
+        help="comma-separated channels in which the server provides the "
+        "opponent (default: %(default)s).",
+    )
+    optionals.add_argument(
+        "-t",
+        "--think",
+        type=parse_think,
+        default=THINK_DEFAULT,
+        help="think time before each action, in seconds: const:S, "
+        "uniform:LO:HI, or exp:MEAN (default: %(default)s).",
+    )
+    optionals.add_argument(
+        "-a",
+        "--actions",
+        choices=ACTIONS,
+        default=ACTIONS_DEFAULT,
+        help="how clients choose actions. random: a random available "
+        "action; scripted: the first available action (default: "
+        "%(default)s).",
+    )
+    optionals.add_argument(
+        "-f",
+        "--framing",
+        choices=FRAMINGS,
+        default=FRAMING_DEFAULT,
+        help="message framing for clients to ask for (default: "
+        "%(default)s).",
+    )
+    optionals.add_argument(
+        "-T",
+        "--pipelined",
+        action="store_true",
+        help="ask for pipelined turns (one round trip per turn, rather "
+        "than two).",
+    )
+    optionals.add_argument(
+        "-H",
+        "--host",
+        type=str,
+        default=None,
+        help="address of server to test (default: start a new server on "
+        "this machine).",
+    )
+    optionals.add_argument(
+        "-P",
+        "--port",
+        type=int,
+        default=DEFAULT_SERVER_PORT,
+        help="port to contact server on (default: %(default)s).",
+    )
+    optionals.add_argument(
+        "-p",
+        "--pid",
+        type=int,
+        default=None,
+        help="process id of server (if given with --host), to report its "
+        "CPU and memory usage.",
+    )
+    optionals.add_argument(
+        "-l",
+        "--server-log",
+        type=str,
+        default=None,
+        help="file for the output of a started server (default: discard "
+        "it).",
+    )
+
+    args = parser.parse_args()
+    if args.clients < 2:
+        parser.error("need at least 2 clients")
+    if args.host is None and args.port != DEFAULT_SERVER_PORT:
+        # (the server always listens on the default port)
+        parser.error("a started server can't use another port")
+    return args
+
+
+def parse_mix(string):
+    """
+    Parse a channel mix like "a:3,b:1" into a dict {"a": 3.0, "b": 1.0}.
+    """
+    mix = {}
+    try:
+        for pair in string.split(","):
+            channel, weight = pair.rsplit(":", 1)
+            mix[channel] = float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid channel mix {string!r}")
+    return mix
+
+
+def parse_think(string):
+    """
+    Parse a think-time distribution like "uniform:0:0.1" into a tuple
+    ("uniform", 0.0, 0.1), checking it has the right number of parameters.
+    """
+    kind, *params = string.split(":")
+    nparams = {"const": 1, "uniform": 2, "exp": 1}
+    try:
+        params = tuple(map(float, params))
+        if len(params) != nparams[kind]:
+            raise ValueError()
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(
+            f"invalid think time distribution {string!r}"
+        )
+    return (kind, *params)
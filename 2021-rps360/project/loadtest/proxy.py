@@ -0,0 +1,337 @@
+"""
+A TCP proxy to put between battleground clients and a server, simulating a
+slow network: each direction of each connection gets its own delay, jitter
+and bandwidth cap, so that protocol changes can be measured offline as they
+would be felt by players on slow home connections.
+
+The proxy also watches the messages from the server going by, and reports
+how many games its clients play, and how long the games take: in games per
+hour for all clients together (counting each game once for each client
+playing in it), and per client (playing one game after another, as with the
+battleground client's --games option).
+
+For example, to load-test a server as if each client were 40ms (give or
+take 10ms) away, on a 1Mbit/s connection (but with a faster download):
+
+    python -m server &
+    python -m loadtest.proxy --listen 12370 --delay 40 --jitter 10 \\
+        --bandwidth 1000/8000 &
+    python -m loadtest -H localhost -P 12370 -t const:0.1
+
+Each of --delay, --jitter and --bandwidth takes one value for both
+directions, or two values, UP/DOWN: client to server, and server to client.
+"""
+
+import sys
+import time
+import random
+import signal
+import asyncio
+import argparse
+
+from battleground.protocol import DEFAULT_SERVER_PORT, MessageType as M
+from battleground.protocol import FRAME_HEADER, FRAME_JSON
+
+# How much to read from a connection at once (bytes)
+CHUNK_SIZE = 65536
+
+# The codes of the messages to watch for, in binary framing
+GAME_CODE = M.GAME.code
+OVER_CODE = M.OVER.code
+
+
+class Link:
+    """
+    One direction of a simulated network link. Data sent over it arrives
+    after 'delay' seconds, give or take 'jitter' seconds (the standard
+    deviation of a normal distribution), but not before the data sent before
+    it (nothing is reordered), and no faster than 'bandwidth' bytes per
+    second (if it's not None).
+    """
+
+    def __init__(self, delay=0, jitter=0, bandwidth=None):
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self._sent = 0  # when the link will have sent everything so far
+        self._arrived = 0  # when everything sent so far will have arrived
+
+    def arrival(self, size, now):
+        """
+        Return the time when 'size' bytes sent 'now' (both according to
+        time.monotonic) will arrive.
+        """
+        start = max(now, self._sent)
+        if self.bandwidth is not None:
+            start += size / self.bandwidth
+        self._sent = start
+        latency = max(0, random.gauss(self.delay, self.jitter))
+        self._arrived = max(self._arrived, start + latency)
+        return self._arrived
+
+
+class Proxy:
+    """
+    Forward connections to the server at 'host':'port', through a pair of
+    Links made for each connection by the functions 'up' (client to server)
+    and 'down' (server to client), and keep statistics on the games played.
+    """
+
+    def __init__(self, host, port, up=Link, down=Link):
+        self.host = host
+        self.port = port
+        self.up = up
+        self.down = down
+        self.start = time.monotonic()
+        self.connections = 0
+        self.games = 0  # (games played by each client, added up)
+        self.game_seconds = 0  # total duration of the 'games'
+        self.bytes = {"up": 0, "down": 0}
+
+    async def serve(self, port, host="localhost"):
+        """
+        Accept connections on 'host':'port' and forward them (forever).
+        """
+        server = await asyncio.start_server(self._handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def report(self):
+        """
+        Return a line summarising the statistics so far.
+        """
+        elapsed = time.monotonic() - self.start
+        line = (
+            f"{self.connections} connections, {self.games} client games "
+            f"({3600 * self.games / elapsed:.0f}/hour)"
+        )
+        if self.games:
+            mean = self.game_seconds / self.games
+            line += (
+                f", {mean:.2f}s per game "
+                f"({3600 / mean:.0f} games/hour per client)"
+            )
+        up, down = self.bytes["up"], self.bytes["down"]
+        return line + f", {up / 1024:.0f}kB up, {down / 1024:.0f}kB down"
+
+    async def _handle(self, client_reader, client_writer):
+        self.connections += 1
+        try:
+            server_reader, server_writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        except OSError:
+            client_writer.close()
+            return
+        writers = (client_writer, server_writer)
+        watcher = _GameWatcher(self)
+        await asyncio.gather(
+            self._pipe(client_reader, server_writer, writers, self.up(), "up"),
+            self._pipe(
+                server_reader,
+                client_writer,
+                writers,
+                self.down(),
+                "down",
+                watcher,
+            ),
+        )
+        for writer in writers:
+            writer.close()
+
+    async def _pipe(
+        self, reader, writer, writers, link, direction, watcher=None
+    ):
+        # (read as data comes, and write as it would arrive, concurrently)
+        chunks = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                arrival, chunk = await chunks.get()
+                await asyncio.sleep(arrival - time.monotonic())
+                if chunk is None:
+                    if writer.can_write_eof():
+                        writer.write_eof()
+                    return
+                writer.write(chunk)
+                await writer.drain()
+
+        delivery = asyncio.create_task(deliver())
+        try:
+            while True:
+                chunk = await reader.read(CHUNK_SIZE)
+                now = time.monotonic()
+                if not chunk:
+                    chunks.put_nowait((link.arrival(0, now), None))
+                    break
+                self.bytes[direction] += len(chunk)
+                if watcher is not None:
+                    watcher.watch(chunk, now)
+                chunks.put_nowait((link.arrival(len(chunk), now), chunk))
+            await delivery
+        except (ConnectionError, OSError):
+            # (one end went away; let go of both, which also stops the pipe
+            # in the other direction)
+            for writer in writers:
+                writer.close()
+        finally:
+            delivery.cancel()
+            await asyncio.gather(delivery, return_exceptions=True)
+
+
+class _GameWatcher:
+    """
+    Time the games in the messages from the server over one connection (from
+    each GAME message to the next OVER message), in either framing (the
+    messages are lines of JSON until the server's OKAY agrees to binary
+    framing, and binary frames after that).
+    """
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.started = None
+        self.binary = False
+        self._partial = b""  # (the start of a message split between chunks)
+
+    def watch(self, chunk, now):
+        data = self._partial + chunk
+        start = 0
+        while True:
+            if self.binary:
+                end = start + FRAME_HEADER.size
+                if end >= len(data):
+                    break
+                (length,) = FRAME_HEADER.unpack_from(data, start)
+                if end + length > len(data):
+                    break
+                code = data[end] & ~FRAME_JSON
+                self._seen(code == GAME_CODE, code == OVER_CODE, now)
+                start = end + length
+            else:
+                end = data.find(b"\n", start)
+                if end < 0:
+                    break
+                message = data[start:end]
+                self._seen(
+                    b'"mtype":"GAME"' in message,
+                    b'"mtype":"OVER"' in message,
+                    now,
+                )
+                self.binary = b'"framing":"binary"' in message
+                start = end + 1
+        self._partial = data[start:]
+
+    def _seen(self, game, over, now):
+        if game:
+            self.started = now
+        elif over and self.started is not None:
+            self.proxy.games += 1
+            self.proxy.game_seconds += now - self.started
+            self.started = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m loadtest.proxy",
+        description="forward battleground connections through a simulated "
+        "slow network, and report games per hour.",
+    )
+    parser.add_argument(
+        "-L",
+        "--listen",
+        type=int,
+        default=DEFAULT_SERVER_PORT + 10,
+        help="port to accept client connections on (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-H",
+        "--host",
+        default="localhost",
+        help="address of server (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-P",
+        "--port",
+        type=int,
+        default=DEFAULT_SERVER_PORT,
+        help="port to contact server on (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-d",
+        "--delay",
+        type=_parse_pair,
+        default="0",
+        help="one-way delay (ms), as DELAY or UP/DOWN (default: 0).",
+    )
+    parser.add_argument(
+        "-j",
+        "--jitter",
+        type=_parse_pair,
+        default="0",
+        help="standard deviation of the delay (ms), as JITTER or UP/DOWN "
+        "(default: 0).",
+    )
+    parser.add_argument(
+        "-b",
+        "--bandwidth",
+        type=_parse_pair,
+        default=None,
+        help="bandwidth cap (kbit/s), as BANDWIDTH or UP/DOWN (default: "
+        "none).",
+    )
+    parser.add_argument(
+        "-r",
+        "--report",
+        type=float,
+        default=10,
+        help="how often to report statistics (s) (default: %(default)s).",
+    )
+    options = parser.parse_args()
+
+    def link_maker(i):
+        delay, jitter = options.delay[i] / 1000, options.jitter[i] / 1000
+        bandwidth = None
+        if options.bandwidth is not None:
+            bandwidth = options.bandwidth[i] * 1000 / 8  # (bytes/s)
+        return lambda: Link(delay, jitter, bandwidth)
+
+    proxy = Proxy(options.host, options.port, link_maker(0), link_maker(1))
+
+    async def run():
+        serving = asyncio.create_task(proxy.serve(options.listen))
+        print(
+            f"forwarding port {options.listen} to "
+            f"{options.host}:{options.port}...",
+            file=sys.stderr,
+        )
+        while not serving.done():
+            await asyncio.wait([serving], timeout=options.report)
+            print(proxy.report(), flush=True)
+        serving.result()
+
+    # (when run in the background and terminated, report as if interrupted)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print(proxy.report())
+
+
+def _parse_pair(string):
+    """
+    Parse a value for both directions, "X" or "UP/DOWN", into a pair of
+    floats (up, down).
+    """
+    try:
+        values = tuple(map(float, string.split("/")))
+    except ValueError:
+        values = ()
+    if len(values) == 1:
+        values *= 2
+    if len(values) != 2 or min(values) < 0:
+        raise argparse.ArgumentTypeError(f"invalid value {string!r}")
+    return values
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Soak-test a battleground server's memory use: start a server (with
+'python -m server', as the load test does), play many games against it
+with simulated clients (the load test's clients, in worker processes), and
+report the resident memory (RSS) of the server's whole process tree every
+so often. In the long-running server, memory should level off after the
+first games, rather than growing with every game played. For example:
+
+    python -m loadtest.soak --games 10000 --every 1000
+
+The clients choose random actions (so games last about 120 turns). The
+exit status is 1 if RSS grows by more than --tolerance MB after the first
+report (which is taken as the warm-up), so that the soak can be rerun to
+check for leaks after changes to the server, the referee, or its logging.
+(The default tolerance allows for the page cache of the game archive's
+index, which SQLite lets grow to about 2MB, over the first ~15,000 games.)
+"""
+
+import sys
+import time
+import argparse
+import multiprocessing
+
+from referee.log import config
+from battleground.protocol import DEFAULT_SERVER_PORT
+from loadtest.main import _start_server, _wait_for_server, _stop_server
+from loadtest.main import _ServerUsage, _run_worker, _share
+from loadtest.main import _raise_file_limit
+from loadtest.options import parse_mix, FRAMINGS, FRAMING_DEFAULT
+from loadtest.options import WORKERS_DEFAULT
+
+
+def soak(host, port, usage, games, every, clients, workers, mix, framing):
+    """
+    Play 'games' games against the server at host:port with 'clients'
+    simulated clients (in 'workers' processes, playing in 'mix', asking for
+    'framing'), and yield (games played, the server's RSS in KiB, client
+    errors so far) every 'every' games, sampling the server's usage with
+    'usage'.
+    """
+    workers = min(workers, clients // 2)
+    played = errors = 0
+    with multiprocessing.Pool(workers) as pool:
+        while played < games:
+            n = min(every, games - played)
+            tasks = [
+                (
+                    i,
+                    host,
+                    port,
+                    _share(clients // 2, workers, i) * 2,
+                    _share(n, workers, i),
+                    mix,
+                    (),  # (no bot channels)
+                    ("const", 0),  # (no think time)
+                    "random",
+                    framing,
+                    False,  # (not pipelined)
+                )
+                for i in range(workers)
+            ]
+            results = pool.map(_run_worker, tasks)
+            played += n
+            errors += sum(r["errors"] for r in results)
+            usage.sample()
+            yield played, usage.rss, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m loadtest.soak",
+        description="start a server, play many games against it, and "
+        "report whether its memory use stays flat.",
+    )
+    parser.add_argument(
+        "-n",
+        "--games",
+        type=int,
+        default=10000,
+        help="number of games to play (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-e",
+        "--every",
+        type=int,
+        default=1000,
+        help="report memory use every this many games (default: "
+        "%(default)s).",
+    )
+    parser.add_argument(
+        "-c",
+        "--clients",
+        type=int,
+        default=100,
+        help="number of simulated clients connected at once (default: "
+        "%(default)s).",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=WORKERS_DEFAULT,
+        help="number of processes to run the clients in (default: "
+        "%(default)s).",
+    )
+    parser.add_argument(
+        "-m",
+        "--mix",
+        type=parse_mix,
+        default="soak:1",
+        help="channel mix, as comma-separated channel:weight pairs "
+        "(default: %(default)s).",
+    )
+    parser.add_argument(
+        "-f",
+        "--framing",
+        choices=FRAMINGS,
+        default=FRAMING_DEFAULT,
+        help="message framing for clients to ask for (default: "
+        "%(default)s).",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=4,
+        help="how much the server's RSS may grow after the first report "
+        "(MB) (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-l",
+        "--server-log",
+        default=None,
+        help="file for the output of the server (default: discard it).",
+    )
+    options = parser.parse_args()
+    config(level=0)  # (no commentary from the clients)
+    _raise_file_limit()
+
+    server, workdir = _start_server(options.server_log)
+    try:
+        _wait_for_server("localhost", DEFAULT_SERVER_PORT)
+        usage = _ServerUsage(server.pid)
+        if not usage.available:
+            sys.exit("can't measure the server's memory (no /proc?)")
+        start = time.monotonic()
+        first = last = None
+        print("   games     RSS (MB)   errors  elapsed (s)")
+        for games, kib, errors in soak(
+            "localhost",
+            DEFAULT_SERVER_PORT,
+            usage,
+            options.games,
+            options.every,
+            options.clients,
+            options.workers,
+            options.mix,
+            options.framing,
+        ):
+            first = kib if first is None else first
+            last = kib
+            print(
+                f"{games:>8} {kib / 1024:>12.1f} {errors:>8} "
+                f"{time.monotonic() - start:>12.0f}",
+                flush=True,
+            )
+    finally:
+        _stop_server(server, workdir)
+    growth = (last - first) / 1024
+    print(
+        f"server RSS ({usage.processes} processes) grew by {growth:.1f}MB "
+        "after the first report"
+    )
+    if growth > options.tolerance:
+        print(f"(more than the tolerance of {options.tolerance}MB)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark the referee's player wrapper: play a trivial player (whose
+methods do nothing) through a PlayerWrapper for as many turns as a game can
+last, at verbosity 0, without limits, with a time limit, and with a space
+limit, and report the wrapper's time per call (to action or update) in
+each case. For example:
+
+    python -m loadtest.wrapper --turns 360 --repeats 20
+
+Before every call, the wrapper collects garbage (to keep collection off the
+player's clock); with --no-gc, collection is skipped, to show the rest of
+the wrapper's overhead, which is otherwise lost in the collection's.
+"""
+
+import gc
+import time
+import argparse
+
+from referee.log import config
+from referee.player import PlayerWrapper, set_space_line
+
+# The longest a game can last (turns)
+MAX_TURNS = 360
+
+# Limits for the limited runs (generous, so that the player never exceeds
+# them: seconds of CPU time, and MB)
+TIME_LIMIT = 60
+SPACE_LIMIT = 1000
+
+# (the configurations to measure: name -> PlayerWrapper keyword arguments)
+LIMITS = {
+    "no limits": {},
+    "time limit": {"time_limit": TIME_LIMIT},
+    "space limit": {"space_limit": SPACE_LIMIT},
+}
+
+
+class IdlePlayer:
+    """
+    A player whose methods do nothing (always playing the same action), so
+    that the wrapper's overhead is all there is to measure.
+    """
+
+    def __init__(self, colour):
+        pass
+
+    def action(self):
+        return ("THROW", "r", (4, -2))
+
+    def update(self, opponent_action, player_action):
+        pass
+
+
+def measure(turns, repeats, **limits):
+    """
+    Return the best time per call (seconds) over 'repeats' runs of 'turns'
+    turns (one action and one update each) of an IdlePlayer wrapped with
+    'limits'.
+    """
+    wrapper = PlayerWrapper("idle", (__name__, "IdlePlayer"), **limits)
+    wrapper.init("upper")
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(turns):
+            action = wrapper.action()
+            wrapper.update(action, action)
+        best = min(best, time.perf_counter() - start)
+    return best / (2 * turns)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m loadtest.wrapper",
+        description="measure the referee's player wrapper's overhead per "
+        "call.",
+    )
+    parser.add_argument(
+        "-n",
+        "--turns",
+        type=int,
+        default=MAX_TURNS,
+        help="number of turns to play in each run (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=20,
+        help="number of runs, taking the fastest (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--no-gc",
+        action="store_true",
+        help="skip the garbage collection before each call.",
+    )
+    options = parser.parse_args()
+    config(level=0)  # (headless, as in the server)
+    set_space_line()
+    if options.no_gc:
+        gc.collect = lambda: 0
+
+    print(
+        f"{2 * options.turns} calls over {options.turns} turns, best of "
+        f"{options.repeats} runs{' (no gc)' if options.no_gc else ''}:"
+    )
+    for name, limits in LIMITS.items():
+        per_call = measure(options.turns, options.repeats, **limits)
+        print(f"{name:>12}: {1e6 * per_call:8.1f}us per call")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,10 +15,10 @@ structures for representing the state of a game.
 
 import sys
 import time
-import logging
 import collections
 
-from referee.log import comment
+from referee.log import comment, wants
+from referee.gamelog import open_game_log, _FORMAT_ACTION
 
 # Game-specific constants for use in other modules:
 
@@ -40,7 +40,9 @@ def play(
     use_unicode=False,
     log_filename=None,
     log_file=None,
+    log_format="text",
     out_function=comment,
+    turn_function=None,
 ):
     """
     Coordinate a game, return a string describing the result.
@@ -57,8 +59,14 @@ def play(
     * use_colour     -- Use ANSI colour codes for output.
     * use_unicode    -- Use unicode symbols for output.
     * log_filename   -- If not None, log all game actions to this path.
+    * log_file       -- If not None, log all game actions to this (already
+                        open) text stream instead.
+    * log_format     -- Format of the game log, "text" (default) or "jsonl"
+                        (see referee.gamelog).
     * out_function   -- Use this function (instead of default 'comment')
                         for all output messages.
+    * turn_function  -- If not None, call this function with the game and
+                        both actions after each turn has been applied.
     """
     # Configure behaviour of this function depending on parameters:
     if delay > 0:
@@ -98,7 +106,9 @@ def play(
 
     # Set up a new game and initialise the players (constructing the
     # Player classes including running their .__init__() methods).
-    game = Game(log_filename=log_filename, log_file=log_file)
+    game = Game(
+        log_filename=log_filename, log_file=log_file, log_format=log_format
+    )
     comment("initialising players", depth=-1)
     for player, colour in zip(players, COLOURS):
         # NOTE: `player` here is actually a player wrapper. Your program
@@ -116,7 +126,8 @@ def play(
     turn = 1
     player_1, player_2 = players
     while not game.over():
-        comment(f"Turn {turn}", depth=-1)
+        if wants(level=1):
+            comment(f"Turn {turn}", depth=-1)
 
         # Ask both players for their next action (calling .action() methods)
         action_1 = player_1.action()
@@ -126,6 +137,8 @@ def play(
         # allowed. Display the resulting game state
         game.update(action_1, action_2)
         display_state(game)
+        if turn_function is not None:
+            turn_function(game, action_1, action_2)
 
         # Notify both players of the actions (via .update() methods)
         player_1.update(opponent_action=action_2, player_action=action_1)
@@ -195,7 +208,7 @@ class Game:
     are __init__, update, over, end, and __str__.
     """
 
-    def __init__(self, log_filename=None, log_file=None):
+    def __init__(self, log_filename=None, log_file=None, log_format="text"):
         # initialise game board state, and both players with zero throws
         self.board = {x: [] for x in _ORD_HEXES}
         self.throws = {"upper": 0, "lower": 0}
@@ -206,19 +219,8 @@ class Game:
         self.history = collections.Counter({self._snap(): 1})
         self.result = None
 
-        if log_file is not None:
-            self.logger = logging.getLogger(name=log_filename)
-            self.logger.addHandler(logging.StreamHandler(log_file))
-            self.logger.setLevel(logging.INFO)
-            self.handler = None
-        elif log_filename is not None:
-            self.logger = logging.getLogger(name=log_filename)
-            self.handler = logging.FileHandler(log_filename, mode="w")
-            self.logger.addHandler(self.handler)
-            self.logger.setLevel(logging.INFO)
-        else:
-            self.logger = logging.getLogger()  # logger with no handlers
-            self.handler = None
+        # game log writer (see referee.gamelog)
+        self.log = open_game_log(log_filename, log_file, log_format)
 
     def update(self, upper_action, lower_action):
         """
@@ -231,7 +233,7 @@ class Game:
         for action, c in [(upper_action, "upper"), (lower_action, "lower")]:
             actions = list(self._available_actions(c))
             if action not in actions:
-                self.logger.info(f"error: {c}: illegal action {action!r}")
+                self.log.error(c, action)
                 self.close()
                 available_actions_list_str = "\n* ".join(
                     [f"{a!r} - {_FORMAT_ACTION(a)}" for a in actions]
@@ -285,12 +287,7 @@ class Game:
         # return a sanitised version of the action to avoid action injection?
 
         # Log the action (if logging is enabled)
-        self.logger.info(
-            f"turn {self.nturns}: upper: {_FORMAT_ACTION(upper_action)}"
-        )
-        self.logger.info(
-            f"turn {self.nturns}: lower: {_FORMAT_ACTION(lower_action)}"
-        )
+        self.log.turn(self.nturns, upper_action, lower_action)
 
     def _available_actions(self, colour):
         """
@@ -418,15 +415,12 @@ class Game:
         If the game is not over this is a no-op.
         """
         if self.result:
-            self.logger.info(self.result)
+            self.log.result(self.result)
             self.close()
         return self.result
     
     def close(self):
-        if self.handler is not None:
-            self.handler.close()
-            self.logger.removeHandler(self.handler)
-            self.handler = None
+        self.log.close()
 
 
 # # #
@@ -571,10 +565,3 @@ throws:' `-.      ,-' `-._,-' `-._,-' `-._,-' `-._,-' `-.
                   `-._,-' `-._,-' `-._,-' `-._,-' `-._,-'         `-._,-'
 {64:}"""
 
-
-def _FORMAT_ACTION(action):
-    atype, *aargs = action
-    if atype == "THROW":
-        return "THROW symbol {} to {}".format(*aargs)
-    else:  # atype == "SLIDE" or "SWING":
-        return "{} from {} to {}".format(atype, *aargs)
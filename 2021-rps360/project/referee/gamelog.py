@@ -0,0 +1,195 @@
+"""
+Provide game log writers, for recording the actions and result of a game
+either in the human-readable text format, or in a compact structured format
+(JSON lines, written through the file's own buffer).
+
+Structured logs can be converted back into the text format with the
+`convert_to_text` function, or from the command line:
+
+    python -m referee.gamelog game.jsonl
+"""
+
+import sys
+import json
+
+# Supported log formats (the first is the default):
+LOG_FORMATS = "text", "jsonl"
+
+# Version of the structured log format, recorded in the header line:
+JSONL_VERSION = 1
+
+
+def open_game_log(log_filename=None, log_file=None, log_format="text"):
+    """
+    Create a game log writer appropriate for the given arguments.
+
+    Arguments:
+    * log_filename -- If not None, log all game actions to this path.
+    * log_file     -- If not None, log all game actions to this (already
+                      open) text stream instead.
+    * log_format   -- One of LOG_FORMATS.
+    """
+    if log_format == "text":
+        return TextGameLog(log_filename=log_filename, log_file=log_file)
+    elif log_format == "jsonl":
+        return JSONGameLog(log_filename=log_filename, log_file=log_file)
+    raise ValueError(f"Unknown log format {log_format!r}")
+
+
+class TextGameLog:
+    """
+    Write a human-readable game log (one line per half-turn, written
+    immediately).
+
+    Writes straight to the file, rather than through the logging module, so
+    that long-running programs (like the server) don't accumulate a logger
+    per game in the logging module's global registry. Closing the log
+    releases the file (if the log opened it) and all references to it.
+    """
+
+    def __init__(self, log_filename=None, log_file=None):
+        if log_file is not None:
+            self.file = log_file
+            self.owns_file = False
+        elif log_filename is not None:
+            self.file = open(log_filename, "w")
+            self.owns_file = True
+        else:
+            self.file = None
+            self.owns_file = False
+
+    def turn(self, nturns, upper_action, lower_action):
+        self._write(*_format_turn(nturns, upper_action, lower_action))
+
+    def error(self, colour, action):
+        self._write(_format_error(colour, repr(action)))
+
+    def result(self, result):
+        self._write(result)
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.owns_file:
+            self.file.close()
+        self.file = None
+
+    def _write(self, *lines):
+        if self.file is not None:
+            for line in lines:
+                self.file.write(line + "\n")
+            self.file.flush()
+
+
+class JSONGameLog:
+    """
+    Write a structured game log, one JSON object per line: a header, then
+    one record per turn (with both players' actions), then the result (or
+    error).
+
+    The records are buffered in memory only by the file itself: each is
+    written to the file as soon as it is made, and the file is only flushed
+    when it fills its buffer, or when the log is closed. (They are not held
+    back in a buffer of our own until close, since close is not called when
+    play is cut short by an exception, e.g. from a player, and the log of
+    such a game, the one most worth keeping, would be lost.)
+    """
+
+    def __init__(self, log_filename=None, log_file=None):
+        if log_file is not None:
+            self.file = log_file
+            self.owns_file = False
+        elif log_filename is not None:
+            self.file = open(log_filename, "w")
+            self.owns_file = True
+        else:
+            self.file = None
+            self.owns_file = False
+        self._write({"format": "jsonl", "version": JSONL_VERSION})
+
+    def turn(self, nturns, upper_action, lower_action):
+        self._write(
+            {"turn": nturns, "upper": upper_action, "lower": lower_action}
+        )
+
+    def error(self, colour, action):
+        self._write({"error": colour, "action": repr(action)})
+
+    def result(self, result):
+        self._write({"result": result})
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.flush()
+        if self.owns_file:
+            self.file.close()
+        self.file = None
+
+    def _write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def convert_to_text(lines):
+    """
+    Generate the lines of a text-format game log, given the lines of a
+    structured (JSON lines) game log.
+    """
+    lines = iter(lines)
+    header = json.loads(next(lines))
+    if header.get("format") != "jsonl":
+        raise ValueError("Not a structured game log (missing header)")
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if "turn" in record:
+            yield from _format_turn(
+                record["turn"],
+                _deep_tuple(record["upper"]),
+                _deep_tuple(record["lower"]),
+            )
+        elif "error" in record:
+            yield _format_error(record["error"], record["action"])
+        elif "result" in record:
+            yield record["result"]
+
+
+# Helper functions for formatting log lines. Both formats must produce the
+# same text lines, so they share these.
+
+
+def _format_turn(nturns, upper_action, lower_action):
+    return (
+        f"turn {nturns}: upper: {_FORMAT_ACTION(upper_action)}",
+        f"turn {nturns}: lower: {_FORMAT_ACTION(lower_action)}",
+    )
+
+
+def _format_error(colour, action_repr):
+    return f"error: {colour}: illegal action {action_repr}"
+
+
+def _deep_tuple(item):
+    """
+    Convert a nested list (such as a JSON-decoded action) to a nested tuple.
+    """
+    if isinstance(item, list):
+        return tuple(_deep_tuple(i) for i in item)
+    return item
+
+
+def _FORMAT_ACTION(action):
+    atype, *aargs = action
+    if atype == "THROW":
+        return "THROW symbol {} to {}".format(*aargs)
+    else:  # atype == "SLIDE" or "SWING":
+        return "{} from {} to {}".format(atype, *aargs)
+
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        with open(filename) as log:
+            for line in convert_to_text(log):
+                print(line)
@@ -48,6 +48,13 @@ class StarLog:
         else:
             self.clear = ""
 
+    def wants(self, level):
+        """
+        True iff messages at this level would be printed (so that callers can
+        avoid preparing messages that nobody wants).
+        """
+        return level <= self.level
+
     def log(self, *args, level=None, depth=0, clear=False, **kwargs):
         """
         Log a message if warranted by this log's verbosity level setting.
@@ -125,6 +132,13 @@ def log(*args, **kwargs):
     _DEFAULT_STARLOG.log(*args, **kwargs)
 
 
+def wants(level):
+    """
+    See StarLog.wants.
+    """
+    return _DEFAULT_STARLOG.wants(level)
+
+
 def print(*args, **kwargs):
     """Shortcut to log at level 0 (always)."""
     log(*args, level=0, **kwargs)
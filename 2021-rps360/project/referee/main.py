@@ -50,6 +50,7 @@ def main():
             use_colour=options.use_colour,
             use_unicode=options.use_unicode,
             log_filename=options.logfile,
+            log_format=options.logformat,
         )
         # Display the final result of the game to the user.
         comment("game over!", depth=-1)
@@ -4,7 +4,8 @@ Provide a command-line argument parsing function using argparse
 
 -----------------------------------------------------------------------------
 usage: referee [-h] [-V] [-d [delay]] [-s [space_limit]] [-t [time_limit]]
-               [-D | -v [{0,1,2,3}]] [-l [LOGFILE]] [-c | -C] [-u | -a]
+               [-D | -v [{0,1,2,3}]] [-l [LOGFILE]] [-L {text,jsonl}]
+               [-c | -C] [-u | -a]
                upper lower
 
 conduct a game of RoPaSci 360 between 2 Player classes.
@@ -52,6 +53,10 @@ optional arguments:
                         if you supply this flag the referee will create a
                         log of all game actions in a text file named LOGFILE
                         (default: game.log).
+  -L {text,jsonl}, --logformat {text,jsonl}
+                        format of the log file. text: (default) human-readable
+                        log; jsonl: compact structured log (convert to text
+                        with `python -m referee.gamelog LOGFILE`).
   -c, --colour          force colour display using ANSI control sequences
                         (default behaviour is automatic based on system).
   -C, --colourless      force NO colour display (see -c).
@@ -65,6 +70,7 @@ optional arguments:
 import sys
 import argparse
 from referee.game import GAME_NAME, COLOURS, NUM_PLAYERS
+from referee.gamelog import LOG_FORMATS
 
 # Program information:
 PROGRAM = "referee"
@@ -98,6 +104,7 @@ VERBOSITY_NOVALUE = 3  # highest level, debug board
 
 LOGFILE_DEFAULT = None
 LOGFILE_NOVALUE = "game.log"
+LOGFORMAT_DEFAULT = LOG_FORMATS[0]
 
 PKG_SPEC_HELP = """
 The first {} arguments are 'package specifications'. These specify which
@@ -226,6 +233,16 @@ def get_options():
         "all game actions in a text file named %(metavar)s "
         "(default: %(const)s).",
     )
+    optionals.add_argument(
+        "-L",
+        "--logformat",
+        type=str,
+        choices=LOG_FORMATS,
+        default=LOGFORMAT_DEFAULT,
+        help="format of the log file. text: (default) human-readable log; "
+        "jsonl: compact structured log (convert to text with `python -m "
+        "referee.gamelog LOGFILE`).",
+    )
 
     colour_group = optionals.add_mutually_exclusive_group()
     colour_group.add_argument(
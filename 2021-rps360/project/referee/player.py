@@ -2,13 +2,19 @@
 Provide a wrapper for Player classes to handle tedious details like
 timing, measuring space usage, reporting which method is currently
 being executed, etc.
+
+Commentary (and the measurements it reports) is only prepared when the
+referee's log wants it, so at verbosity 0 the wrapper runs headless, adding
+as little overhead as possible to each call.
 """
 
 import gc
+import os
 import time
+import atexit
 import importlib
 
-from referee.log import comment, print
+from referee.log import comment, print, wants
 from referee.game import NUM_PLAYERS
 
 
@@ -23,7 +29,7 @@ class PlayerWrapper:
     """
 
     def __init__(self, name, player_loc, time_limit=None, space_limit=None):
-        self.name = name
+        self.base_name = self.name = name
 
         # create some context managers for resource limiting
         self.timer = _CountdownTimer(time_limit, self.name)
@@ -41,7 +47,9 @@ class PlayerWrapper:
 
     def init(self, colour):
         self.colour = colour
-        self.name += f" ({colour})"
+        # (the same wrapper may play several games, each with a new player)
+        self.name = f"{self.base_name} ({colour})"
+        self.timer.clock = 0
         player_cls = str(self.Player).strip("<class >")
         comment(f"initialising {self.colour} player as a {player_cls}")
         with self.space, self.timer:
@@ -51,23 +59,29 @@ class PlayerWrapper:
         comment(self.space.status(), depth=1)
 
     def action(self):
-        comment(f"asking {self.name} for next action...")
+        verbose = wants(level=1)
+        if verbose:
+            comment(f"asking {self.name} for next action...")
         with self.space, self.timer:
             # ask the real player
             action = self.player.action()
-        comment(f"{self.name} returned action: {action!r}", depth=1)
-        comment(self.timer.status(), depth=1)
-        comment(self.space.status(), depth=1)
+        if verbose:
+            comment(f"{self.name} returned action: {action!r}", depth=1)
+            comment(self.timer.status(), depth=1)
+            comment(self.space.status(), depth=1)
         # give back the result
         return action
 
     def update(self, opponent_action, player_action):
-        comment(f"updating {self.name} with actions...")
+        verbose = wants(level=1)
+        if verbose:
+            comment(f"updating {self.name} with actions...")
         with self.space, self.timer:
             # forward to the real player
             self.player.update(opponent_action, player_action)
-        comment(self.timer.status(), depth=1)
-        comment(self.space.status(), depth=1)
+        if verbose:
+            comment(self.timer.status(), depth=1)
+            comment(self.space.status(), depth=1)
 
 
 def _load_player_class(package_name, class_name):
@@ -102,14 +116,17 @@ class _CountdownTimer:
         """
         self.name = name
         self.limit = time_limit
+        self.limited = time_limit is not None and time_limit > 0
         self.clock = 0
-        self._status = ""
-
-    def _set_status(self, status):
-        self._status = status
+        self.elapsed = None
 
     def status(self):
-        return self._status
+        if self.elapsed is None:
+            return ""
+        return (
+            f"time:  +{self.elapsed:6.3f}s  (just elapsed)  "
+            f"{self.clock:7.3f}s  (game total)"
+        )
 
     def __enter__(self):
         # clean up memory off the clock
@@ -120,15 +137,11 @@ class _CountdownTimer:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         # accumulate elapsed time since __enter__
-        elapsed = time.process_time() - self.start
-        self.clock += elapsed
-        self._set_status(
-            f"time:  +{elapsed:6.3f}s  (just elapsed)  "
-            f"{self.clock:7.3f}s  (game total)"
-        )
+        self.elapsed = time.process_time() - self.start
+        self.clock += self.elapsed
 
         # if we are limited, let's hope we aren't out of time!
-        if self.limit is not None and self.limit > 0:
+        if self.limited:
             if self.clock > self.limit:
                 raise ResourceLimitException(
                     f"{self.name} exceeded available time"
@@ -143,45 +156,45 @@ class _MemoryWatcher:
     * works by parsing procfs; only available on linux.
     * unless the limit is set to 0, throws an exception upon exiting the
       context if the memory limit has been breached
+    * without a limit, only measures usage when asked for its status
     """
 
     def __init__(self, space_limit):
         self.limit = space_limit
-        self._status = ""
-
-    def _set_status(self, status):
-        self._status = status
+        self.limited = space_limit is not None and space_limit > 0
 
     def status(self):
-        return self._status
+        if not _SPACE_ENABLED:
+            return ""
+        curr_usage, peak_usage = self._measure()
+        return (
+            f"space: {curr_usage:7.3f}MB (current usage) "
+            f"{peak_usage:7.3f}MB (max usage) (shared)"
+        )
 
     def __enter__(self):
         return self  # unused
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
-        Check up on the current and peak space usage of the process, printing
-        stats and ensuring that peak usage is not exceeding limits
+        Check up on the peak space usage of the process, ensuring that peak
+        usage is not exceeding limits
         """
-        if _SPACE_ENABLED:
-            curr_usage, peak_usage = _get_space_usage()
-
-            # adjust measurements to reflect usage of players and referee, not
-            # the Python interpreter itself
-            curr_usage -= _DEFAULT_MEM_USAGE
-            peak_usage -= _DEFAULT_MEM_USAGE
-
-            self._set_status(
-                f"space: {curr_usage:7.3f}MB (current usage) "
-                f"{peak_usage:7.3f}MB (max usage) (shared)"
-            )
+        # if we are limited, let's hope we are not out of space!
+        if _SPACE_ENABLED and self.limited:
+            _, peak_usage = self._measure()
+            if peak_usage > self.limit:
+                raise ResourceLimitException(
+                    "players exceeded shared space limit"
+                )
 
-            # if we are limited, let's hope we are not out of space!
-            if self.limit is not None and self.limit > 0:
-                if peak_usage > self.limit:
-                    raise ResourceLimitException(
-                        "players exceeded shared space limit"
-                    )
+    def _measure(self):
+        curr_usage, peak_usage = _get_space_usage()
+        # adjust measurements to reflect usage of players and referee, not
+        # the Python interpreter itself
+        curr_usage -= _DEFAULT_MEM_USAGE
+        peak_usage -= _DEFAULT_MEM_USAGE
+        return curr_usage, peak_usage
 
 
 def _get_space_usage():
@@ -190,16 +203,40 @@ def _get_space_usage():
     in MB
     """
     # on linux, we can find the memory usage of our program we seek
-    # inside /proc/self/status (specifically, fields VmSize and VmPeak)
-    with open("/proc/self/status") as proc_status:
-        for line in proc_status:
-            if "VmSize:" in line:
-                curr_usage = int(line.split()[1]) / 1024  # kB -> MB
-            elif "VmPeak:" in line:
-                peak_usage = int(line.split()[1]) / 1024  # kB -> MB
+    # inside /proc/self/status (specifically, fields VmSize and VmPeak).
+    # keep the file open between calls (this is called for every timed
+    # call when a space limit is set); re-reading from the start gives
+    # fresh figures. (but reopen it in a forked child, since 'self' was
+    # resolved to the parent when the file was opened)
+    global _PROC_STATUS, _PROC_STATUS_PID
+    if _PROC_STATUS is None or _PROC_STATUS_PID != os.getpid():
+        if _PROC_STATUS is not None:
+            _PROC_STATUS.close()  # (our copy of the parent's file)
+        _PROC_STATUS = open("/proc/self/status")
+        _PROC_STATUS_PID = os.getpid()
+    _PROC_STATUS.seek(0)
+    status = _PROC_STATUS.read()
+    # (find the two fields directly, rather than checking all ~60 lines)
+    curr_usage = _status_kb(status, "VmSize:") / 1024  # kB -> MB
+    peak_usage = _status_kb(status, "VmPeak:") / 1024  # kB -> MB
     return curr_usage, peak_usage
 
 
+def _status_kb(status, field):
+    # (the value of a field like "VmPeak:\t  123456 kB" in the status)
+    start = status.index(field) + len(field)
+    return int(status[start : status.index("kB", start)])
+
+
+@atexit.register
+def _close_proc_status():
+    if _PROC_STATUS is not None:
+        _PROC_STATUS.close()
+
+
+_PROC_STATUS = None
+_PROC_STATUS_PID = None
+
 _DEFAULT_MEM_USAGE = 0
 
 _SPACE_ENABLED = False
@@ -0,0 +1,3 @@
+from selfplay.main import main
+
+main()
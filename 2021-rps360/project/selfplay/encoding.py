@@ -0,0 +1,78 @@
+"""
+Encode game states and actions as fixed-shape integer arrays, for use in
+training evaluation functions from self-play data.
+
+A state is encoded as:
+* tokens -- uint8 array of shape (NUM_HEXES, 6), the number of tokens of
+            each kind ("RPSrps", in that order) on each hex (hexes in the
+            same order as the referee's board display, see HEXES).
+* throws -- uint8 array of shape (2,), the number of throws used by upper
+            and lower.
+
+An action is encoded as four small integers (atype, symbol, source,
+target), where atype indexes ACTION_TYPES, symbol indexes SYMBOLS (or is -1
+for slides and swings), and source and target index HEXES (source is -1 for
+throws).
+"""
+
+import numpy as np
+
+from referee.game import _ORD_HEXES
+
+HEXES = tuple(_ORD_HEXES)
+HEX_INDEX = {x: i for i, x in enumerate(HEXES)}
+NUM_HEXES = len(HEXES)
+
+TOKENS = "RPSrps"
+TOKEN_INDEX = {t: i for i, t in enumerate(TOKENS)}
+
+ACTION_TYPES = "THROW", "SLIDE", "SWING"
+SYMBOLS = "rps"
+
+
+def encode_state(game):
+    """
+    Return the (tokens, throws) arrays encoding the state of a referee Game.
+    """
+    tokens = np.zeros((NUM_HEXES, len(TOKENS)), dtype=np.uint8)
+    for x, symbols in game.board.items():
+        for s in symbols:
+            tokens[HEX_INDEX[x], TOKEN_INDEX[s]] += 1
+    throws = np.array(
+        [game.throws["upper"], game.throws["lower"]], dtype=np.uint8
+    )
+    return tokens, throws
+
+
+def encode_action(action):
+    """
+    Return the (atype, symbol, source, target) encoding of an action.
+    """
+    atype, *aargs = action
+    if atype == "THROW":
+        s, x = aargs
+        return (0, SYMBOLS.index(s), -1, HEX_INDEX[x])
+    x, y = aargs
+    return (ACTION_TYPES.index(atype), -1, HEX_INDEX[x], HEX_INDEX[y])
+
+
+def decode_action(code):
+    """
+    Return the action tuple encoded by (atype, symbol, source, target).
+    """
+    atype, symbol, source, target = (int(c) for c in code)
+    if atype == 0:
+        return ("THROW", SYMBOLS[symbol], HEXES[target])
+    return (ACTION_TYPES[atype], HEXES[source], HEXES[target])
+
+
+def encode_result(result):
+    """
+    Return the outcome of a game, from upper's point of view: +1 if upper
+    won, -1 if lower won, 0 for a draw.
+    """
+    if result == "winner: upper":
+        return 1
+    if result == "winner: lower":
+        return -1
+    return 0
@@ -0,0 +1,120 @@
+"""
+Driver program to generate a self-play dataset: play many games between two
+Player classes in worker processes, encoding each turn as fixed-shape
+arrays, and writing them to an append-only dataset of .npy shards (see
+selfplay.shards).
+"""
+
+import os
+import time
+import multiprocessing
+
+from referee.log import config, print, comment
+from referee.game import play, Game, IllegalActionException
+from referee.player import PlayerWrapper, ResourceLimitException
+from selfplay.encoding import encode_state, encode_action, encode_result
+from selfplay.shards import write_shard, append_manifest, read_manifest
+from selfplay.options import get_options
+
+
+def main():
+    options = get_options()
+    config(level=options.verbosity)
+
+    os.makedirs(options.out, exist_ok=True)
+    # continue numbering after any shards already in the dataset
+    first_shard = len(read_manifest(options.out))
+    nshards = -(-options.games // options.shard_games)  # (ceiling)
+    tasks = [
+        (
+            options.out,
+            f"shard-{first_shard + i:06d}",
+            min(options.shard_games, options.games - i * options.shard_games),
+            options.player1_loc,
+            options.player2_loc,
+        )
+        for i in range(nshards)
+    ]
+
+    comment(
+        f"playing {options.games} games in {nshards} shards "
+        f"using {options.workers} worker processes...",
+    )
+    start = time.time()
+    ngames = nrows = 0
+    pool = multiprocessing.Pool(options.workers, initializer=_init_worker)
+    with pool:
+        # (the parent process is the only writer of the manifest)
+        for entry in pool.imap_unordered(_play_shard, tasks):
+            append_manifest(options.out, entry)
+            ngames += entry["games"]
+            nrows += entry["rows"]
+            comment(
+                f"wrote {entry['name']}: {entry['games']} games, "
+                f"{entry['rows']} turns ({entry['errors']} games discarded)",
+                depth=1,
+            )
+    elapsed = time.time() - start
+    print(
+        f"{ngames} games ({nrows} turns) in {elapsed:.1f}s "
+        f"written to {options.out}"
+    )
+
+
+def _init_worker():
+    # players' and referee's commentary would only get in the way here
+    config(level=-1)
+
+
+def _play_shard(task):
+    """
+    Play a shard's worth of games and write them to the dataset (in a
+    worker process). Return the shard's manifest entry.
+    """
+    directory, name, ngames, player1_loc, player2_loc = task
+    rows = {"tokens": [], "throws": [], "turn": [], "actions": []}
+    rows["outcome"], rows["game"] = [], []
+    errors = 0
+    for game_index in range(ngames):
+        try:
+            turns, result = _play_game(player1_loc, player2_loc)
+        except (IllegalActionException, ResourceLimitException):
+            errors += 1
+            continue
+        outcome = encode_result(result)
+        for turn, (tokens, throws, actions) in enumerate(turns, 1):
+            rows["tokens"].append(tokens)
+            rows["throws"].append(throws)
+            rows["turn"].append(turn)
+            rows["actions"].append(actions)
+            rows["outcome"].append(outcome)
+            rows["game"].append(game_index)
+    nrows = write_shard(directory, name, rows)
+    return {
+        "name": name,
+        "games": ngames - errors,
+        "rows": nrows,
+        "errors": errors,
+    }
+
+
+def _play_game(player1_loc, player2_loc):
+    """
+    Play one game, returning the list of encoded turns (state before the
+    turn, and both actions) and the result.
+    """
+    players = [
+        PlayerWrapper("player 1", player1_loc),
+        PlayerWrapper("player 2", player2_loc),
+    ]
+    turns = []
+    state = encode_state(Game())
+
+    def record(game, upper_action, lower_action):
+        nonlocal state
+        actions = encode_action(upper_action), encode_action(lower_action)
+        turns.append((*state, actions))
+        state = encode_state(game)
+
+    result = play(players, print_state=False, turn_function=record)
+    return turns, result
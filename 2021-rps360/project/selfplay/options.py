@@ -0,0 +1,131 @@
+"""
+Provide a command-line argument parsing function using argparse
+(resulting in the following help message):
+
+-----------------------------------------------------------------------------
+usage: selfplay [-h] [-n GAMES] [-g SHARD_GAMES] [-w WORKERS] [-o OUT]
+                [-v [{0,1}]]
+                upper lower
+
+generate a dataset of RoPaSci 360 games between 2 Player classes.
+
+player package/class specifications (positional args):
+  upper                 location of Upper's Player class (e.g. package name)
+  lower                 location of Lower's Player class (e.g. package name)
+
+optional arguments:
+  -h, --help            show this message.
+  -n GAMES, --games GAMES
+                        total number of games to play (default: 1000).
+  -g SHARD_GAMES, --shard-games SHARD_GAMES
+                        number of games to store in each shard (default: 100).
+  -w WORKERS, --workers WORKERS
+                        number of worker processes (default: number of CPUs).
+  -o OUT, --out OUT     dataset directory, created if necessary; new shards
+                        are appended to any already there (default: selfplay-
+                        data).
+  -v [{0,1}], --verbosity [{0,1}]
+                        control the level of output. 0: only a final summary;
+                        1: (default) also report each shard.
+-----------------------------------------------------------------------------
+"""
+
+import os
+import argparse
+from referee.game import GAME_NAME, COLOURS, NUM_PLAYERS
+from referee.options import PackageSpecAction
+
+# Program information:
+PROGRAM = "selfplay"
+DESCRIP = (
+    f"generate a dataset of {GAME_NAME} games between {NUM_PLAYERS} Player "
+    "classes."
+)
+
+# default values (to use if flag is not provided)
+# and missing values (to use if flag is provided, but with no value)
+
+GAMES_DEFAULT = 1000
+SHARD_GAMES_DEFAULT = 100
+WORKERS_DEFAULT = os.cpu_count() or 1
+OUT_DEFAULT = "selfplay-data"
+
+VERBOSITY_LEVELS = 2
+VERBOSITY_DEFAULT = 1
+VERBOSITY_NOVALUE = 1
+
+
+def get_options():
+    """Parse and return command-line arguments."""
+
+    parser = argparse.ArgumentParser(
+        prog=PROGRAM,
+        description=DESCRIP,
+        add_help=False,  # <-- we will add it back to the optional group.
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+    # positional arguments used for player package specifications:
+    positionals = parser.add_argument_group(
+        title="player package/class specifications (positional args)",
+    )
+    for num, col in enumerate(COLOURS, 1):
+        Col = col.title()
+        positionals.add_argument(
+            f"player{num}_loc",
+            metavar=col,
+            action=PackageSpecAction,
+            help=f"location of {Col}'s Player class (e.g. package name)",
+        )
+
+    # optional arguments used for configuration:
+    optionals = parser.add_argument_group(title="optional arguments")
+    optionals.add_argument(
+        "-h",
+        "--help",
+        action="help",
+        help="show this message.",
+    )
+    optionals.add_argument(
+        "-n",
+        "--games",
+        type=int,
+        default=GAMES_DEFAULT,
+        help="total number of games to play (default: %(default)s).",
+    )
+    optionals.add_argument(
+        "-g",
+        "--shard-games",
+        type=int,
+        default=SHARD_GAMES_DEFAULT,
+        help="number of games to store in each shard (default: "
+        "%(default)s).",
+    )
+    optionals.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=WORKERS_DEFAULT,
+        help="number of worker processes (default: number of CPUs).",
+    )
+    optionals.add_argument(
+        "-o",
+        "--out",
+        type=str,
+        default=OUT_DEFAULT,
+        help="dataset directory, created if necessary; new shards are "
+        "appended to any already there (default: %(default)s).",
+    )
+    optionals.add_argument(
+        "-v",
+        "--verbosity",
+        type=int,
+        choices=range(0, VERBOSITY_LEVELS),
+        nargs="?",
+        default=VERBOSITY_DEFAULT,
+        const=VERBOSITY_NOVALUE,
+        help="control the level of output. 0: only a final summary; "
+        "1: (default) also report each shard.",
+    )
+
+    return parser.parse_args()
@@ -0,0 +1,93 @@
+"""
+Store self-play data as append-only shards of .npy arrays, which training
+code can memory-map and stream without loading the whole dataset.
+
+A dataset directory contains a number of shards and a manifest. Each shard
+is a set of .npy files (one per field in FIELDS) holding one row per turn
+played. Shards are never modified once written; the manifest (one JSON
+object per line, one line per shard) is only ever appended to, and only
+lists complete shards.
+"""
+
+import os
+import json
+
+import numpy as np
+
+from selfplay.encoding import NUM_HEXES, TOKENS
+
+MANIFEST = "manifest.jsonl"
+
+# Field name -> (dtype, shape of each row):
+FIELDS = {
+    "tokens": (np.uint8, (NUM_HEXES, len(TOKENS))),  # state before turn
+    "throws": (np.uint8, (2,)),  # state before turn
+    "turn": (np.int16, ()),  # turn number (from 1)
+    "actions": (np.int8, (2, 4)),  # upper's and lower's encoded actions
+    "outcome": (np.int8, ()),  # final outcome, from upper's point of view
+    "game": (np.int32, ()),  # index of game within shard
+}
+
+
+def write_shard(directory, name, rows):
+    """
+    Write the shard `name` into `directory`, given `rows`, a dict from each
+    field name to a list of row values. Each array is written under a
+    temporary name and then renamed, so that a shard file is either
+    complete or absent. Return the number of rows written.
+    """
+    nrows = len(rows["turn"])
+    for field, (dtype, shape) in FIELDS.items():
+        array = np.lib.format.open_memmap(
+            _path(directory, name, field) + ".tmp",
+            mode="w+",
+            dtype=dtype,
+            shape=(nrows, *shape),
+        )
+        if nrows:
+            array[:] = rows[field]
+        array.flush()
+        del array
+        os.replace(
+            _path(directory, name, field) + ".tmp",
+            _path(directory, name, field),
+        )
+    return nrows
+
+
+def append_manifest(directory, entry):
+    """
+    Record a completed shard (a dict, including at least its 'name') in the
+    dataset manifest.
+    """
+    with open(os.path.join(directory, MANIFEST), "a") as manifest:
+        manifest.write(json.dumps(entry) + "\n")
+
+
+def read_manifest(directory):
+    """
+    Return the list of manifest entries for all complete shards.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            return [json.loads(line) for line in manifest if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def iter_shards(directory, fields=FIELDS):
+    """
+    Generate, for each complete shard in the dataset, a dict from field name
+    to a read-only memory-mapped array (for the requested fields).
+    """
+    for entry in read_manifest(directory):
+        yield {
+            field: np.load(
+                _path(directory, entry["name"], field), mmap_mode="r"
+            )
+            for field in fields
+        }
+
+
+def _path(directory, name, field):
+    return os.path.join(directory, f"{name}.{field}.npy")
@@ -1,82 +1,440 @@
 """
-Multi-threaded match-making game server
+Asynchronous match-making game server
+
+Each client connection is served by a coroutine (rather than a thread), so
+clients waiting for an opponent cost no more than an idle socket. Matched
+players are queued (in a bounded queue) for a fixed number of game worker
+coroutines, which coordinate their games, with the referee's CPU-bound work
+(validating and applying actions, logging, and running server-controlled
+players) offloaded to a thread pool executor.
+
+Optionally, several such server processes can share the server's port,
+and its matchmaking (see SERVER_PROCESSES).
 """
 
+import io
 import os
+import sys
+import time
+import zlib
 import random
+import signal
+import socket
+import asyncio
+import tempfile
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.connection
 from datetime import datetime
-import threading
-from collections import defaultdict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from referee.log import StarLog
-from referee.game import play, IllegalActionException, COLOURS, NUM_PLAYERS
+from referee.game import Game, IllegalActionException, COLOURS, NUM_PLAYERS
 from battleground.protocol import DisconnectException, ProtocolException
-from battleground.protocol import Connection, MessageType as M
+from battleground.protocol import TimeoutException
+from battleground.protocol import AsyncConnection, MessageType as M
 from battleground.protocol import DEFAULT_SERVER_PORT
+from battleground.protocol import BINARY_FRAMING, JSON_FRAMING
+from server.bots import BotPool, BotException
+from server import metrics
+from server import broker
+from server.spectate import Spectators
+from server.rating import Ratings, RatedQueue
+from server.tournament import Tournaments
+from server.archive import Archive
+from server.admission import Admission
 
 from cpu import PlayerRandomMixture
 from cpu import PlayerGreedyArmy
 
 
 # The following channels are reserved, and choosing them results in playing
-# a game with server-controlled players:
+# a game with server-controlled players (Player class, and name):
 SPECIAL_CHANNELS = {
-    "random": (lambda: ServerPlayer(PlayerRandomMixture, "randy")),
-    "greedy": (lambda: ServerPlayer(PlayerRandomMixture, "greedo")),
+    "random": (PlayerRandomMixture, "randy"),
+    "greedy": (PlayerRandomMixture, "greedo"),
 }
 
+# How many processes to run server-controlled players in (shared by all
+# games in special channels), and how long each of their moves may take
+# (seconds)
+BOT_PROCESSES = max(1, (os.cpu_count() or 1) // 2)
+BOT_TIME_BUDGET = 2.0
+
 # Print at a higher level of verbosity, including some debugging information
 DEBUG = False  # The matchmaking system seems to be working well from 2019.
 
+# How many threads to use for the referee's CPU-bound work (shared by all
+# games)
+REFEREE_THREADS = os.cpu_count() or 1
+
+# Limits on new connections, so that clients stuck in a reconnect loop (or
+# worse) are turned away before they use up the server's resources (see
+# server/admission.py): at most MAX_CONNECTIONS_PER_ADDRESS connections open
+# from each (IP) address at once, and new connections from each address at
+# most CONNECT_RATE per second (on average, in bursts of up to CONNECT_BURST),
+# and from all addresses together at most TOTAL_CONNECT_RATE per second (in
+# bursts of up to TOTAL_CONNECT_BURST). These limits apply to each server
+# process separately, and not at all to ADMISSION_EXEMPT addresses (e.g. for
+# load testing from localhost). The limits for each address are generous,
+# since a whole class (e.g. behind a campus NAT) may share one address; where
+# each client has its own address, they can be tightened (e.g. to 64, 5, and
+# 50).
+MAX_CONNECTIONS_PER_ADDRESS = 1024
+CONNECT_RATE = 50
+CONNECT_BURST = 500
+TOTAL_CONNECT_RATE = 500
+TOTAL_CONNECT_BURST = 2000
+ADMISSION_EXEMPT = {"127.0.0.1", "::1"}
+
+# How long new clients may take to send their first (PLAY or SPEC) message
+# (seconds)
+HELLO_TIMEOUT = 30
+
+# Whether to agree when clients ask (in their PLAY message) to switch to the
+# protocol's more compact binary framing (see battleground/protocol.py)
+ALLOW_BINARY_FRAMING = True
+
+# Whether to agree when clients ask (in their PLAY message) for pipelined
+# turns, in which each turn's update is sent along with the next turn's TURN
+# message (rather than in an UPD8 message, to which the client must reply
+# before the next turn begins), so that each turn takes one round trip
+# rather than two (see NetworkPlayer)
+ALLOW_PIPELINING = True
+
+# How often to check that waiting players are still connected (seconds).
+# Clients who hang up are noticed from the state of their connections, and
+# those who vanish (without hanging up) by TCP keepalive: once a connection
+# has been idle for TCP_KEEPALIVE[0] seconds, the operating system probes the
+# client every TCP_KEEPALIVE[1] seconds, and gives up on them after
+# TCP_KEEPALIVE[2] probes go unanswered. As a fallback (e.g. for platforms
+# without keepalive settings), waiting players are also pinged (with an OKAY
+# message, which they must echo) every PING_INTERVAL seconds, and dropped
+# unless they reply within PING_TIMEOUT seconds.
+HEARTBEAT_INTERVAL = 10
+TCP_KEEPALIVE = (60, 10, 6)
+PING_INTERVAL = 5 * 60
+PING_TIMEOUT = 10
+
+# How long players may wait for a game, and how often to check (seconds)
+WAITING_TTL = 30 * 60
+SWEEP_INTERVAL = 60
+
+# Limits on the size of the matchmaking pool
+MAX_WAITING_PLAYERS = 10000
+MAX_WAITING_CHANNELS = 5000
+
+# Channels in which players are matched by skill, with the waiting player
+# nearest to them in (Elo) rating, e.g. {"rated"} (see server/rating.py).
+# Search windows start at RATING_WINDOW points either side of a player's
+# rating, and widen by RATING_WINDOW_GROWTH points per second of waiting;
+# waiting players are matched with each other as their windows widen every
+# RATED_MATCH_INTERVAL seconds. Ratings are kept in a file for each channel
+# in RATINGS_DIR (or in memory only, if it's None).
+RATED_CHANNELS = set()
+RATINGS_DIR = "ratings"
+RATING_WINDOW = 100
+RATING_WINDOW_GROWTH = 20
+RATED_MATCH_INTERVAL = 1
+
+# Channels in which the server plays a round-robin tournament between the
+# players who register there (by asking for games in the channel), e.g.
+# {"finals"}, rather than matching players as they arrive (see
+# server/tournament.py). Each tournament's results are kept in a file in
+# TOURNAMENT_DIR, and games are scheduled (for as many game workers as are
+# free) every TOURNAMENT_INTERVAL seconds.
+TOURNAMENT_CHANNELS = set()
+TOURNAMENT_DIR = "tournaments"
+TOURNAMENT_INTERVAL = 1
+
+# How many games may run at once, and how many matched games may be queued
+# waiting for a game worker (after which matchmaking waits, too)
+GAME_WORKERS = 8 * (os.cpu_count() or 1)
+GAME_QUEUE_SIZE = 256
+
+# How often to check on players in queued games (seconds; as above, they are
+# only pinged every PING_INTERVAL seconds)
+KEEPALIVE_INTERVAL = 10
+
+# How long clients may take to ask for another game (by sending another PLAY
+# message) after each game, before they are disconnected (seconds)
+REPLAY_TIMEOUT = 30
+
+# How long network players may take to reply to each message in a game, and
+# to all of their messages in the game put together (seconds). A player who
+# runs out of time loses the game.
+MOVE_TIMEOUT = 60
+GAME_CLOCK = 10 * 60
+
+# Where to archive played games (see server/archive.py), or None to write
+# each game's log to its own text file in logs/ instead
+ARCHIVE_DIR = "logs"
+
+# If not None, serve metrics (in the Prometheus text format) to localhost on
+# this port, at /metrics
+METRICS_PORT = None
+
+# How many turns spectators may fall behind a game they're watching, and how
+# long they may take to accept each batch of turns (seconds), before they are
+# dropped
+SPECTATOR_BUFFER = 64
+SPECTATOR_TIMEOUT = 30
+
+# How many server processes to run. With more than one, every process
+# accepts connections on the same port (with SO_REUSEPORT), and they share
+# matchmaking through a broker process (see server/broker.py). The bot
+# processes, referee threads and game workers above are shared out between
+# them, and each serves its own metrics (on METRICS_PORT + its number).
+SERVER_PROCESSES = 1
+
 
 # # # #
-# Main thread: listen for incoming connections.
+# Main coroutine: listen for incoming connections.
 #
 #
 
 
 def main():
-    out = StarLog(
-        level=1 + DEBUG, timefn=lambda: f"Thread-0 {datetime.now()}"
-    )
+    out = StarLog(level=1 + DEBUG, timefn=lambda: f"Main {datetime.now()}")
     out.comment("initialising server", depth=-1)
+    try:
+        if SERVER_PROCESSES > 1:
+            run_processes(out)
+        else:
+            asyncio.run(serve(out))
+    except KeyboardInterrupt:
+        print()  # end line
+        out.comment("bye!")
+
+
+def run_processes(out):
+    """
+    Run SERVER_PROCESSES server processes, and a broker process for them to
+    share matchmaking through, until interrupted.
+    """
+    # (fork, while this process has no other threads)
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory(prefix="server-") as tmp:
+        listener = broker.listen(os.path.join(tmp, "broker.sock"))
+        processes = [
+            context.Process(
+                target=broker.run_broker, args=(listener,), name="Broker"
+            )
+        ]
+        for i in range(SERVER_PROCESSES):
+            processes.append(
+                context.Process(
+                    target=serve_process,
+                    args=(i, listener.getsockname()),
+                    name=f"Server-{i}",
+                )
+            )
+        for process in processes:
+            process.start()
+        listener.close()
+        out.comment(f"started {SERVER_PROCESSES} server processes")
+        # (on SIGTERM too, take the server processes down with us)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+        try:
+            # if any process stops, the rest can't go on (e.g. without the
+            # broker, players in different processes would never meet)
+            stopped = multiprocessing.connection.wait(
+                [process.sentinel for process in processes]
+            )
+            for process in processes:
+                if process.sentinel in stopped:
+                    out.comment(f"{process.name} process stopped! stopping")
+        finally:
+            for process in processes:
+                process.terminate()
+
+
+def serve_process(worker_id, broker_path):
+    timefn = lambda: f"Main-{worker_id} {datetime.now()}"
+    out = StarLog(level=1 + DEBUG, timefn=timefn)
+    # (when the main process terminates us, shut down as if interrupted, so
+    # that queued games are still archived)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve(out, worker_id, broker_path))
+    except KeyboardInterrupt:
+        pass  # (the main process says bye)
+
+
+async def serve(out, worker_id=None, broker_path=None):
+    # (share out the resources between server processes, if there are any)
+    nprocesses = 1 if broker_path is None else SERVER_PROCESSES
+    bot_processes = max(1, BOT_PROCESSES // nprocesses)
+    referee_threads = max(1, REFEREE_THREADS // nprocesses)
+    game_workers = max(1, GAME_WORKERS // nprocesses)
 
-    # set up a shared matchmaking pool
-    pool = MatchmakingPool(
-        num_players=NUM_PLAYERS, special_channels=SPECIAL_CHANNELS
+    # set up processes for server-controlled players
+    bots = BotPool(
+        bots={ch: Player for ch, (Player, _) in SPECIAL_CHANNELS.items()},
+        size=bot_processes,
+        time_budget=BOT_TIME_BUDGET,
     )
+    out.comment(f"started {bot_processes} bot processes")
+    special_channels = {
+        ch: functools.partial(ServerPlayer, bots, ch, name)
+        for ch, (_, name) in SPECIAL_CHANNELS.items()
+    }
+
+    # set up a shared matchmaking pool, and an executor for referee work
+    ratings = Ratings(RATED_CHANNELS, RATINGS_DIR)
+    tournaments = Tournaments(TOURNAMENT_CHANNELS, TOURNAMENT_DIR)
+    Pool = MatchmakingPool if broker_path is None else ShardedMatchmakingPool
+    pool = Pool(
+        num_players=NUM_PLAYERS,
+        special_channels=special_channels,
+        ratings=ratings,
+        tournaments=tournaments,
+    )
+    executor = ThreadPoolExecutor(
+        max_workers=referee_threads, thread_name_prefix="Referee"
+    )
+    client_ids = itertools.count(1)
+    client_prefix = "" if worker_id is None else f"{worker_id}."
+    admission = Admission(
+        max_per_address=MAX_CONNECTIONS_PER_ADDRESS,
+        rate=CONNECT_RATE,
+        burst=CONNECT_BURST,
+        total_rate=TOTAL_CONNECT_RATE,
+        total_burst=TOTAL_CONNECT_BURST,
+        exempt=ADMISSION_EXEMPT,
+    )
+    # (keep references to background tasks, so that they keep running)
+    heartbeat = asyncio.create_task(pool.heartbeat(out))
+    sweeper = asyncio.create_task(pool.sweeper(out))
+
+    # set up the game workers, the queue feeding them matched games, the
+    # list of games for spectators to watch, and the archive of games played
+    games = asyncio.Queue(maxsize=GAME_QUEUE_SIZE)
+    spectators = Spectators(buffer=SPECTATOR_BUFFER, timeout=SPECTATOR_TIMEOUT)
+    archive = None
+    if ARCHIVE_DIR is not None:
+        name = "games" if worker_id is None else f"games-{worker_id}"
+        archive = Archive(ARCHIVE_DIR, name=name)
+    workers = [
+        asyncio.create_task(
+            game_worker(
+                games, executor, spectators, ratings, tournaments, archive
+            )
+        )
+        for _ in range(game_workers)
+    ]
+    out.comment(f"started {game_workers} game workers")
+    # (players matched while waiting in rated channels are queued from here)
+    found = functools.partial(queue_game, games=games, out=out)
+    rematch = asyncio.create_task(pool.rematch(found, out))
+
+    # (and so are games scheduled in tournament channels, while there are
+    # game workers free for them)
+    def free_workers():
+        return game_workers - metrics.ACTIVE_GAMES.value - games.qsize()
+
+    schedule = asyncio.create_task(pool.schedule(found, free_workers, out))
+
+    async def handle(connection, address):
+        # a new coroutine handles each new client (if we'll have them)
+        host = address[0] if address else None
+        reason = admission.admit(host)
+        if reason is not None:
+            out.debug("refusing client", address, "due to", reason)
+            metrics.REFUSED_CONNECTIONS.inc()
+            await refuse(connection, reason)
+            return
+        out.comment("new client connected: ", address)
+        connection.recv_observer = metrics.observe_recv
+        metrics.CONNECTED_CLIENTS.inc()
+        try:
+            client_id = f"{client_prefix}{next(client_ids)}"
+            await servant(connection, pool, games, spectators, client_id)
+        finally:
+            metrics.CONNECTED_CLIENTS.dec()
+            admission.release(host)
+
+    if broker_path is not None:
+
+        async def adopt(connection, name, channel, available, pipelined):
+            # a new coroutine handles each client passed from another
+            # server process (having already requested a game)
+            out.comment("client passed from another process:", name)
+            connection.recv_observer = metrics.observe_recv
+            metrics.CONNECTED_CLIENTS.inc()
+            try:
+                client_out = client_log(f"{client_prefix}{next(client_ids)}")
+                await play_games(
+                    connection,
+                    name,
+                    channel,
+                    pool,
+                    games,
+                    client_out,
+                    available=available,
+                    pipelined=pipelined,
+                    adopted=True,
+                )
+            finally:
+                metrics.CONNECTED_CLIENTS.dec()
+
+        await pool.connect(broker_path, worker_id, nprocesses, adopt)
+        sync = asyncio.create_task(pool.sync(out))
+        out.comment(f"connected to broker as server process {worker_id}")
+
+    if METRICS_PORT is not None:
+        # (keep a reference to this server too, so that it keeps running)
+        metrics_port = METRICS_PORT + (worker_id or 0)
+        metrics_server = await metrics.start_server(metrics_port, pool, games)
+        out.comment(f"serving metrics on port {metrics_port}...")
 
     # listen for connections incoming on PORT:
+    # Host of "" allows all incoming connections on the chosen port
+    server = await AsyncConnection.start_server(
+        handle,
+        host="",
+        port=DEFAULT_SERVER_PORT,
+        reuse_port=broker_path is not None,
+        keepalive=TCP_KEEPALIVE,
+    )
+    out.comment(f"listening on port {DEFAULT_SERVER_PORT}...")
     try:
-        # Host of "" allows all incoming connections on the chosen port
-        connections = Connection.iter_listen(
-            host="", port=DEFAULT_SERVER_PORT
-        )
-        out.comment(f"listening on port {DEFAULT_SERVER_PORT}...")
-        for connection, address in connections:
-            # repeatedly accept a new connection, and hand off to a new thread
-            out.comment("new client connected: ", address)
-            out.comment("starting a new thread to handle this client...")
-            handler = threading.Thread(
-                target=servant, args=(connection, pool)
-            )
-            handler.daemon = True  # so that new thread exits when main exits
-            handler.start()
-    except KeyboardInterrupt:
-        print()  # end line
-        out.comment("bye!")
+        with executor:
+            async with server:
+                await server.serve_forever()
+    finally:
+        bots.close()
+        ratings.close()
+        tournaments.close()
+        if archive is not None:
+            archive.close()
 
 
 # # # #
-# Worker thread: Coordinate the matchmaking process and, if the client is the
-#  player that allows a game to begin, coordinate that game to conclusion.
+# Servant coroutine: Coordinate the matchmaking process and, if the client is
+#  the player that allows a game to begin, queue that game for a worker.
 #
 
 
-def servant(connection, pool):
-    # (Each thread gets own print function which includes its thread number)
-    timefn = lambda: f"{threading.current_thread().name} {datetime.now()}"
-    out = StarLog(level=1 + DEBUG, timefn=timefn)
+async def refuse(connection, reason):
+    # (tell them why, but don't wait around for them to listen)
+    try:
+        await connection.send(M.ERRO, reason=reason)
+    except DisconnectException:
+        pass
+    await connection.disconnect()
+
+
+def client_log(client_id):
+    # (Each coroutine gets own print function which includes its client id)
+    timefn = lambda: f"Client-{client_id} {datetime.now()}"
+    return StarLog(level=1 + DEBUG, timefn=timefn)
+
+
+async def servant(connection, pool, games, spectators, client_id):
+    out = client_log(client_id)
     out.comment("hello, world!")
 
     # # #
@@ -89,26 +447,128 @@ def servant(connection, pool):
     out.comment("begin communication with player", depth=-1)
     out.comment("waiting for PLAY request...")
     try:
-        playmsg = connection.recv(M.PLAY)
+        playmsg = await connection.recv(M.PLAY | M.SPEC, timeout=HELLO_TIMEOUT)
+        if playmsg["mtype"] is M.SPEC:
+            # Oh! You'd only like to watch? Right this way:
+            out.comment("received SPEC request:", playmsg)
+            await spectators.serve(connection, playmsg, out)
+            return
         out.comment("successfully received PLAY request:", playmsg)
         out.comment("sending OKAY back.")
-        connection.send(M.OKAY)
+        pipelined = await accept(connection, playmsg)
+    except TimeoutException:
+        out.comment("client took too long to make a request. bye!")
+        await connection.disconnect()
+        return
     except DisconnectException:
         out.comment("client disconnected. bye!")
-        connection.disconnect()
+        await connection.disconnect()
         return
     except ProtocolException as e:
         out.comment("protocol error! that was unexpected...? bye!")
-        connection.disconnect()
+        await connection.disconnect()
         return
 
-    # Now that you're officially a player, let's wrap you up in an object so
-    # that we won't forget your name.
-    new_player = NetworkPlayer(connection, playmsg["name"])
+    await play_games(
+        connection,
+        playmsg["name"],
+        playmsg["channel"],
+        pool,
+        games,
+        out,
+        available=playmsg.get("games"),
+        pipelined=pipelined,
+    )
 
-    # And we'll need to note that channel for matchmaking purposes!
-    channel = playmsg["channel"]
 
+async def play_games(
+    connection,
+    name,
+    channel,
+    pool,
+    games,
+    out,
+    available=None,
+    pipelined=False,
+    adopted=False,
+):
+    """
+    Find games for the client 'name' in 'channel', one after another, for
+    as long as they send another PLAY message within REPLAY_TIMEOUT seconds
+    of the end of each game. The client may say how many more games they
+    are 'available' for (for tournament channels), and the server may have
+    agreed to play them with 'pipelined' turns.
+    """
+    while True:
+        # Now that you're officially a player, let's wrap you up in an object
+        # so that we won't forget your name.
+        new_player = NetworkPlayer(connection, name)
+        new_player.available = available
+        new_player.pipelined = pipelined
+
+        # And we'll need to note that channel for matchmaking purposes!
+        if not await seek_game(new_player, channel, pool, games, out, adopted):
+            return
+
+        # That was fun! Would you care for another game?
+        out.comment("waiting for another PLAY request...", depth=-1)
+        try:
+            playmsg = await _recv_replay(connection, new_player.owing, out)
+            out.comment("successfully received PLAY request:", playmsg)
+            pipelined = await accept(connection, playmsg)
+        except (DisconnectException, ProtocolException):
+            out.comment("no more games. bye!")
+            await connection.disconnect()
+            return
+        name, channel = playmsg["name"], playmsg["channel"]
+        available = playmsg.get("games")
+        adopted = False
+
+
+async def _recv_replay(connection, owing, out):
+    # (receive a PLAY message within REPLAY_TIMEOUT seconds; but if the last
+    # game was cut short while we were waiting for a reply of type 'owing',
+    # e.g. when their opponent ran out of time, that reply may come first,
+    # and we should skip it)
+    if owing is None:
+        return await connection.recv(M.PLAY, timeout=REPLAY_TIMEOUT)
+    deadline = time.monotonic() + REPLAY_TIMEOUT
+    msg = await connection.recv(M.PLAY | owing, timeout=REPLAY_TIMEOUT)
+    if msg["mtype"] is M.PLAY:
+        return msg
+    out.comment("skipping late reply from the last game:", msg)
+    timeout = max(0, deadline - time.monotonic())
+    return await connection.recv(M.PLAY, timeout=timeout)
+
+
+async def accept(connection, playmsg):
+    """
+    Reply OKAY to a PLAY message, agreeing to switch to binary framing (see
+    ALLOW_BINARY_FRAMING), and to pipelined turns (see ALLOW_PIPELINING), if
+    the client asks. Return whether turns will be pipelined.
+    """
+    okay = {}
+    binary = (
+        ALLOW_BINARY_FRAMING
+        and playmsg.get("framing") == BINARY_FRAMING
+        and connection.framing != BINARY_FRAMING
+    )
+    if binary:
+        okay["framing"] = BINARY_FRAMING
+    pipelined = ALLOW_PIPELINING and playmsg.get("pipelined", False)
+    if pipelined:
+        okay["pipelined"] = True
+    await connection.send(M.OKAY, **okay)
+    if binary:
+        connection.set_framing(BINARY_FRAMING)
+    return pipelined
+
+
+async def seek_game(new_player, channel, pool, games, out, adopted=False):
+    """
+    Find a game for 'new_player', and wait until it's over. Return True if
+    they are still connected (to this server process) by then.
+    """
     # # #
     # Conduct matchmaking
     #
@@ -117,21 +577,141 @@ def servant(connection, pool):
     # some suitable opponents for you to play with...
     out.comment("looking for opponents...", depth=-1)
     try:
-        players = pool.match(channel, new_player, out)
+        players = await pool.request_match(
+            channel, new_player, out, adopted=adopted
+        )
         out.comment("opponents found!")
+    except PlayerTransferred:
+        # Your opponents are waiting with a servant in another process. I've
+        # passed your connection on to them; I'll just let go of my end.
+        out.comment("passed to another server process. bye~!")
+        await new_player.connection.disconnect()
+        return False
     except NotEnoughPlayers:
         # I'm afraid this is as far as I can take you, good sir/madam.
-        # If you wait here for just a short time, I'm sure another thread
+        # If you wait here for just a short time, I'm sure another servant
         # will come by and pick you up quite soon.
         # It has been my eternal pleasure. Farewell~    Your humble servant.
-        out.comment("leaving in pool for another thread. bye~!")
+        out.comment("leaving in pool for another servant. bye~!")
+        # (but keep this coroutine, and so the connection, open until that
+        # other servant is finished with you)
+        await new_player.finished.wait()
+        return not new_player.disconnected.is_set()
+
+    # # #
+    # Queue the game for a game worker
+    #
+
+    # Splendid! Between the few of you, we have enough players for a game!
+    # Please wait in line (we'll check on you from time to time) until one
+    # of our game workers is ready to begin:
+    out.comment("queueing game for a game worker...", depth=-1)
+    await queue_game(players, channel, games, out)
+    # (again, keep this coroutine open until the game is finished with you)
+    await new_player.finished.wait()
+    return not new_player.disconnected.is_set()
+
+
+async def queue_game(players, channel, games, out):
+    """
+    Queue a game between 'players' in 'channel' for a game worker, keeping
+    its players alive (see keep_alive) until the game starts.
+    """
+    started = asyncio.Event()
+    keepalive = asyncio.create_task(keep_alive(players, started, out))
+    await games.put((players, channel, started, out))
+    out.comment("game queued.")
+    await keepalive
+
+
+async def keep_alive(players, started, out):
+    """
+    Until the game has 'started', check on all of its players every
+    KEEPALIVE_INTERVAL seconds (so we know they're still here), and ping
+    them every PING_INTERVAL seconds (so they know we are, too). Players who
+    have hung up, or who fail to respond, are dropped.
+    """
+    while not started.is_set():
+        try:
+            await asyncio.wait_for(started.wait(), KEEPALIVE_INTERVAL)
+        except asyncio.TimeoutError:
+            out.comment("game still queued; checking on players...")
+            await asyncio.gather(
+                *(_keep(p, out) for p in players), return_exceptions=True
+            )
+
+
+async def _keep(player, out):
+    if player.hung_up():
+        out.comment("lost client", player.name, "who hung up")
+        await player.drop()
+        return
+    if time.monotonic() - player.pinged < PING_INTERVAL:
+        return
+    try:
+        await player.ping(timeout=PING_TIMEOUT)
+    except Exception as e:
+        # (OSError, DisconnectException, ProtocolException, or anything else
+        # unexpected: in any case, we've lost them)
+        out.comment("lost client", player.name, "due to", e)
+        await player.drop()
+
+
+# # # #
+# Game worker coroutines: Repeatedly take a matched game from the queue and
+#  coordinate that game to conclusion.
+#
+
+
+async def game_worker(
+    games, executor, spectators, ratings, tournaments, archive
+):
+    while True:
+        players, channel, started, out = await games.get()
+        started.set()
+        metrics.ACTIVE_GAMES.inc()
+        try:
+            await conduct(
+                players,
+                channel,
+                executor,
+                spectators,
+                ratings,
+                tournaments,
+                archive,
+                out,
+            )
+            metrics.GAMES.inc()
+            metrics.GAMES_PER_MINUTE.mark()
+        except Exception as e:
+            # (don't let one game take down the worker)
+            out.comment("unexpected error in game worker!", depth=-1)
+            out.comment(f"{e.__class__.__name__}: {e}")
+            for player in players:
+                await player.drop()
+        finally:
+            metrics.ACTIVE_GAMES.dec()
+            games.task_done()
+
+
+async def conduct(
+    players, channel, executor, spectators, ratings, tournaments, archive, out
+):
+    # # #
+    # Check all players are still with us
+    #
+
+    # We'll need everyone to still be here for a game:
+    if not all(player.alive for player in players):
+        out.comment("a client disconnected while queued", depth=-1)
+        for player in players:
+            await player.drop(reason="opponent disconnected")
         return
 
     # # #
     # Initialise all players, prepare for game
     #
 
-    # Splendid! Between the few of you, we have enough players for a game!
     # Who will take the first turn? Let us cast the proverbial die:
     out.comment("randomly assigning colours to players...")
     random.shuffle(players)
@@ -140,17 +720,28 @@ def servant(connection, pool):
     # Then, shall we introduce you to one another?
     col_name_map = {colour: player.name for colour, player in cols_players}
     for colour, player in cols_players:
-        player.game(col_name_map, out.comment)
-
-    # What name shall we give to this glorious playing?
-    player_names = "_and_".join(p.name for p in players)
-    timestamp = str(datetime.now())[:19].replace(" ", "_").replace(":", "-")
-    game_name = f"logs/game_at_{timestamp}_with_{player_names}.txt"
-    # Attempt to make sure there is a 'logs' folder ready for the game log
-    try:
-        os.mkdir("logs")
-    except:
-        pass
+        await player.game(col_name_map, out.comment)
+
+    # Where shall we record this glorious playing? In the archive, if we
+    # have one (see ARCHIVE_DIR), or else in its own log file:
+    if archive is not None:
+        log_file, log_format = io.StringIO(), "jsonl"
+    else:
+        player_names = "_and_".join(p.name for p in players)
+        timestamp = str(datetime.now())[:19]
+        timestamp = timestamp.replace(" ", "_").replace(":", "-")
+        game_name = f"logs/game_at_{timestamp}_with_{player_names}.txt"
+        # Attempt to make sure there is a 'logs' folder ready for the log
+        try:
+            os.mkdir("logs")
+        except:
+            pass
+        log_file, log_format = open(game_name, "w"), "text"
+    started = time.time()
+
+    # And would anyone else like to watch?
+    broadcast = spectators.start(channel, **col_name_map)
+    outcome = "game error"  # (for the spectators, if nothing more specific)
 
     # # #
     # Play game, handle result
@@ -158,14 +749,20 @@ def servant(connection, pool):
 
     # Without further ado, let us begin!
     try:
-        with open(game_name, 'w') as log_file:
-            result = play(
-                players,
-                out_function=out.comment,
-                print_state=False,
-                log_filename=game_name,
-                log_file=log_file,
+        result = await play(
+            players,
+            executor,
+            log_file=log_file,
+            log_format=log_format,
+            broadcast=broadcast,
+        )
+        outcome = result
+        # (and update the players' ratings, if this channel is rated)
+        if ratings.rates(channel):
+            new_ratings = ratings.record(
+                channel, col_name_map["upper"], col_name_map["lower"], result
             )
+            out.comment("new ratings:", *map(round, new_ratings))
 
         # What a delightful result! I hope that was an enjoyable game
         # for all of you. Let's share the final result.
@@ -173,31 +770,64 @@ def servant(connection, pool):
         out.comment(result)
         out.comment("sending out result...")
         for player in players:
-            player.game_over(result=result)
+            await player.game_over(result=result)
     except IllegalActionException:
         # Ah! The game has ended early. We had better
         # make sure everyone is on the same page:
         out.comment("game error", depth=-1)
         out.comment("game error: invalid action")
+        outcome = "game error: invalid action"
+        for player in players:
+            await player.game_over(result="game error: invalid action")
+    except BotException as e:
+        # Oh dear, our own player has let us down.
+        out.comment("game error", depth=-1)
+        out.comment("game error: server player failed:", e)
+        outcome = "game error: server player failed"
         for player in players:
-            player.game_over(result="game error: invalid action")
+            await player.game_over(result="game error: server player failed")
     except DisconnectException:
         # In the unfortunate event of a disconnection, we had better
         # make sure everyone is on the same page:
         out.comment("connection error", depth=-1)
         out.comment("a client disconnected")
+        outcome = "game error: a player disconnected"
         for player in players:
             try:
-                player.error(reason="opponent disconnected")
-            except BrokenPipeError:
+                await player.error(reason="opponent disconnected")
+            except DisconnectException:
                 # this connection must have been the one that reset; skip it
                 continue
     except ProtocolException as e:
         out.comment("protocol error!", depth=-1)
         out.comment(e)
         out.comment("a client did something unexpected")
+        outcome = "game error: a player broke protocol"
         for player in players:
-            player.error(reason="opponent broke protocol")
+            await player.error(reason="opponent broke protocol")
+    finally:
+        spectators.end(broadcast, outcome)
+        ended = time.time()
+        if tournaments.plays(channel):
+            tournaments.record(
+                channel,
+                col_name_map["upper"],
+                col_name_map["lower"],
+                outcome,
+                started,
+                ended,
+            )
+        if archive is not None:
+            archive.add(
+                channel,
+                col_name_map["upper"],
+                col_name_map["lower"],
+                started,
+                ended,
+                outcome,
+                log_file.getvalue(),
+            )
+        log_file.close()
 
     # # #
     # Terminate all players
@@ -205,11 +835,109 @@ def servant(connection, pool):
 
     # One way or another, that's the end of this meeting. Until next time, my
     # good friends! It has been my deepest pleasure~
-    out.comment("disconnection", depth=-1)
-    out.comment("disconnecting players...")
+    # (I'll leave you connected, in case you'd like another game)
+    out.comment("release", depth=-1)
+    out.comment("releasing players...")
     for player in players:
-        player.disconnect()
-    out.comment("end of thread. bye~")
+        await player.release()
+    out.comment("end of game. bye~")
+
+
+# # #
+# Game coordination
+#
+
+
+async def play(
+    players, executor, log_file=None, log_format="text", broadcast=None
+):
+    """
+    Coordinate a game, return a string describing the result (as for
+    referee.game.play, but for asynchronous player wrappers).
+
+    Network communication is awaited in this coroutine, while the referee's
+    own work (validating and applying actions, and logging them) is
+    offloaded to 'executor'. If 'broadcast' is not None, each turn is
+    published to it (for spectators) once it has been applied.
+
+    If a player runs out of time (see NetworkPlayer), the game ends there,
+    and their opponent wins.
+    """
+    loop = asyncio.get_running_loop()
+
+    # Set up a new game and initialise the players
+    game = Game(log_file=log_file, log_format=log_format)
+    try:
+        for player, colour in zip(players, COLOURS):
+            await player.init(colour)
+
+        # Repeat the following until the game ends
+        # SIMULTANEOUS PLAY VERSION:
+        # all players choose an action, then the board and players get
+        # updates:
+        player_1, player_2 = players
+        while not game.over():
+            # Ask both players for their next action (at the same time)
+            action_1, action_2 = await _gather(
+                player_1.action(), player_2.action()
+            )
+
+            # Validate both actions and apply them to the game if they are
+            # allowed.
+            seconds = await loop.run_in_executor(
+                executor, _timed, game.update, action_1, action_2
+            )
+            metrics.TURN_SECONDS.observe(seconds)
+            if broadcast is not None:
+                broadcast.turn(game.nturns, action_1, action_2)
+
+            # Notify both players of the actions (at the same time)
+            final = game.over()
+            await _gather(
+                player_1.update(
+                    opponent_action=action_2,
+                    player_action=action_1,
+                    final=final,
+                ),
+                player_2.update(
+                    opponent_action=action_1,
+                    player_action=action_2,
+                    final=final,
+                ),
+            )
+    except PlayerOutOfTime as e:
+        # (unless the game was already over, that's the end of it)
+        if not game.over():
+            loser = e.player.colour
+            winner = next(c for c in COLOURS if c != loser)
+            game.result = f"winner: {winner} ({loser} ran out of time)"
+    except BaseException:
+        # (keep the log of the game so far)
+        game.close()
+        raise
+
+    # After that loop, the game has ended (one way or another!)
+    return await loop.run_in_executor(executor, game.end)
+
+
+async def _gather(*coroutines):
+    # (as asyncio.gather, but if one fails, cancel the others, rather than
+    # leave them waiting on a game that's over)
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def _timed(function, *args):
+    # (time the referee's work in the executor thread itself, so as not to
+    # count time spent queueing for a thread)
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
 
 
 # # #
@@ -220,104 +948,223 @@ def servant(connection, pool):
 class NetworkPlayer:
     """
     A Player wrapper for network-controlled players
+
+    During a game, each of the player's replies must arrive within
+    'move_timeout' seconds, and all of them within 'clock' seconds put
+    together, or else PlayerOutOfTime is raised.
+
+    If the player's turns are pipelined (see ALLOW_PIPELINING), each update
+    (but the last) is held back, and sent with the next TURN message, to
+    which the player replies with their next action (and no OKAY).
     """
 
-    def __init__(self, connection, name):
+    def __init__(
+        self, connection, name, move_timeout=MOVE_TIMEOUT, clock=GAME_CLOCK
+    ):
         self.connection = connection
         self.name = name
         self.player_str = f"{self.name} (not yet initialised)"
-
-    def ping(self, timeout=None):
-        self.connection.send(M.OKAY)
-        self.connection.recv(M.OKAY, timeout=timeout)
-
-    def game(self, colour_name_map, log_function):
+        # how long this player may take to reply to each message in the
+        # game, and how long they have left for all of their replies
+        self.move_timeout = move_timeout
+        self.clock = clock
+        # False once the matchmaking pool finds this player unresponsive (or
+        # evicts them)
+        self.alive = True
+        self.waiting_since = None
+        # when they were last known to be there (answering a ping, or
+        # connecting)
+        self.pinged = time.monotonic()
+        # held during a heartbeat ping (which must finish before the game can
+        # begin, after which there are no more pings)
+        self.lock = asyncio.Lock()
+        self.playing = False
+        # set once this player's connection is closed
+        self.disconnected = asyncio.Event()
+        # set once this player's game is over (or they've gone)
+        self.finished = asyncio.Event()
+        # how many more games they're available for, if they said (see
+        # server.tournament)
+        self.available = None
+        # whether their turns are pipelined, and if so, the update held back
+        # for their next TURN message
+        self.pipelined = False
+        self._update = {}
+        # the type of reply we were waiting for when their game ended, if it
+        # ended before it came (see play_games)
+        self.owing = None
+
+    async def ping(self, timeout=None):
+        async with self.lock:
+            if self.playing or not self.alive:
+                return  # too late; the game has begun (or they're gone)
+            await self.connection.send(M.OKAY)
+            await self.connection.recv(M.OKAY, timeout=timeout)
+            self.pinged = time.monotonic()
+
+    def hung_up(self):
+        return self.connection.hung_up()
+
+    async def drop(self, reason=None):
+        # for when the player is found to be dead (or is evicted) before a
+        # game, in which case tell them why
+        self.alive = False
+        if reason is not None:
+            async with self.lock:
+                try:
+                    await self.connection.send(M.ERRO, reason=reason)
+                except DisconnectException:
+                    pass
+        await self.connection.disconnect()
+        self.disconnected.set()
+        self.finished.set()
+
+    async def game(self, colour_name_map, log_function):
         self.log = log_function
         self.log(self.player_str, "sending GAME")
-        self.connection.send(M.GAME, **colour_name_map)
+        async with self.lock:
+            self.playing = True
+            await self.connection.send(M.GAME, **colour_name_map)
 
-    def init(self, colour):
+    async def init(self, colour):
         self.colour = colour
         self.player_str = f"{self.name} ({colour})"
         self.log(self.player_str, "sending INIT")
-        self.connection.send(M.INIT, colour=colour)
-        self.connection.recv(M.OKAY)
+        await self.connection.send(M.INIT, colour=colour)
+        await self._recv(M.OKAY)
 
-    def action(self):
+    async def action(self):
         self.log(self.player_str, "sending TURN")
-        self.connection.send(M.TURN)
+        await self.connection.send(M.TURN, **self._update)
+        self._update = {}
         self.log(self.player_str, "waiting for ACTN")
-        actnmsg = self.connection.recv(M.ACTN)
+        actnmsg = await self._recv(M.ACTN)
         self.log(self.player_str, "received ACTN:", actnmsg)
         return actnmsg["action"]
 
-    def update(self, opponent_action, player_action):
+    async def update(self, opponent_action, player_action, final=False):
+        if self.pipelined and not final:
+            self._update = {
+                "opponent_action": opponent_action,
+                "player_action": player_action,
+            }
+            return
         self.log(self.player_str, "sending UPD8")
-        self.connection.send(
+        await self.connection.send(
             M.UPD8,
             opponent_action=opponent_action,
             player_action=player_action,
         )
         self.log(self.player_str, "waiting for OKAY")
-        self.connection.recv(M.OKAY)
+        await self._recv(M.OKAY)
 
-    def game_over(self, result):
+    async def game_over(self, result):
         self.log(self.player_str, "sending OVER")
-        self.connection.send(M.OVER, result=result)
+        await self.connection.send(M.OVER, result=result)
 
-    def error(self, reason):
+    async def error(self, reason):
         self.log(self.player_str, "sending ERRO")
-        self.connection.send(M.ERRO, reason=reason)
+        await self.connection.send(M.ERRO, reason=reason)
 
-    def disconnect(self):
+    async def release(self):
+        # for when the game is over; leave the connection open (the client
+        # may ask for another game)
+        self.log(self.player_str, "releasing")
+        self.finished.set()
+
+    async def disconnect(self):
         self.log(self.player_str, "disconnecting")
-        self.connection.disconnect()
+        await self.connection.disconnect()
+        self.disconnected.set()
+        self.finished.set()
+
+    async def _recv(self, mtype):
+        # (within the game's deadlines, charging the time to their clock)
+        start = time.monotonic()
+        self.owing = mtype
+        try:
+            msg = await self.connection.recv(
+                mtype, timeout=max(0, min(self.move_timeout, self.clock))
+            )
+        except TimeoutException:
+            self.log(self.player_str, "ran out of time")
+            raise PlayerOutOfTime(self)
+        finally:
+            self.clock -= time.monotonic() - start
+        self.owing = None
+        return msg
 
 
 class ServerPlayer:
     """
-    A Player wrapper for locally-controlled players
+    A Player wrapper for locally-controlled players (which run in a bot
+    worker process, to keep their computation off the event loop)
     """
 
-    def __init__(self, Player, name):
-        self.Player = Player
+    def __init__(self, bots, bot, name):
+        self.bots = bots
+        self.bot = bot
         self.name = name
+        self.alive = True
+        self.worker = None
+        self.pinged = time.monotonic()
+
+    async def ping(self, timeout=None):
+        pass
+
+    def hung_up(self):
+        return False
+
+    async def drop(self, reason=None):
+        await self.disconnect()
 
-    def game(self, _colour_name_map, log_function):
+    async def game(self, _colour_name_map, log_function):
         self.log = log_function
+        self.worker, self.game_id = await self.bots.assign()
 
-    def init(self, colour):
+    async def init(self, colour):
         self.colour = colour
         self.player_str = f"{self.name} ({colour})"
         self.log(self.player_str, "initialising", colour)
-        self.player = self.Player(colour)
+        await self._request("init", self.bot, colour)
 
-    def action(self):
+    async def action(self):
         self.log(self.player_str, "asking for action")
-        action = self.player.action()
+        action = await self._request("action")
         self.log(self.player_str, "got:", action)
         return action
 
-    def update(self, opponent_action, player_action):
+    async def update(self, opponent_action, player_action, final=False):
         self.log(
             self.player_str,
             "updating with",
             player_action,
             opponent_action,
         )
-        self.player.update(
-            opponent_action=opponent_action,
-            player_action=player_action,
-        )
+        await self._request("update", opponent_action, player_action)
 
-    def game_over(self, result):
+    async def game_over(self, result):
         pass
 
-    def error(self, reason):
+    async def error(self, reason):
         pass
 
-    def disconnect(self):
-        pass
+    async def release(self):
+        await self.disconnect()
+
+    async def disconnect(self):
+        if self.worker is not None:
+            await self.worker.end(self.game_id)
+            self.worker = None
+
+    async def _request(self, command, *args):
+        worker, game_id = self.worker, self.game_id
+        status, value = await worker.request(command, game_id, *args)
+        if status == "timeout":
+            raise BotException(f"{self.player_str} exceeded time budget")
+        if status == "error":
+            raise BotException(f"{self.player_str} failed: {value}")
+        return value
 
 
 # # #
@@ -327,25 +1174,76 @@ class ServerPlayer:
 
 class MatchmakingPool:
     """
-    A collection of per-channel waiting lists, with concurrent access
-    control.
+    A collection of per-channel waiting queues.
     Submit your player to a channel with the match method, and receive
     either a NotEnoughPlayers exception or a list of num_players
     previously deposited.
 
+    Waiting players are checked by a background heartbeat (run the heartbeat
+    coroutine as a task), which drops those whose connections show they have
+    hung up, and (every 'ping_interval' seconds) pings the rest concurrently,
+    dropping those that fail to respond. Matching never waits on the
+    network; it just skips over dead players.
+
+    The pool's memory is bounded: players are evicted after waiting for
+    'ttl' seconds (by the sweeper coroutine, run it as a task too), and if
+    there are ever more than 'max_players' waiting players or 'max_channels'
+    channels, whole channels are evicted, least-recently-active first.
+    Evicted players are sent an ERRO message and disconnected.
+
+    In channels rated by 'ratings' (see server.rating), players are matched
+    in pairs by rating instead of in order of arrival, and waiting players
+    are also matched with each other as their search windows widen (by the
+    rematch coroutine, run it as a task too).
+
+    In tournament channels (see server.tournament), players are never
+    matched as they arrive; they register and wait, and the schedule
+    coroutine (run it as a task too) starts their tournament's games.
+
     Notes:
-    * Thread safe (I think)
-    * Does not automatically clear stale connections out of channel waiting
-      lists until a new player is submitted to that channel. Therefore, an
-      attack exists where a client can run up memory usage by repeatedly
-      submitting players to obscure channels, and then disconnecting.
+    * Coroutine safe: match never awaits, so it runs atomically on the
+      event loop.
     """
 
-    def __init__(self, num_players, special_channels):
-        self._lock = threading.RLock()
-        self._waiting = defaultdict(list)
+    def __init__(
+        self,
+        num_players,
+        special_channels,
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        ping_interval=PING_INTERVAL,
+        ping_timeout=PING_TIMEOUT,
+        ttl=WAITING_TTL,
+        sweep_interval=SWEEP_INTERVAL,
+        max_players=MAX_WAITING_PLAYERS,
+        max_channels=MAX_WAITING_CHANNELS,
+        ratings=None,
+        rating_window=RATING_WINDOW,
+        rating_window_growth=RATING_WINDOW_GROWTH,
+        rated_match_interval=RATED_MATCH_INTERVAL,
+        tournaments=None,
+        tournament_interval=TOURNAMENT_INTERVAL,
+    ):
+        # channel -> queue of waiting players, in order of channel activity
+        # (least-recently active first)
+        self._waiting = {}
+        self._size = 0  # total players in all queues
+        self._dropping = set()  # (references to running eviction tasks)
+        self._starting = set()  # (references to running rematched games)
         self.num_players = num_players
         self.special_channels = special_channels
+        self.heartbeat_interval = heartbeat_interval
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.max_players = max_players
+        self.max_channels = max_channels
+        self.ratings = ratings
+        self.rating_window = rating_window
+        self.rating_window_growth = rating_window_growth
+        self.rated_match_interval = rated_match_interval
+        self.tournaments = tournaments
+        self.tournament_interval = tournament_interval
 
     def match(self, channel, new_player, out):
         """
@@ -360,56 +1258,437 @@ class MatchmakingPool:
         # the server can provide some:
         if channel in self.special_channels:
             return [self.special_channels[channel](), new_player]
+        # in a tournament channel, the scheduler will find the games:
+        if self._scheduled(channel):
+            return self._register(channel, new_player, out)
+        # in a rated channel, we match-make by rating:
+        if self._rated(channel):
+            return self._match_rated(channel, new_player, out)
         # otherwise, we do need to match-make as usual:
-        with self._lock:
-            out.debug("matchmaking pool before filter:", self._waiting)
-            # clean out any players who have since disconnected
-            channel_waiting = self._filter(channel, out)
-
-            # deposit THIS new player in the queue too,
-            channel_waiting.append(new_player)
-
-            # okay, are there enough players waiting to play a game?
-            if len(channel_waiting) < self.num_players:
-                # no; alert the caller
-                out.comment("not enough players!")
-                out.debug("pool after filter:", self._waiting)
-                raise NotEnoughPlayers()
-            else:
-                # yes! extract this queue from the waiting pool
-                del self._waiting[channel]
-                out.comment("match found!")
-                out.debug("pool after filter:", self._waiting)
-                # and return these players to the caller!
-                return channel_waiting
-
-    def _filter(self, channel, out=None):
-        with self._lock:
-            still_waiting = []
-            for player in self._waiting[channel]:
-                try:
-                    player.ping(timeout=10)
-                    # contact! they're still online! re-add them to the pool:
-                    still_waiting.append(player)
-                except (
-                    OSError,
-                    BrokenPipeError,  # the connection has gone stale?
-                    DisconnectException,  # the client closed connection
-                    ProtocolException,  # the client... did what?
-                ) as e:
-                    # in any case, close this connection and don't keep this
-                    # client in the pool.
-                    if out is not None:
-                        out.comment(
-                            "ditching client",
-                            player,
-                            "due to",
-                            e.__class__.__name__,
-                            e,
+        # (take the channel out; if it goes back, it goes to the end, as
+        # the most recently active channel)
+        queue = self._waiting.pop(channel, deque())
+        out.debug("matchmaking queue before match:", list(queue))
+        # take players from the front of the queue, skipping the dead
+        players = []
+        while queue and len(players) < self.num_players - 1:
+            player = queue.popleft()
+            self._size -= 1
+            if player.alive:
+                players.append(player)
+        # and add THIS new player too,
+        players.append(new_player)
+
+        # okay, are there enough players waiting to play a game?
+        if len(players) < self.num_players:
+            # no; put them all back and alert the caller
+            new_player.waiting_since = time.monotonic()
+            queue.extend(players)
+            self._size += len(players)
+            self._waiting[channel] = queue
+            self._enforce_limits(out)
+            out.comment("not enough players!")
+            raise NotEnoughPlayers()
+        else:
+            # yes! keep the channel only if others are still waiting
+            if queue:
+                self._waiting[channel] = queue
+            out.comment("match found!")
+            # and return these players to the caller!
+            return players
+
+    def _match_rated(self, channel, new_player, out):
+        queue = self._waiting.pop(channel, None) or self._new_queue(channel)
+        new_player.rating = self.ratings.get(channel, new_player.name)
+        now = time.monotonic()
+        opponent = queue.nearest(new_player.rating, queue.window, now)
+        if opponent is None:
+            new_player.waiting_since = now
+            queue.add(new_player)
+            self._size += 1
+            self._waiting[channel] = queue
+            self._enforce_limits(out)
+            out.comment("no opponents near rating", round(new_player.rating))
+            raise NotEnoughPlayers()
+        queue.remove(opponent)
+        self._size -= 1
+        if queue:
+            self._waiting[channel] = queue
+        ratings = self._ratings_of(opponent, new_player)
+        out.comment("match found! ratings:", *ratings)
+        return [opponent, new_player]
+
+    def _register(self, channel, new_player, out):
+        tournament = self.tournaments.get(channel)
+        tournament.register(new_player.name, new_player.available)
+        if tournament.done(new_player.name):
+            # (there's no point waiting; tell them so)
+            self._evict(new_player, "no games left in this tournament", out)
+            raise NotEnoughPlayers()
+        queue = self._waiting.pop(channel, deque())
+        new_player.waiting_since = time.monotonic()
+        queue.append(new_player)
+        self._size += 1
+        self._waiting[channel] = queue
+        self._enforce_limits(out)
+        remaining = tournament.remaining(new_player.name)
+        out.comment(f"registered for tournament (games to go: {remaining})")
+        raise NotEnoughPlayers()
+
+    async def heartbeat(self, out):
+        """
+        Forever: every 'heartbeat_interval' seconds, clear out the waiting
+        players who have hung up, or who haven't been pinged for
+        'ping_interval' seconds and then fail to respond to a ping.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            # (checking a connection's state is free; pinging is not)
+            expiry = time.monotonic() - self.ping_interval
+            checks = [
+                p
+                for q in self._waiting.values()
+                for p in q
+                if p.hung_up() or p.pinged < expiry
+            ]
+            out.debug(f"heartbeat: checking {len(checks)} waiting players")
+            # (and let nothing one player does stop the heartbeat)
+            await asyncio.gather(
+                *(self._check(p, out) for p in checks), return_exceptions=True
+            )
+            # clear the dead out of the queues (without reordering them)
+            for channel in list(self._waiting):
+                queue = self._waiting[channel]
+                if not all(player.alive for player in queue):
+                    alive = [p for p in queue if p.alive]
+                    self._size -= len(queue) - len(alive)
+                    queue = self._new_queue(channel, alive)
+                    self._waiting[channel] = queue
+                if not queue:
+                    del self._waiting[channel]
+
+    async def sweeper(self, out):
+        """
+        Forever: every 'sweep_interval' seconds, evict all players who have
+        been waiting for longer than 'ttl' seconds.
+        """
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            expiry = time.monotonic() - self.ttl
+            for channel in list(self._waiting):
+                queue = self._waiting[channel]
+                # (queues are in order of arrival, so look from the front)
+                while queue and next(iter(queue)).waiting_since < expiry:
+                    self._size -= 1
+                    self._evict(queue.popleft(), "matchmaking timed out", out)
+                if not queue:
+                    del self._waiting[channel]
+
+    async def rematch(self, found, out):
+        """
+        Forever: every 'rated_match_interval' seconds, match pairs of players
+        waiting in rated channels whose search windows have widened to
+        include each other. Each such game is passed to the coroutine
+        function 'found' (with its players and channel), in a new task.
+        """
+        while True:
+            await asyncio.sleep(self.rated_match_interval)
+            now = time.monotonic()
+            for channel in [c for c in self._waiting if self._rated(c)]:
+                queue = self._waiting[channel]
+                # (longest-waiting first, as their windows are the widest)
+                for player in list(queue):
+                    if player not in queue or not player.alive:
+                        continue
+                    window = queue.window_of(player, now)
+                    opponent = queue.nearest(
+                        player.rating, window, now, exclude=player
+                    )
+                    if opponent is None:
+                        continue
+                    queue.remove(player)
+                    queue.remove(opponent)
+                    self._size -= 2
+                    out.comment(
+                        f"rated match found in channel {channel!r}! ratings:",
+                        *self._ratings_of(player, opponent),
+                    )
+                    self._start(found, [player, opponent], channel)
+                if not queue:
+                    del self._waiting[channel]
+
+    async def schedule(self, found, capacity, out):
+        """
+        Forever: every 'tournament_interval' seconds, start games between
+        players waiting in tournament channels (see server.tournament), but
+        only as many as there are game workers free for (as returned by the
+        function 'capacity'). Each game is passed to the coroutine function
+        'found' (with its players and channel), in a new task.
+        """
+        while True:
+            await asyncio.sleep(self.tournament_interval)
+            limit = capacity()
+            for channel in [c for c in self._waiting if self._scheduled(c)]:
+                if limit <= 0:
+                    break
+                queue = self._waiting[channel]
+                tournament = self.tournaments.get(channel)
+                # (first let go of anyone the results so far have left with
+                # no games to play)
+                for player in queue:
+                    if player.alive and tournament.done(player.name):
+                        self._evict(
+                            player, "no games left in this tournament", out
                         )
-                    player.connection.disconnect()
-            self._waiting[channel] = still_waiting
-            return still_waiting
+                waiting = [player for player in queue if player.alive]
+                pairs = tournament.pairings(waiting, limit)
+                limit -= len(pairs)
+                started = {player for pair in pairs for player in pair}
+                self._size -= len(queue)
+                queue = deque(p for p in waiting if p not in started)
+                self._size += len(queue)
+                if pairs:
+                    out.comment(
+                        f"scheduled {len(pairs)} games in tournament "
+                        f"{channel!r}"
+                    )
+                for pair in pairs:
+                    self._start(found, list(pair), channel)
+                if queue:
+                    self._waiting[channel] = queue
+                else:
+                    del self._waiting[channel]
+
+    async def request_match(self, channel, new_player, out, adopted=False):
+        """
+        As for match, but as a coroutine (see ShardedMatchmakingPool).
+        """
+        return self.match(channel, new_player, out)
+
+    def waiting_counts(self):
+        """
+        Return a dict from each channel to its number of waiting players.
+        """
+        return {channel: len(q) for channel, q in self._waiting.items()}
+
+    def configured(self, channel):
+        """
+        Whether 'channel' is one of the server's own (special, rated or
+        tournament) channels, rather than one chosen by clients.
+        """
+        return (
+            channel in self.special_channels
+            or self._rated(channel)
+            or self._scheduled(channel)
+        )
+
+    def _rated(self, channel):
+        # (in a channel that's rated and a tournament, the tournament decides
+        # who plays whom; the games are still rated)
+        if self._scheduled(channel):
+            return False
+        return self.ratings is not None and self.ratings.rates(channel)
+
+    def _scheduled(self, channel):
+        return self.tournaments is not None and self.tournaments.plays(channel)
+
+    def _start(self, found, players, channel):
+        task = asyncio.create_task(found(players, channel))
+        self._starting.add(task)
+        task.add_done_callback(self._starting.discard)
+
+    def _new_queue(self, channel, players=()):
+        if self._rated(channel):
+            return RatedQueue(
+                players, self.rating_window, self.rating_window_growth
+            )
+        return deque(players)
+
+    @staticmethod
+    def _ratings_of(*players):
+        return [round(player.rating) for player in players]
+
+    def _enforce_limits(self, out):
+        # evict whole channels, least-recently-active first, until the pool
+        # is back within its limits
+        while (
+            len(self._waiting) > self.max_channels
+            or self._size > self.max_players
+        ):
+            channel = next(iter(self._waiting))
+            queue = self._waiting.pop(channel)
+            self._size -= len(queue)
+            for player in queue:
+                self._evict(player, "matchmaking pool full", out)
+
+    def _evict(self, player, reason, out):
+        # (player has already been removed from its queue)
+        if not player.alive:
+            return
+        out.comment("evicting client", player.name, "due to", reason)
+        player.alive = False
+        task = asyncio.create_task(player.drop(reason=reason))
+        self._dropping.add(task)
+        task.add_done_callback(self._dropping.discard)
+
+    async def _check(self, player, out):
+        if player.hung_up():
+            out.comment("ditching client", player.name, "who hung up")
+            await player.drop()
+            return
+        try:
+            await player.ping(timeout=self.ping_timeout)
+        except Exception as e:
+            # the connection has gone stale (OSError)? the client closed
+            # connection (DisconnectException)? the client... did what
+            # (ProtocolException, or anything else)? in any case, close this
+            # connection and don't keep this client in the pool.
+            out.comment(
+                "ditching client",
+                player.name,
+                "due to",
+                e.__class__.__name__,
+                e,
+            )
+            await player.drop()
+
+
+class ShardedMatchmakingPool(MatchmakingPool):
+    """
+    A matchmaking pool shared with other server processes through a broker
+    (see server.broker).
+
+    Players waiting in this process are kept (and checked, and evicted)
+    here, as for MatchmakingPool, but the broker decides where each new
+    player should look for opponents. If they are waiting in another
+    process, request_match passes the new player's connection there, and
+    raises PlayerTransferred. Players passed here from other processes are
+    given to the 'adopt' coroutine function (see connect), and should be
+    matched here (with adopted=True).
+
+    Special channels are always matched here, and so is every channel if
+    the broker is lost. Rated and tournament channels are each matched in a
+    single 'home' process (chosen by hashing the channel's name), where
+    their players are passed straight away, so that they can be matched by
+    rating or scheduled (and their ratings or results kept) in one place.
+    """
+
+    async def connect(self, path, worker_id, nprocesses, adopt):
+        """
+        Connect to the broker listening at 'path', as server process
+        'worker_id' (of 'nprocesses'). Players passed to this process will be
+        given to 'adopt' (with their connection, name and channel).
+        """
+        self.worker_id = worker_id
+        self.nprocesses = nprocesses
+        self._adopting = set()  # (references to running adoption tasks)
+
+        def on_message(msg, fds):
+            # (the only messages the broker sends unasked are transfers)
+            for fd in fds:
+                task = asyncio.create_task(self._adopt(adopt, msg, fd))
+                self._adopting.add(task)
+                task.add_done_callback(self._adopting.discard)
+
+        self.broker = await broker.BrokerConnection.connect(
+            path, worker_id, on_message
+        )
+
+    async def _adopt(self, adopt, msg, fd):
+        sock = socket.socket(fileno=fd)
+        connection = await AsyncConnection.from_socket(sock)
+        connection.set_framing(msg.get("framing", JSON_FRAMING))
+        await adopt(
+            connection,
+            msg["name"],
+            msg["channel"],
+            msg["games"],
+            msg.get("pipelined", False),
+        )
+
+    async def request_match(self, channel, new_player, out, adopted=False):
+        """
+        Submit a 'new_player' to look for games on 'channel' (see match),
+        wherever their opponents are waiting. Raise PlayerTransferred if
+        they're waiting in another process.
+        """
+        if channel in self.special_channels or self.broker.lost:
+            return self.match(channel, new_player, out)
+        if self._homed(channel):
+            # (the broker needn't count these players; they all wait at home)
+            where = zlib.crc32(channel.encode()) % self.nprocesses
+            if adopted or where == self.worker_id:
+                return self.match(channel, new_player, out)
+            return await self._transfer(new_player, channel, where, out)
+        if adopted:
+            # (the broker sent this player here because somebody's waiting)
+            where = self.worker_id
+        else:
+            try:
+                reply = await self.broker.request(op="match", channel=channel)
+            except ConnectionError:
+                out.comment("lost broker! matching in this process only")
+                return self.match(channel, new_player, out)
+            where = reply["worker"]
+
+        if where is None:
+            # nobody is waiting anywhere, and the broker has already counted
+            # the new player as waiting here
+            return self.match(channel, new_player, out)
+        elif where == self.worker_id:
+            try:
+                return self.match(channel, new_player, out)
+            except NotEnoughPlayers:
+                # whoever was waiting here has since gone, so the new player
+                # will wait instead (let the broker know)
+                await self._tell_broker(op="enqueue", channel=channel)
+                raise
+        else:
+            return await self._transfer(new_player, channel, where, out)
+
+    async def _transfer(self, new_player, channel, where, out):
+        out.comment("opponents are waiting in server process", where)
+        try:
+            await self.broker.send(
+                fds=[new_player.connection.fileno()],
+                op="transfer",
+                to=where,
+                channel=channel,
+                name=new_player.name,
+                games=new_player.available,
+                framing=new_player.connection.framing,
+                pipelined=new_player.pipelined,
+            )
+        except ConnectionError:
+            out.comment("lost broker! matching in this process only")
+            return self.match(channel, new_player, out)
+        raise PlayerTransferred()
+
+    async def sync(self, out):
+        """
+        Forever (until the broker is lost): every 'heartbeat_interval'
+        seconds, send the broker the number of players waiting here in each
+        channel (so that it forgets those who have gone).
+        """
+        while not self.broker.lost:
+            await asyncio.sleep(self.heartbeat_interval)
+            counts = {
+                channel: sum(player.alive for player in queue)
+                for channel, queue in self._waiting.items()
+                if not self._homed(channel)
+            }
+            counts = {channel: n for channel, n in counts.items() if n}
+            out.debug(f"sync: {sum(counts.values())} players waiting here")
+            await self._tell_broker(op="counts", counts=counts)
+
+    def _homed(self, channel):
+        return self._rated(channel) or self._scheduled(channel)
+
+    async def _tell_broker(self, **msg):
+        try:
+            await self.broker.send(**msg)
+        except ConnectionError:
+            pass  # (and we'll match in this process only from now on)
 
 
 class NotEnoughPlayers(Exception):
@@ -418,5 +1697,23 @@ class NotEnoughPlayers(Exception):
     """
 
 
+class PlayerOutOfTime(Exception):
+    """
+    For when a network player takes too long to reply during a game (see
+    NetworkPlayer)
+    """
+
+    def __init__(self, player):
+        super().__init__(f"{player.name} ran out of time")
+        self.player = player
+
+
+class PlayerTransferred(Exception):
+    """
+    For when a player's opponents are waiting in another server process, to
+    which the player's connection has been passed
+    """
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,115 @@
+"""
+Admission control: decide whether to serve each new connection (before any
+of its messages are read), so that a client stuck in a reconnect loop (or
+worse) is turned away cheaply, rather than using up the server's sockets and
+memory, or its attention.
+
+Connections are limited in number from each (IP) address, and in rate, both
+from each address and from all addresses together. The rates are enforced
+with token buckets: each new connection takes a token from its address's
+bucket (and then from the shared bucket), and each bucket refills at a
+constant rate, up to its capacity, so short bursts of new connections are
+allowed, but not a steady flood of them.
+"""
+
+import time
+
+
+class TokenBucket:
+    """
+    A bucket of up to 'burst' tokens (initially full), refilled at 'rate'
+    tokens per second.
+    """
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = time.monotonic() if now is None else now
+
+    def take(self, now):
+        """
+        Take a token, if there is one (return True), or else don't (return
+        False). 'now' is the time (according to time.monotonic).
+        """
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    def _refill(self, now):
+        elapsed = now - self.time
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.time = now
+
+
+class Admission:
+    """
+    Admit a new connection from an address only if fewer than
+    'max_per_address' connections from that address are already open (see
+    admit and release), and if it's within the address's rate limit of
+    'rate' new connections per second (in bursts of up to 'burst'), and the
+    limit for all addresses together, of 'total_rate' new connections per
+    second (in bursts of up to 'total_burst'). Connections from 'exempt'
+    addresses are always admitted.
+    """
+
+    def __init__(
+        self, max_per_address, rate, burst, total_rate, total_burst, exempt=()
+    ):
+        self.max_per_address = max_per_address
+        self.rate = rate
+        self.burst = burst
+        self.exempt = frozenset(exempt)
+        self._total = TokenBucket(total_rate, total_burst)
+        self._open = {}  # address -> number of open connections
+        self._buckets = {}  # address -> TokenBucket (unless it's full)
+        self._prune_at = 1024
+
+    def admit(self, address):
+        """
+        Decide whether to admit a new connection from 'address'. If so,
+        count it as open (until release is called), and return None; if not,
+        return the reason why not (a string).
+        """
+        if address in self.exempt:
+            return None
+        if self._open.get(address, 0) >= self.max_per_address:
+            return "too many connections from your address"
+        now = time.monotonic()
+        bucket = self._buckets.get(address)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune(now)
+            bucket = self._buckets[address] = TokenBucket(
+                self.rate, self.burst, now
+            )
+        if not bucket.take(now):
+            return "too many new connections from your address"
+        if not self._total.take(now):
+            return "too many new connections; try again soon"
+        self._open[address] = self._open.get(address, 0) + 1
+        return None
+
+    def release(self, address):
+        """
+        Count a connection from 'address' (that was admitted) as closed.
+        """
+        if address in self.exempt:
+            return
+        self._open[address] -= 1
+        if not self._open[address]:
+            del self._open[address]
+
+    def _prune(self, now):
+        # (forget the buckets that have refilled, as they would be new ones;
+        # and then don't prune again until there are twice as many)
+        for address in list(self._buckets):
+            if self._buckets[address].full(now):
+                del self._buckets[address]
+        self._prune_at = max(1024, 2 * len(self._buckets))
@@ -0,0 +1,309 @@
+"""
+Archive the server's games: append compact game records to a few large
+segment files (rather than writing a small file per game), with an index
+for finding any game, or any player's games, quickly.
+
+Each game record is a header line (a JSON object with the game's id,
+channel, players, start and end times, and result), followed by the game's
+structured log (see referee.gamelog, JSONGameLog). Records are appended to
+the current segment file (named like games-000001.jsonl) by a background
+writer thread, which starts a new segment once the current one reaches
+'segment_bytes'. The index (an SQLite database, index.sqlite, in the same
+directory) maps game ids, player names and start times to the segment and
+byte range of each record.
+
+Several server processes can share an archive directory, each appending to
+its own segment files (named after the process) and sharing the index.
+
+Query the archive from the command line, e.g.:
+
+    python -m server.archive logs --player NAME --since 2021-05-01 [--log]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import queue
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+from referee.gamelog import convert_to_text
+
+# Start a new segment file once the current one reaches this size (bytes)
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    started REAL NOT NULL,
+    ended REAL NOT NULL,
+    channel TEXT NOT NULL,
+    upper TEXT NOT NULL,
+    lower TEXT NOT NULL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS games_by_start ON games (started);
+CREATE INDEX IF NOT EXISTS games_by_upper ON games (upper, started);
+CREATE INDEX IF NOT EXISTS games_by_lower ON games (lower, started);
+"""
+
+_INSERT = """
+INSERT INTO games
+    (segment, offset, length, started, ended, channel, upper, lower, result)
+    VALUES (?, ?, 0, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class Archive:
+    """
+    Append games to the archive in 'directory' (see add), from a background
+    thread. Segment files are named after 'name' (use a different name for
+    each process sharing the directory).
+    """
+
+    def __init__(self, directory, name="games", segment_bytes=SEGMENT_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._write, name="Archive", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, channel, upper, lower, started, ended, result, log):
+        """
+        Queue a game to be archived (without waiting for it to be written).
+        'started' and 'ended' are Unix times, and 'log' is the game's
+        structured log (as a string).
+        """
+        self._queue.put((channel, upper, lower, started, ended, result, log))
+
+    def close(self):
+        """
+        Finish writing any queued games, and stop the writer thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write(self):
+        index = _connect(self.directory)
+        segment = _Segment(self.directory, self.name, self.segment_bytes)
+        try:
+            while True:
+                # (write as many games as are waiting at once, and commit
+                # them to the index together)
+                games = [self._queue.get()]
+                while games[-1] is not None and not self._queue.empty():
+                    games.append(self._queue.get())
+                stop = games[-1] is None
+                games = [game for game in games if game is not None]
+                try:
+                    with index:
+                        for game in games:
+                            segment.append(index, game)
+                        segment.flush()
+                except (OSError, sqlite3.Error) as e:
+                    # (don't take the server down; but do say something)
+                    print(
+                        f"archive: lost {len(games)} games: {e}",
+                        file=sys.stderr,
+                    )
+                if stop:
+                    return
+        finally:
+            segment.close()
+            index.close()
+
+
+class _Segment:
+    """
+    The segment file currently being appended to (by one Archive).
+    """
+
+    def __init__(self, directory, name, segment_bytes):
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        # (start a new segment, after any left from previous runs, rather
+        # than appending to one that may end with a partial record)
+        pattern = re.compile(re.escape(name) + r"-(\d+)\.jsonl")
+        matches = map(pattern.fullmatch, os.listdir(directory))
+        self.number = max((int(m[1]) for m in matches if m), default=0)
+        self.filename = None
+        self.file = None
+
+    def append(self, index, game):
+        """
+        Append a 'game' (as queued by Archive.add) to the segment, and add
+        it to the 'index' (in the caller's transaction).
+        """
+        if self.file is None or self.file.tell() >= self.segment_bytes:
+            self._rotate()
+        channel, upper, lower, started, ended, result, log = game
+        # (index the game first, for its id, and then fill in its length)
+        game_id = index.execute(
+            _INSERT,
+            (self.filename, self.file.tell(), started, ended)
+            + (channel, upper, lower, result),
+        ).lastrowid
+        header = {
+            "game": game_id,
+            "channel": channel,
+            "upper": upper,
+            "lower": lower,
+            "started": started,
+            "ended": ended,
+            "result": result,
+        }
+        record = json.dumps(header, separators=(",", ":")) + "\n" + log
+        length = self.file.write(record.encode())
+        index.execute(
+            "UPDATE games SET length = ? WHERE id = ?", (length, game_id)
+        )
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _rotate(self):
+        self.close()
+        self.number += 1
+        self.filename = f"{self.name}-{self.number:06d}.jsonl"
+        self.file = open(os.path.join(self.directory, self.filename), "ab")
+
+
+def _connect(directory):
+    index = sqlite3.connect(
+        os.path.join(directory, "index.sqlite"), timeout=30
+    )
+    # (let several processes write, and readers read, all at once)
+    index.execute("PRAGMA journal_mode=WAL")
+    index.executescript(_SCHEMA)
+    return index
+
+
+# # #
+# Reading the archive
+#
+
+
+def find_games(directory, game=None, player=None, since=None, until=None):
+    """
+    Return the index entries (as dicts) of the archived games in 'directory'
+    with id 'game', played by 'player', or started between Unix times
+    'since' and 'until' (any of which may be None, for any), in order.
+    """
+    conditions, params = [], []
+    if game is not None:
+        conditions.append("id = ?")
+        params.append(game)
+    if since is not None:
+        conditions.append("started >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("started < ?")
+        params.append(until)
+    where = " AND ".join(conditions) or "1"
+    if player is None:
+        query = f"SELECT * FROM games WHERE {where}"
+    else:
+        # (a union, so that each half can use its player's index)
+        query = (
+            f"SELECT * FROM games WHERE upper = ? AND {where} UNION "
+            f"SELECT * FROM games WHERE lower = ? AND {where}"
+        )
+        params = [player, *params, player, *params]
+    index = sqlite3.connect(os.path.join(directory, "index.sqlite"))
+    index.row_factory = sqlite3.Row
+    try:
+        rows = index.execute(query + " ORDER BY started, id", params)
+        return [dict(row) for row in rows]
+    finally:
+        index.close()
+
+
+def read_game(directory, entry):
+    """
+    Return the record of an archived game, given its index 'entry' (see
+    find_games): its header (a dict), and the lines of its structured log.
+    """
+    with open(os.path.join(directory, entry["segment"]), "rb") as segment:
+        segment.seek(entry["offset"])
+        lines = segment.read(entry["length"]).decode().splitlines()
+    return json.loads(lines[0]), lines[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m server.archive",
+        description="find games in a server's game archive.",
+    )
+    parser.add_argument("directory", help="the archive directory.")
+    parser.add_argument("-g", "--game", type=int, help="find this game id.")
+    parser.add_argument("-p", "--player", help="find this player's games.")
+    parser.add_argument(
+        "-s",
+        "--since",
+        type=_parse_time,
+        help="find games started at or after this (ISO format) time.",
+    )
+    parser.add_argument(
+        "-u",
+        "--until",
+        type=_parse_time,
+        help="find games started before this (ISO format) time.",
+    )
+    parser.add_argument(
+        "-l",
+        "--log",
+        action="store_true",
+        help="print each game's log (in the text format), too.",
+    )
+    options = parser.parse_args()
+
+    start = time.perf_counter()
+    entries = find_games(
+        options.directory,
+        options.game,
+        options.player,
+        options.since,
+        options.until,
+    )
+    for entry in entries:
+        started = datetime.fromtimestamp(entry["started"])
+        print(
+            f"{entry['id']} {started:%Y-%m-%d %H:%M:%S} {entry['channel']} "
+            f"{entry['upper']} (upper) vs {entry['lower']} (lower): "
+            f"{entry['result']}"
+        )
+        if options.log:
+            _, log = read_game(options.directory, entry)
+            for line in convert_to_text(log) if log else ():
+                print("   ", line)
+    elapsed = time.perf_counter() - start
+    print(f"({len(entries)} games, {1000 * elapsed:.1f}ms)", file=sys.stderr)
+
+
+def _parse_time(string):
+    try:
+        return datetime.fromisoformat(string).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time {string!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Run server-controlled players ('bots') in a pool of worker processes, so
+that their computation competes neither with other games nor with the
+server's event loop for the GIL.
+
+Each worker process imports all of the bot classes when it starts, and
+keeps a spare instance of each bot for each colour constructed ahead of
+time, ready for the next game. A bot stays in the same worker process for
+the whole of its game. Each move (each call to a bot's action or update
+method) must finish within a time budget, enforced inside the worker.
+"""
+
+import signal
+import asyncio
+import itertools
+import multiprocessing
+
+from referee.game import COLOURS
+
+
+class BotPool:
+    """
+    A fixed-size pool of bot worker processes.
+
+    * bots        -- dict from bot name (e.g. a channel) to Player class.
+                     The classes must be importable by the worker processes.
+    * size        -- number of worker processes.
+    * time_budget -- limit on the (wall-clock) time, in seconds, for each
+                     call to a bot's action or update method.
+    """
+
+    def __init__(self, bots, size, time_budget):
+        self.bots = bots
+        self.time_budget = time_budget
+        # (spawn, rather than fork, a server with running threads)
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [self._start_worker() for _ in range(size)]
+        self._game_ids = itertools.count()
+        self._replacing = asyncio.Lock()
+
+    async def assign(self):
+        """
+        Choose a worker for a new game (the least busy one), and return it
+        along with a new game id. Workers that have died (or that we have
+        lost touch with) are replaced first (starting and stopping worker
+        processes in a thread, off the event loop).
+        """
+        loop = asyncio.get_running_loop()
+        async with self._replacing:
+            for i, worker in enumerate(self._workers):
+                if worker.lost or not worker.process.is_alive():
+                    self._workers[i] = await loop.run_in_executor(
+                        None, self._start_worker
+                    )
+                    # (wait for any request in progress to find that the
+                    # worker is gone, before closing its pipe)
+                    async with worker.lock:
+                        worker.lost = True
+                    await loop.run_in_executor(None, worker.stop)
+        worker = min(self._workers, key=lambda w: w.games)
+        worker.games += 1
+        return worker, next(self._game_ids)
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+
+    def _start_worker(self):
+        return _Worker(self._context, self.bots, self.time_budget)
+
+
+class _Worker:
+    """
+    The server's end of a bot worker process (talking to it through a pipe,
+    one request at a time).
+    """
+
+    def __init__(self, context, bots, time_budget):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_work,
+            args=(child_conn, bots, time_budget),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.lock = asyncio.Lock()
+        self.games = 0  # number of games currently assigned
+        self.lost = False  # set if the pipe to the process breaks
+
+    def stop(self):
+        """
+        Terminate the worker process, wait for it to exit (so it doesn't
+        linger as a zombie), and close our end of its pipe.
+        """
+        self.process.terminate()
+        self.process.join()
+        self.process.close()
+        self.conn.close()
+
+    async def request(self, command, game_id, *args):
+        """
+        Send a request to the worker process and await its reply, a tuple
+        (status, value) where status is one of "ok", "timeout" or "error"
+        (including if the process has died).
+        """
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            if self.lost:
+                return ("error", "bot worker process died")
+            try:
+                self.conn.send((command, game_id, *args))
+            except OSError:  # (e.g. BrokenPipeError)
+                self.lost = True
+                return ("error", "bot worker process died")
+            # wait until the reply is ready to read, without blocking the
+            # event loop
+            ready = loop.create_future()
+            fd = self.conn.fileno()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(0))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+            try:
+                return self.conn.recv()
+            except (EOFError, OSError):
+                self.lost = True
+                return ("error", "bot worker process died")
+
+    async def end(self, game_id):
+        """
+        Let the worker forget about a finished game.
+        """
+        self.games -= 1
+        await self.request("end", game_id)
+
+
+class BotException(Exception):
+    """
+    For when a server-controlled player fails (raising an exception, or
+    exceeding its time budget).
+    """
+
+
+# # #
+# Worker process
+#
+
+
+class _OutOfTime(Exception):
+    """For interrupting a bot which has exceeded its time budget."""
+
+
+def _out_of_time(signum, frame):
+    raise _OutOfTime()
+
+
+def _work(conn, bots, time_budget):
+    # (leave ^C to the server, which will terminate us)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _out_of_time)
+
+    players = {}  # game id -> Player instance
+    spares = {}  # (bot name, colour) -> Player instance, ready to go
+
+    def make_spare(name, colour):
+        try:
+            spares[name, colour] = bots[name](colour)
+        except Exception:
+            pass  # (we'll try again when the instance is needed)
+
+    for name in bots:
+        for colour in COLOURS:
+            make_spare(name, colour)
+
+    while True:
+        try:
+            command, game_id, *args = conn.recv()
+        except EOFError:
+            return  # the server has gone
+        try:
+            if command == "init":
+                name, colour = args
+                player = spares.pop((name, colour), None)
+                if player is None:
+                    player = _timed(time_budget, bots[name], colour)
+                players[game_id] = player
+                conn.send(("ok", None))
+                # (prepare the next one while we would otherwise be idle)
+                make_spare(name, colour)
+                continue
+            elif command == "action":
+                result = _timed(time_budget, players[game_id].action)
+            elif command == "update":
+                opponent_action, player_action = args
+                result = _timed(
+                    time_budget,
+                    players[game_id].update,
+                    opponent_action,
+                    player_action,
+                )
+            elif command == "end":
+                players.pop(game_id, None)
+                result = None
+            conn.send(("ok", result))
+        except _OutOfTime:
+            players.pop(game_id, None)
+            conn.send(("timeout", None))
+        except Exception as e:
+            players.pop(game_id, None)
+            conn.send(("error", f"{e.__class__.__name__}: {e}"))
+
+
+def _timed(time_budget, function, *args):
+    signal.setitimer(signal.ITIMER_REAL, time_budget)
+    try:
+        return function(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
@@ -0,0 +1,230 @@
+"""
+Share matchmaking between several server processes, which all accept
+connections on the same port (see SERVER_PROCESSES in server/__main__.py).
+
+A broker process keeps track of which server processes have players waiting
+in each channel. Each server process asks the broker where to find an
+opponent for each new player. If the opponent is waiting in another
+process, the new player's socket is passed there (through the broker, over a
+Unix domain socket), and their game is played by that process.
+
+The broker only counts waiting players (per channel, per server process, in
+order of arrival); the players themselves, and their heartbeats, stay with
+the server processes, which regularly send the broker their current counts.
+If the broker's counts are out of date, the worst that can happen is that a
+new player is sent to a process where nobody is waiting any more, where they
+will wait instead.
+
+Messages between the broker and server processes are JSON objects, one per
+packet (SOCK_SEQPACKET), possibly with a file descriptor attached.
+"""
+
+import os
+import json
+import signal
+import socket
+import asyncio
+import selectors
+from collections import deque
+
+# Maximum size of a message (bytes)
+MAX_MESSAGE = 65536
+
+
+def listen(path):
+    """
+    Create the broker's listening socket at 'path' (before starting the
+    server processes, so that they can connect to it straight away).
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    listener.bind(path)
+    listener.listen()
+    return listener
+
+
+def run_broker(listener):
+    """
+    Serve server processes connecting to 'listener', forever. Message ops:
+
+    * hello    -- {worker}: identify a server process.
+    * match    -- {channel}: find a waiting player for a new player in
+                  channel. Replies {worker}, the id of the server process
+                  where a player is waiting (they are no longer counted as
+                  waiting), or None, in which case the new player is counted
+                  as waiting in the asking process.
+    * enqueue  -- {channel}: count another player waiting in this process.
+    * counts   -- {counts}: replace the counts of waiting players in this
+                  process with a dict from channel to count.
+    * transfer -- {to, ...} with a file descriptor: pass the message and the
+                  descriptor on to server process 'to'.
+    """
+    # (leave ^C to the main server process, which will terminate us)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    workers = {}  # worker id -> socket
+    worker_ids = {}  # socket -> worker id
+    waiting = {}  # channel -> deque of worker ids (one per waiting player)
+
+    while True:
+        for key, _ in selector.select():
+            conn = key.fileobj
+            if conn is listener:
+                conn, _ = listener.accept()
+                selector.register(conn, selectors.EVENT_READ)
+                continue
+            try:
+                data, fds, _, _ = socket.recv_fds(conn, MAX_MESSAGE, 1)
+            except OSError:
+                data, fds = b"", []
+            if not data:
+                # this server process has gone; forget its waiting players
+                selector.unregister(conn)
+                conn.close()
+                worker = worker_ids.pop(conn, None)
+                workers.pop(worker, None)
+                _replace_counts(waiting, worker, {})
+                continue
+            msg = json.loads(data)
+            worker = worker_ids.get(conn)
+            op = msg["op"]
+            if op == "hello":
+                worker_ids[conn] = msg["worker"]
+                workers[msg["worker"]] = conn
+            elif op == "match":
+                queue = waiting.get(msg["channel"])
+                if queue:
+                    found = queue.popleft()
+                    if not queue:
+                        del waiting[msg["channel"]]
+                else:
+                    found = None
+                    waiting[msg["channel"]] = deque([worker])
+                _send(conn, {"op": "reply", "worker": found})
+            elif op == "enqueue":
+                waiting.setdefault(msg["channel"], deque()).append(worker)
+            elif op == "counts":
+                _replace_counts(waiting, worker, msg["counts"])
+            elif op == "transfer":
+                target = workers.get(msg["to"])
+                if target is not None:
+                    _send(target, msg, fds)
+            # (we have passed on any descriptors we were sent; close ours)
+            for fd in fds:
+                os.close(fd)
+
+
+def _replace_counts(waiting, worker, counts):
+    for channel in set(waiting) | set(counts):
+        queue = deque(w for w in waiting.get(channel, ()) if w != worker)
+        queue.extend([worker] * counts.get(channel, 0))
+        if queue:
+            waiting[channel] = queue
+        else:
+            waiting.pop(channel, None)
+
+
+def _send(conn, msg, fds=()):
+    try:
+        socket.send_fds(conn, [json.dumps(msg).encode()], fds)
+    except OSError:
+        pass  # (this server process has gone; we'll notice soon)
+
+
+class BrokerConnection:
+    """
+    A server process's connection to the broker (for use on the process's
+    event loop). Messages from the broker other than replies (i.e.
+    transfers) are passed to the function 'on_message', along with the
+    list of any file descriptors attached.
+    """
+
+    @staticmethod
+    async def connect(path, worker_id, on_message):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sock.connect(path)
+        broker = BrokerConnection(sock, on_message)
+        await broker.send(op="hello", worker=worker_id)
+        return broker
+
+    def __init__(self, sock, on_message):
+        """
+        Avoid using this constructor directly. Prefer to use connect.
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.on_message = on_message
+        self.lost = False
+        self._replies = deque()  # futures awaiting replies, in order
+        self._sending = asyncio.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self.sock.fileno(), self._readable)
+
+    async def request(self, **msg):
+        """
+        Send a message, and return the broker's reply.
+        """
+        reply = self._loop.create_future()
+        await self.send(reply=reply, **msg)
+        return await reply
+
+    async def send(self, fds=(), reply=None, **msg):
+        """
+        Send a message (with any file descriptors 'fds' attached). If the
+        future 'reply' is given, it will receive the broker's reply.
+        """
+        data = json.dumps(msg).encode()
+        # (replies come back in the order that requests were sent)
+        async with self._sending:
+            if reply is not None:
+                self._replies.append(reply)
+            while True:
+                try:
+                    socket.send_fds(self.sock, [data], list(fds))
+                    return
+                except BlockingIOError:
+                    await self._writable()
+                except OSError as e:
+                    self._lose()
+                    raise ConnectionError(f"lost broker: {e}")
+
+    async def _writable(self):
+        writable = self._loop.create_future()
+        self._loop.add_writer(
+            self.sock.fileno(),
+            lambda: writable.done() or writable.set_result(None),
+        )
+        try:
+            await writable
+        finally:
+            self._loop.remove_writer(self.sock.fileno())
+
+    def _readable(self):
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.sock, MAX_MESSAGE, 1)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self._lose()
+                return
+            msg = json.loads(data)
+            if msg["op"] == "reply":
+                reply = self._replies.popleft()
+                if not reply.done():  # (unless the requester gave up)
+                    reply.set_result(msg)
+            else:
+                self.on_message(msg, fds)
+
+    def _lose(self):
+        if self.lost:
+            return
+        self.lost = True
+        self._loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        for reply in self._replies:
+            if not reply.done():
+                reply.set_exception(ConnectionError("lost broker"))
+        self._replies.clear()
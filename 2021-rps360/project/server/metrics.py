@@ -0,0 +1,285 @@
+"""
+Collect metrics about the server, and serve them over HTTP in the
+Prometheus text format (at http://localhost:PORT/metrics).
+
+All of the metrics are plain counters, updated (and read) only from the
+server's event loop thread, so they need no locks: recording a value is just
+an addition. Work done in other threads (such as the referee's) is timed in
+that thread, but recorded back on the event loop.
+"""
+
+import time
+import asyncio
+import threading
+import multiprocessing
+from bisect import bisect_left
+from collections import deque
+
+
+class Counter:
+    """A value that only goes up (e.g. the number of games played)."""
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, {}, self.value
+
+
+class Gauge(Counter):
+    """A value that goes up and down (e.g. the number of active games)."""
+
+    kind = "gauge"
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class RecentEvents:
+    """
+    A gauge counting the events (marked with 'mark') in the last 'window'
+    seconds (e.g. games finished per minute).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, window=60):
+        self.name = name
+        self.help = help
+        self.window = window
+        self._times = deque()
+
+    def mark(self):
+        now = time.monotonic()
+        self._times.append(now)
+        self._expire(now)
+
+    def samples(self):
+        self._expire(time.monotonic())
+        yield self.name, {}, len(self._times)
+
+    def _expire(self, now):
+        while self._times and self._times[0] < now - self.window:
+            self._times.popleft()
+
+
+class Histogram:
+    """
+    A distribution of observed values (e.g. latencies), counted in buckets
+    with the given upper bounds. Optionally, observations can be split into
+    separate series by the value of a single label.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.label = label
+        self._series = {}  # label value -> _HistogramSeries
+
+    def observe(self, value, label_value=None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = _HistogramSeries(
+                len(self.buckets)
+            )
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+
+    def samples(self):
+        for label_value, series in self._series.items():
+            labels = {} if self.label is None else {self.label: label_value}
+            cumulative = 0
+            bounds = [*map(_format_value, self.buckets), "+Inf"]
+            for bound, count in zip(bounds, series.counts):
+                cumulative += count
+                bucket_labels = {**labels, "le": bound}
+                yield self.name + "_bucket", bucket_labels, cumulative
+            yield self.name + "_sum", labels, series.sum
+            yield self.name + "_count", labels, cumulative
+
+
+class _HistogramSeries:
+    def __init__(self, nbuckets):
+        self.counts = [0] * (nbuckets + 1)  # (the last is for +Inf)
+        self.sum = 0
+
+
+# # #
+# The server's metrics
+#
+
+CONNECTED_CLIENTS = Gauge(
+    "rps360_connected_clients", "Clients currently connected."
+)
+REFUSED_CONNECTIONS = Counter(
+    "rps360_refused_connections_total",
+    "New connections refused by admission control.",
+)
+ACTIVE_GAMES = Gauge("rps360_active_games", "Games currently being played.")
+SPECTATORS = Gauge("rps360_spectators", "Spectators currently watching.")
+GAMES = Counter("rps360_games_total", "Games played to completion.")
+GAMES_PER_MINUTE = RecentEvents(
+    "rps360_games_last_minute", "Games completed in the last minute."
+)
+RECV_SECONDS = Histogram(
+    "rps360_recv_seconds",
+    "Time spent awaiting each message received from clients, by type.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+    label="mtype",
+)
+TURN_SECONDS = Histogram(
+    "rps360_referee_turn_seconds",
+    "Time taken by the referee to validate and apply each turn.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+
+METRICS = (
+    CONNECTED_CLIENTS,
+    REFUSED_CONNECTIONS,
+    ACTIVE_GAMES,
+    SPECTATORS,
+    GAMES,
+    GAMES_PER_MINUTE,
+    RECV_SECONDS,
+    TURN_SECONDS,
+)
+
+
+def observe_recv(mtype, seconds):
+    """
+    Record the time taken to receive a message (for use as an
+    AsyncConnection's recv observer).
+    """
+    RECV_SECONDS.observe(seconds, mtype.name)
+
+
+def render(pool=None, games=None):
+    """
+    Return all metrics in the Prometheus text exposition format, including
+    those read at the time of the call from the matchmaking 'pool' and the
+    'games' queue (if given), and the number of threads and processes.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(_render_metric(metric.name, metric.help, metric.kind))
+        for name, labels, value in metric.samples():
+            lines.append(_render_sample(name, labels, value))
+
+    def gauge(name, help, samples):
+        lines.extend(_render_metric(name, help, "gauge"))
+        for labels, value in samples:
+            lines.append(_render_sample(name, labels, value))
+
+    if pool is not None:
+        gauge(
+            "rps360_waiting_players",
+            "Players waiting for a game, by channel (the open channel and "
+            "the server's own channels by name, and the rest as 'other').",
+            _waiting_samples(pool),
+        )
+    if games is not None:
+        gauge(
+            "rps360_queued_games",
+            "Matched games waiting for a game worker.",
+            [({}, games.qsize())],
+        )
+    gauge(
+        "rps360_threads",
+        "Threads in the server process.",
+        [({}, threading.active_count())],
+    )
+    gauge(
+        "rps360_processes",
+        "Child processes of the server.",
+        [({}, len(multiprocessing.active_children()))],
+    )
+    return "".join(line + "\n" for line in lines)
+
+
+def _waiting_samples(pool):
+    # (clients choose their own channels, so to keep the number of label
+    # values bounded, only the open channel (blank) and the server's own
+    # channels get labels of their own, and the rest are counted together)
+    counts = {}
+    for channel, n in pool.waiting_counts().items():
+        if channel and not pool.configured(channel):
+            channel = "other"
+        counts[channel] = counts.get(channel, 0) + n
+    return [({"channel": channel}, n) for channel, n in counts.items()]
+
+
+async def start_server(port, pool=None, games=None, host="localhost"):
+    """
+    Listen for HTTP requests on 'host':'port', answering each GET request
+    for /metrics with the current metrics (see render).
+
+    Return the asyncio Server (see asyncio.start_server).
+    """
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10)
+            # (skip the headers, up to a blank line)
+            while (await asyncio.wait_for(reader.readline(), 10)).strip():
+                pass
+            method, path, *_ = request.decode("latin-1").split() + ["", ""]
+            if method == "GET" and path.split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = render(pool, games).encode()
+            else:
+                status = "404 Not Found"
+                body = b"try /metrics\n"
+            head = (
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n"
+                "\r\n"
+            )
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, OSError):
+            pass  # (never mind; they can always ask again)
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host=host, port=port)
+
+
+# Helper functions for the text format.
+
+
+def _render_metric(name, help, kind):
+    return f"# HELP {name} {help}", f"# TYPE {name} {kind}"
+
+
+def _render_sample(name, labels, value):
+    if labels:
+        pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {_format_value(value)}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _escape(label_value):
+    return (
+        str(label_value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
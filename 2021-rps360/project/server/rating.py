@@ -0,0 +1,183 @@
+"""
+Skill-aware matchmaking: Elo ratings for players in rated channels, and a
+matchmaking queue ordered by rating.
+
+In a rated channel, a new player is matched with the waiting player nearest
+to them in rating, as long as the two are close enough: within the new
+player's search window, or the waiting player's, whichever is wider. Search
+windows start at 'window' rating points, and widen by 'growth' points for
+every second a player waits, so that nobody waits for long just because
+there is nobody else near their rating.
+
+Ratings can be kept in a file for each rated channel (e.g.
+ratings/rated.jsonl), to which each new rating is appended, and read back
+when the server restarts.
+"""
+
+import os
+import json
+import time
+import itertools
+from bisect import bisect_left
+from urllib.parse import quote
+
+
+class Ratings:
+    """
+    Elo ratings of players (by name), kept separately in each of the rated
+    'channels'. New players start with the 'initial' rating. If 'directory'
+    is not None, each channel's ratings are kept in a file there (or else,
+    in memory only, for the life of this process).
+    """
+
+    def __init__(self, channels, directory=None, initial=1500, k=32):
+        self.channels = frozenset(channels)
+        self.directory = directory
+        self.initial = initial
+        self.k = k
+        self._ratings = {}  # (channel, name) -> rating
+        self._files = {}  # channel -> ratings file (once it's been read)
+
+    def rates(self, channel):
+        return channel in self.channels
+
+    def get(self, channel, name):
+        if self.directory is not None and channel not in self._files:
+            self._load(channel)
+        return self._ratings.get((channel, name), self.initial)
+
+    def record(self, channel, upper, lower, result):
+        """
+        Update the ratings of the players named 'upper' and 'lower' after a
+        game in 'channel' with 'result' (a string as returned by
+        referee.game.Game.end). Return their new ratings.
+        """
+        if result.startswith("winner: upper"):
+            score = 1
+        elif result.startswith("winner: lower"):
+            score = 0
+        else:  # a draw
+            score = 0.5
+        upper_rating = self.get(channel, upper)
+        lower_rating = self.get(channel, lower)
+        expected = 1 / (1 + 10 ** ((lower_rating - upper_rating) / 400))
+        change = self.k * (score - expected)
+        self._set(channel, upper, upper_rating + change)
+        self._set(channel, lower, lower_rating - change)
+        return upper_rating + change, lower_rating - change
+
+    def close(self):
+        for file in self._files.values():
+            file.close()
+
+    def _set(self, channel, name, rating):
+        self._ratings[channel, name] = rating
+        if self.directory is not None:
+            entry = {"name": name, "rating": rating, "time": time.time()}
+            self._files[channel].write(
+                json.dumps(entry, separators=(",", ":")) + "\n"
+            )
+
+    def _load(self, channel):
+        # (read back the channel's ratings, the latest for each player, and
+        # then keep its file open to append to)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, quote(channel, safe="") or "_")
+        path += ".jsonl"
+        try:
+            with open(path) as file:
+                # (skip a partial last line, if the server stopped mid-write)
+                for line in file:
+                    if line.endswith("\n"):
+                        entry = json.loads(line)
+                        self._ratings[channel, entry["name"]] = entry["rating"]
+        except FileNotFoundError:
+            pass
+        self._files[channel] = open(path, "a", buffering=1)
+
+
+class RatedQueue:
+    """
+    Players waiting in a rated channel (each with 'rating' and
+    'waiting_since' attributes), kept sorted by rating for nearest-rating
+    lookups in O(log n) time (plus the number of players skipped over), and
+    in order of arrival (iterating over the queue gives the players in this
+    order). Adding and removing players finds their place in O(log n) time,
+    but then takes O(n) time to insert into (or delete from) the sorted
+    lists; that's a fast memory move for queues of the sizes we see (see
+    MAX_WAITING_PLAYERS in server/__main__.py).
+    """
+
+    def __init__(self, players=(), window=100, growth=10):
+        self.window = window
+        self.growth = growth
+        self._keys = []  # sorted (rating, arrival number) pairs
+        self._players = []  # the player for each key
+        self._arrivals = {}  # player -> key, in order of arrival
+        self._numbers = itertools.count()
+        for player in players:
+            self.add(player)
+
+    def __len__(self):
+        return len(self._arrivals)
+
+    def __iter__(self):
+        return iter(self._arrivals)
+
+    def __contains__(self, player):
+        return player in self._arrivals
+
+    def add(self, player):
+        key = (player.rating, next(self._numbers))
+        i = bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._players.insert(i, player)
+        self._arrivals[player] = key
+
+    def remove(self, player):
+        i = bisect_left(self._keys, self._arrivals.pop(player))
+        del self._keys[i]
+        del self._players[i]
+
+    def popleft(self):
+        """Remove and return the player who has been waiting longest."""
+        player = next(iter(self._arrivals))
+        self.remove(player)
+        return player
+
+    def window_of(self, player, now):
+        return self.window + self.growth * (now - player.waiting_since)
+
+    def nearest(self, rating, window, now, exclude=None):
+        """
+        Return the (living) waiting player nearest to 'rating' who is within
+        'window' points of it, or within their own search window, or None if
+        there is no such player (other than 'exclude').
+        """
+        if not self._arrivals:
+            return None
+        # (nobody's window is wider than that of whoever has waited longest)
+        oldest = next(iter(self._arrivals))
+        limit = max(window, self.window_of(oldest, now))
+        # search outwards from 'rating', nearest players first
+        keys, players = self._keys, self._players
+        above = bisect_left(keys, (rating,))
+        below = above - 1
+        while below >= 0 or above < len(keys):
+            below_is_nearer = below >= 0 and (
+                above == len(keys)
+                or rating - keys[below][0] <= keys[above][0] - rating
+            )
+            if below_is_nearer:
+                i, below = below, below - 1
+            else:
+                i, above = above, above + 1
+            distance = abs(keys[i][0] - rating)
+            if distance > limit:
+                return None
+            player = players[i]
+            if player is exclude or not player.alive:
+                continue
+            if distance <= max(window, self.window_of(player, now)):
+                return player
+        return None
@@ -0,0 +1,158 @@
+"""
+Let clients watch games in progress ('spectators').
+
+A spectator connects and sends a SPEC message (instead of PLAY). With a null
+'game', the server replies with a SPEC message listing the games in progress
+(and the spectator may ask again). With a game id from that list, the server
+replies with a GAME message naming the players, then one SPEC message per
+turn played (with the turn number and both players' actions, starting from
+the first turn of the game), then the game's OVER message, then
+disconnects.
+
+Each message is encoded once per game, however many spectators are watching
+it, and kept in the game's history. Each spectator has their own task
+sending them the messages they haven't seen yet; the game itself only
+appends to the history. A spectator who falls more than 'buffer' messages
+behind (not counting the history from before they joined) is dropped.
+"""
+
+import asyncio
+import itertools
+
+from battleground.protocol import MessageType as M, encode
+from battleground.protocol import DisconnectException, ProtocolException
+
+from server import metrics
+
+
+class Spectators:
+    """
+    The games in progress (in this server process), for spectators to find
+    and watch.
+
+    * buffer  -- how many messages a spectator may fall behind before they
+                 are dropped.
+    * timeout -- how long (seconds) a spectator may take to accept messages
+                 before they are dropped, and to ask which game to watch.
+    """
+
+    def __init__(self, buffer, timeout):
+        self.buffer = buffer
+        self.timeout = timeout
+        self._broadcasts = {}  # game id -> Broadcast
+        self._game_ids = itertools.count(1)
+
+    def start(self, channel, upper, lower):
+        """
+        Make a new game available to watch. Return its Broadcast.
+        """
+        game_id = next(self._game_ids)
+        broadcast = Broadcast(game_id, channel, upper, lower)
+        self._broadcasts[game_id] = broadcast
+        return broadcast
+
+    def end(self, broadcast, result):
+        """
+        Send the game's result to its spectators, and stop listing it.
+        """
+        broadcast.over(result)
+        self._broadcasts.pop(broadcast.game_id, None)
+
+    def listing(self):
+        return [
+            {
+                "game": b.game_id,
+                "channel": b.channel,
+                "upper": b.upper,
+                "lower": b.lower,
+                "turn": b.nturns,
+            }
+            for b in self._broadcasts.values()
+        ]
+
+    async def serve(self, connection, specmsg, out):
+        """
+        Serve a spectator who has sent the SPEC message 'specmsg', until they
+        have watched a game, or leave.
+        """
+        try:
+            while specmsg["game"] is None:
+                await connection.send(M.SPEC, games=self.listing())
+                specmsg = await connection.recv(M.SPEC, timeout=self.timeout)
+            broadcast = self._broadcasts.get(specmsg["game"])
+            if broadcast is None:
+                await connection.send(M.ERRO, reason="no such game")
+                return
+            out.comment("spectator watching game", broadcast.game_id)
+            metrics.SPECTATORS.inc()
+            try:
+                await self._watch(connection, broadcast, out)
+            finally:
+                metrics.SPECTATORS.dec()
+        except (DisconnectException, ProtocolException, KeyError) as e:
+            out.comment("lost spectator due to", e.__class__.__name__, e)
+        finally:
+            await connection.disconnect()
+
+    async def _watch(self, connection, broadcast, out):
+        frames = broadcast.frames
+        position = 0
+        # (history from before they joined doesn't count against the buffer)
+        joined = len(frames)
+        await self._send(connection, broadcast.header)
+        while True:
+            changed = broadcast.changed
+            if position < len(frames):
+                if len(frames) - max(position, joined) > self.buffer:
+                    out.comment("dropping slow spectator")
+                    return
+                batch = frames[position:]
+                position += len(batch)
+                await self._send(connection, *batch)
+            elif broadcast.is_over:
+                out.comment("spectator watched to the end. bye~")
+                return
+            else:
+                await changed.wait()
+
+    async def _send(self, connection, *frames):
+        try:
+            await asyncio.wait_for(
+                connection.send_encoded(*frames), self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise DisconnectException("Spectator too slow! Dropping.")
+
+
+class Broadcast:
+    """
+    The history of a game in progress (as encoded messages), for
+    spectators to follow.
+    """
+
+    def __init__(self, game_id, channel, upper, lower):
+        self.game_id = game_id
+        self.channel = channel
+        self.upper = upper
+        self.lower = lower
+        self.header = encode(M.GAME, game=game_id, upper=upper, lower=lower)
+        self.frames = []
+        self.nturns = 0
+        self.is_over = False
+        # (set, and replaced, whenever there is a new frame)
+        self.changed = asyncio.Event()
+
+    def turn(self, nturns, upper_action, lower_action):
+        self.nturns = nturns
+        self._publish(
+            encode(M.SPEC, turn=nturns, upper=upper_action, lower=lower_action)
+        )
+
+    def over(self, result):
+        self._publish(encode(M.OVER, result=result))
+        self.is_over = True
+
+    def _publish(self, frame):
+        self.frames.append(frame)
+        self.changed.set()
+        self.changed = asyncio.Event()
@@ -0,0 +1,92 @@
+"""
+Tests for the server's admission control (run them with 'python -m unittest
+server.test_admission'), in particular that its default limits admit many
+clients sharing one address, as a class behind a campus NAT would.
+"""
+
+import unittest
+from unittest import mock
+
+from server.admission import Admission
+from server.__main__ import MAX_CONNECTIONS_PER_ADDRESS
+from server.__main__ import CONNECT_RATE, CONNECT_BURST
+from server.__main__ import TOTAL_CONNECT_RATE, TOTAL_CONNECT_BURST
+
+# (a campus NAT's address, and some other addresses)
+NAT = "203.0.113.7"
+OTHERS = [f"198.51.100.{i}" for i in range(1, 11)]
+
+# (the size of a class, connecting from behind the NAT)
+CLASS_SIZE = 300
+
+
+class AdmissionTest(unittest.TestCase):
+    def setUp(self):
+        # (control the clock the token buckets see)
+        self.now = 1000.0
+        patcher = mock.patch(
+            "server.admission.time.monotonic", lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.admission = Admission(
+            max_per_address=MAX_CONNECTIONS_PER_ADDRESS,
+            rate=CONNECT_RATE,
+            burst=CONNECT_BURST,
+            total_rate=TOTAL_CONNECT_RATE,
+            total_burst=TOTAL_CONNECT_BURST,
+            exempt={"127.0.0.1"},
+        )
+
+    def admit(self, address, n):
+        # (try to admit n connections from 'address' at once, and return
+        # how many were admitted)
+        return sum(self.admission.admit(address) is None for _ in range(n))
+
+    def test_class_behind_one_address_connects_at_once(self):
+        self.assertEqual(self.admit(NAT, CLASS_SIZE), CLASS_SIZE)
+
+    def test_class_behind_one_address_reconnects_between_games(self):
+        self.admit(NAT, CLASS_SIZE)
+        for _ in range(10):
+            # (every client hangs up after its game, and a few seconds
+            # later, connects again for another)
+            for _ in range(CLASS_SIZE):
+                self.admission.release(NAT)
+            self.now += CLASS_SIZE / CONNECT_RATE
+            self.assertEqual(self.admit(NAT, CLASS_SIZE), CLASS_SIZE)
+
+    def test_clients_behind_one_address_dont_limit_other_addresses(self):
+        self.admit(NAT, MAX_CONNECTIONS_PER_ADDRESS)
+        for address in OTHERS:
+            self.assertEqual(self.admit(address, 10), 10)
+
+    def test_open_connections_from_one_address_are_limited(self):
+        n = MAX_CONNECTIONS_PER_ADDRESS
+        while self.admit(NAT, 1):
+            self.now += 1  # (keeping within the rate limits)
+        self.assertEqual(
+            self.admission.admit(NAT),
+            "too many connections from your address",
+        )
+        self.assertEqual(self.admission._open[NAT], n)
+        self.admission.release(NAT)
+        self.assertEqual(self.admit(NAT, 1), 1)
+
+    def test_reconnect_loop_from_one_address_is_limited(self):
+        # (a client that hangs up and reconnects as fast as it can)
+        admitted = 0
+        for _ in range(10 * CONNECT_BURST):
+            if self.admission.admit(NAT) is None:
+                admitted += 1
+                self.admission.release(NAT)
+            self.now += 0.001
+        self.assertLess(admitted, 2 * CONNECT_BURST)
+
+    def test_exempt_addresses_are_not_limited(self):
+        n = MAX_CONNECTIONS_PER_ADDRESS + TOTAL_CONNECT_BURST
+        self.assertEqual(self.admit("127.0.0.1", n), n)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+"""
+Scheduled tournaments: in a tournament channel, rather than matching players
+as they arrive, the server plays a round-robin between all of the players
+who have registered there (by sending a PLAY message in the channel), so
+that every pair of them plays one game.
+
+Each player declares how many games they are available for (in the 'games'
+field of their PLAY message, or just the one by default), and can then stay
+connected while the server schedules their games (see battleground's
+--games option). A player's remaining work is the number of registered
+opponents they have yet to play (but at most the number of games they are
+still available for). Whenever there are game workers free, the scheduler
+pairs up the waiting players with the most remaining work first, each with
+the waiting opponent they have yet to play who has the most remaining work,
+so that the players with the longest schedules are never left idle, and
+the round-robin finishes as soon as it can.
+
+Registrations and results are appended to a results file for each channel
+(e.g. tournaments/finals.jsonl), and read back when the server restarts,
+so that a tournament carries on where it left off. Games that end in an
+error (e.g. a disconnection) are recorded, but will be played again. Print
+a tournament's standings from the command line, e.g.:
+
+    python -m server.tournament tournaments/finals.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from urllib.parse import quote
+
+
+class Tournaments:
+    """
+    A tournament in each of the tournament 'channels', with their results
+    files kept in 'directory'.
+    """
+
+    def __init__(self, channels, directory):
+        self.channels = frozenset(channels)
+        self.directory = directory
+        self._tournaments = {}  # channel -> Tournament (once there is one)
+
+    def plays(self, channel):
+        return channel in self.channels
+
+    def get(self, channel):
+        tournament = self._tournaments.get(channel)
+        if tournament is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, quote(channel, safe="") or "_")
+            tournament = self._tournaments[channel] = Tournament(
+                path + ".jsonl"
+            )
+        return tournament
+
+    def record(self, channel, upper, lower, result, started, ended):
+        """
+        Record the result of a game in the tournament in 'channel' (see
+        Tournament.record).
+        """
+        self.get(channel).record(upper, lower, result, started, ended)
+
+    def close(self):
+        for tournament in self._tournaments.values():
+            tournament.close()
+
+
+class Tournament:
+    """
+    A round-robin between the players (by name) registered in a channel,
+    with its results file at 'path' (read back, if it already exists).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.available = {}  # name -> games they are still available for
+        self.played = {}  # name -> set of opponents they have played
+        for entry in read_results(path):
+            if entry["event"] == "register":
+                self._register(entry["name"], 0)
+            elif counts(entry["result"]):
+                self._played(entry["upper"], entry["lower"])
+        self._file = open(path, "a", buffering=1)  # (one line at a time)
+
+    def register(self, name, games=None):
+        """
+        Register the player 'name' (if they are new), as available for
+        'games' more games (by default, one).
+        """
+        if not isinstance(games, int) or games < 1:
+            games = 1
+        if name not in self.played:
+            self._write(event="register", name=name, time=time.time())
+        self._register(name, games)
+
+    def remaining(self, name):
+        """
+        The number of games the player 'name' has left to play: one for
+        each registered opponent they have yet to play, but at most the
+        number they are available for.
+        """
+        opponents = len(self.played) - 1 - len(self.played[name])
+        return min(opponents, self.available[name])
+
+    def done(self, name):
+        """
+        Whether the player 'name' has no games left to play (for now): they
+        have played every other registered player (if there are any), or
+        they are available for no more games.
+        """
+        return len(self.played) > 1 and not self.remaining(name)
+
+    def pairings(self, players, limit):
+        """
+        Choose up to 'limit' games to play next between the waiting
+        (registered) 'players', and return them as a list of pairs (see
+        above). Players are otherwise taken in the order given.
+        """
+        # (most remaining work first; sorted is stable, so ties keep order)
+        order = sorted(players, key=lambda p: -self.remaining(p.name))
+        free = set(order)
+        pairs = []
+        for player in order:
+            if len(pairs) >= limit:
+                break
+            if player not in free or not self.remaining(player.name):
+                continue
+            free.remove(player)
+            opponent = next(
+                (
+                    p
+                    for p in order
+                    if p in free
+                    and p.name != player.name
+                    and p.name not in self.played[player.name]
+                ),
+                None,
+            )
+            if opponent is None:
+                free.add(player)
+                continue
+            free.remove(opponent)
+            pairs.append((player, opponent))
+        return pairs
+
+    def record(self, upper, lower, result, started, ended):
+        """
+        Record (and write out) the result of a game between the players
+        'upper' and 'lower' (a string as returned by referee.game.Game.end,
+        or a game error), played between Unix times 'started' and 'ended'.
+        """
+        self._write(
+            event="game",
+            upper=upper,
+            lower=lower,
+            result=result,
+            started=started,
+            ended=ended,
+        )
+        for name in (upper, lower):
+            if name in self.available:
+                self.available[name] = max(0, self.available[name] - 1)
+        if counts(result):
+            self._played(upper, lower)
+
+    def close(self):
+        self._file.close()
+
+    def _register(self, name, games):
+        self.played.setdefault(name, set())
+        self.available[name] = games
+
+    def _played(self, upper, lower):
+        for name in (upper, lower):
+            self.played.setdefault(name, set())
+            self.available.setdefault(name, 0)
+        self.played[upper].add(lower)
+        self.played[lower].add(upper)
+
+    def _write(self, **entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+
+def counts(result):
+    """
+    Whether a game with 'result' counts as played (that is, it ended in a
+    win or a draw, rather than an error).
+    """
+    return result.startswith(("winner:", "draw:"))
+
+
+# # #
+# Reading results
+#
+
+
+def read_results(path):
+    """
+    Return the entries (as dicts) in the results file at 'path', in order
+    (or none, if there is no such file yet).
+    """
+    try:
+        with open(path) as file:
+            # (skip a partial last line, if the server stopped mid-write)
+            return [json.loads(line) for line in file if line.endswith("\n")]
+    except FileNotFoundError:
+        return []
+
+
+def standings(entries):
+    """
+    Return the standings after the results 'entries' (see read_results): a
+    list of (name, played, won, drawn, lost, points) tuples, best first.
+    Wins are worth one point, and draws half a point.
+    """
+    records = {}  # name -> [played, won, drawn, lost]
+    for entry in entries:
+        if entry["event"] == "register":
+            records.setdefault(entry["name"], [0, 0, 0, 0])
+            continue
+        if not counts(entry["result"]):
+            continue
+        if entry["result"].startswith("winner: upper"):
+            outcomes = {entry["upper"]: 1, entry["lower"]: 3}
+        elif entry["result"].startswith("winner: lower"):
+            outcomes = {entry["upper"]: 3, entry["lower"]: 1}
+        else:
+            outcomes = {entry["upper"]: 2, entry["lower"]: 2}
+        for name, outcome in outcomes.items():
+            record = records.setdefault(name, [0, 0, 0, 0])
+            record[0] += 1
+            record[outcome] += 1
+    table = [
+        (name, played, won, drawn, lost, won + drawn / 2)
+        for name, (played, won, drawn, lost) in records.items()
+    ]
+    return sorted(table, key=lambda row: (-row[5], -row[2], row[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m server.tournament",
+        description="print the standings in a server's tournament.",
+    )
+    parser.add_argument("results", help="the tournament's results file.")
+    options = parser.parse_args()
+
+    entries = read_results(options.results)
+    table = standings(entries)
+    width = max((len(row[0]) for row in table), default=4)
+    print(f"{'':>4} {'name':<{width}}  played  won drawn lost  points")
+    for rank, (name, played, won, drawn, lost, points) in enumerate(table):
+        print(
+            f"{rank + 1:>3}. {name:<{width}}  {played:>6} {won:>4} "
+            f"{drawn:>5} {lost:>4} {points:>7.1f}"
+        )
+    # (and how much of the round-robin is left to play)
+    n = len(table)
+    games = sum(row[1] for row in table) // 2
+    print(
+        f"({games} of {n * (n - 1) // 2} games played by {n} players)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()